@@ -6,11 +6,22 @@
 #   app/api/routers/sync.py
 #
 #   Router to make full and delta syncs and show status of
-#   last sync or running sync job
+#   last sync or running sync job. When enabled in the sync.schedule config
+#   the SyncScheduler runs the delta syncs in the background, GET /sync/schedule
+#   shows when each resource runs next.
+#   Teamleader webhooks are received in POST /sync/webhook, the records are
+#   queued and synced by a background task. Entries that failed are drained
+#   again by a timer when their retry is due.
+#   POST /sync/{resource}/ids refreshes a list of records right away.
 #
-from fastapi import APIRouter, BackgroundTasks
+import hmac
+import threading
+from fastapi import APIRouter, BackgroundTasks, HTTPException
 from app.app import App as SyncApp
+from app.models.sync_ids_params import SyncIdsParams
 from app.models.sync_params import SyncParams
+from app.models.webhook_params import WebhookEvent
+from app.sync_scheduler import SyncScheduler
 
 
 router = APIRouter()
@@ -20,26 +31,105 @@ class Worker:
     def __init__(self):
         self.teamleader_running = False
         self.sync_app = SyncApp()
+        self.scheduler = SyncScheduler(
+            self.sync_app.resource_syncs(),
+            self.sync_app.schedule_conf,
+            busy=lambda: self.teamleader_running,
+            workers=self.sync_app.resource_workers,
+            resource_busy=self.sync_app.resource_busy
+        )
+        self.webhook_lock = threading.Lock()
+        self.webhook_pending = False
+        self.webhook_timer = None
 
     @property
     def app(self):
         return self.sync_app
 
-    def teamleader_job(self, full_sync):
+    def teamleader_job(self, full_sync, resume=False):
         self.teamleader_running = True
-        self.sync_app.teamleader_sync(full_sync)
-        self.teamleader_running = False
+        try:
+            self.sync_app.teamleader_sync(full_sync, resume)
+        finally:
+            self.teamleader_running = False
+
+    def webhook_job(self):
+        """ Drains the webhook queue. When a drain is already running it is
+        asked to check the queue again instead of starting a second one.
+        """
+        self.webhook_pending = True
+        while self.webhook_pending and self.webhook_lock.acquire(blocking=False):
+            try:
+                self.webhook_pending = False
+                self.sync_app.drain_webhook_queue()
+                self.schedule_webhook_retry()
+            finally:
+                self.webhook_lock.release()
+
+    def schedule_webhook_retry(self):
+        """ Drains the queue again when its next failed entry is due """
+        if self.webhook_timer:
+            self.webhook_timer.cancel()
+            self.webhook_timer = None
+
+        delay = self.sync_app.webhook_queue.next_attempt_in()
+        if delay is not None:
+            self.webhook_timer = threading.Timer(delay, self.webhook_job)
+            self.webhook_timer.daemon = True
+            self.webhook_timer.start()
+
+    async def teamleader_async_job(self, full_sync, resume=False):
+        self.teamleader_running = True
+        try:
+            await self.sync_app.teamleader_sync_async(full_sync, resume)
+        finally:
+            self.teamleader_running = False
 
 
 worker = Worker()
 
 
+@router.on_event("startup")
+def start_scheduler():
+    if worker.app.schedule_conf.get('enabled', False):
+        worker.scheduler.start()
+
+    # sync webhook events that were queued before a restart
+    threading.Thread(target=worker.webhook_job, daemon=True).start()
+
+
+@router.on_event("shutdown")
+def stop_scheduler():
+    worker.scheduler.stop()
+    if worker.webhook_timer:
+        worker.webhook_timer.cancel()
+
+
 @router.get("/oauth", include_in_schema=False)
 def auth_callback(code: str, state: str = ''):
     result = worker.app.auth_callback(code, state)
     return result
 
 
+@router.post("/webhook")
+def teamleader_webhook(
+    event: WebhookEvent,
+    background_tasks: BackgroundTasks,
+    token: str = ''
+):
+    secret = worker.app.webhook_secret
+    if not secret or not hmac.compare_digest(token, secret):
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+
+    resource = worker.app.webhook_event(event.type, event.subject.type, event.subject.id)
+    if resource is None:
+        return {"status": f"Ignored {event.type} event"}
+
+    background_tasks.add_task(worker.webhook_job)
+
+    return {"status": f"Queued {event.type} event", "resource": resource}
+
+
 @router.get("/teamleader")
 async def teamleader_sync_status():
     status = worker.app.teamleader_status()
@@ -54,12 +144,42 @@ async def start_teamleader_sync(
     params: SyncParams
 ):
     if not worker.teamleader_running:
-        background_tasks.add_task(worker.teamleader_job, params.full_sync)
+        if params.use_async:
+            # runs on the event loop, using the http/2 AsyncTeamleaderClient
+            background_tasks.add_task(
+                worker.teamleader_async_job, params.full_sync, params.resume)
+        else:
+            background_tasks.add_task(worker.teamleader_job, params.full_sync, params.resume)
         status = 'Teamleader sync started'
     else:
         status = 'Teamleader sync was already running'
 
     return {
         "status": status,
-        "full_sync": params.full_sync
+        "full_sync": params.full_sync,
+        "use_async": params.use_async,
+        "resume": params.resume
     }
+
+
+@router.post("/{resource}/ids")
+def refresh_ids(resource: str, params: SyncIdsParams):
+    if resource not in worker.app.sync_resources():
+        raise HTTPException(status_code=404, detail=f"Unknown resource {resource}")
+
+    result = worker.app.ids_sync(resource, params.ids)
+
+    return {
+        "resource": resource,
+        "requested": result['requested'],
+        "synced": result['synced'],
+        "failed_ids": result['failed_ids'],
+        "inserted": result['inserted'],
+        "updated": result['updated'],
+        "unchanged": result['unchanged']
+    }
+
+
+@router.get("/schedule")
+async def sync_schedule():
+    return worker.scheduler.status()
@@ -13,10 +13,19 @@
 #   this is instantiated
 #
 import argh
+import asyncio
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from psycopg2 import OperationalError as PSQLError
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
-from app.comm.teamleader_client import TeamleaderClient
+from app.comm.teamleader_client import TeamleaderClient, LIST_INCLUDES
+from app.comm.async_teamleader_client import AsyncTeamleaderClient
 from app.models.companies import Companies
 from app.models.contacts import Contacts
 from app.models.departments import Departments
@@ -25,21 +34,100 @@ from app.models.invoices import Invoices
 from app.models.projects import Projects
 from app.models.users import Users
 from app.models.custom_fields import CustomFields
+from app.models.sync_model import COPY_THRESHOLD
+from app.models.sync_state import SyncState, SYNC_FAILED
+from app.models.webhook_queue import WebhookQueue
+from app.sync_pipeline import (
+    SyncPipeline,
+    PIPELINE_QUEUE_SIZE,
+    WRITE_BATCH_RECORDS,
+    WRITE_BATCH_BYTES,
+    WRITE_BATCH_SECONDS
+)
 
 
 # Initialize the logger and the configuration
 config = ConfigParser()
 logger = logging.get_logger(__name__, config=config)
 
+# Entries requested per list call
+PAGE_SIZE = 100
+# Number of detail calls of a page that are fetched concurrently
+DETAIL_WORKERS = 1
+# Same for the asyncio sync, coroutines are cheap so we allow more in flight
+ASYNC_DETAIL_WORKERS = 10
+# List pages requested concurrently once the number of matches is known,
+# 1 lists page by page until an empty page is returned
+LIST_WORKERS = 1
+# Seconds subtracted from the delta watermark so entries modified while the
+# previous sync was running are not missed
+WATERMARK_OVERLAP = 300
+# Resource syncs run concurrently by teamleader_sync, 1 syncs them one by one
+RESOURCE_WORKERS = 1
+# Stored uuids compared per query when reconciling deleted records
+RECONCILE_BATCH_SIZE = 10000
+# Teamleader webhook subject types and the resources they update
+WEBHOOK_RESOURCES = {
+    'company': 'companies',
+    'contact': 'contacts',
+    'invoice': 'invoices',
+    'project': 'projects',
+}
+# Queued webhook records synced per batch
+WEBHOOK_BATCH_SIZE = 100
+# Event type of the records queued because their details call failed in a sync
+SYNC_FAILED_EVENT = 'sync.failed'
+
 
 class App:
 
     def __init__(self):
+        # held while a resource is synced, see resource_lock
+        self.resource_locks = defaultdict(threading.Lock)
+        self.resource_locks_guard = threading.Lock()
+        self.init_sync_config()
         self.init_teamleader_client()
         self.init_database_models()
 
+    def init_sync_config(self):
+        sync_conf = config.app_cfg.get('sync') or {}
+        self.detail_workers = sync_conf.get('detail_workers', DETAIL_WORKERS)
+        self.async_detail_workers = sync_conf.get(
+            'async_detail_workers', ASYNC_DETAIL_WORKERS)
+        # resources synced with list calls only (sideloading custom fields)
+        self.list_only = sync_conf.get('list_only') or []
+        # skip details calls for listed entries that did not change
+        self.skip_unchanged = sync_conf.get('skip_unchanged', True)
+        # pages queued between the list, details and write stages of a sync
+        self.pipeline_lookahead = sync_conf.get('pipeline_lookahead', PIPELINE_QUEUE_SIZE)
+        # a write batch is flushed at this many records, json bytes or seconds
+        self.write_batch_records = sync_conf.get('write_batch_records', WRITE_BATCH_RECORDS)
+        self.write_batch_bytes = sync_conf.get('write_batch_bytes', WRITE_BATCH_BYTES)
+        self.write_batch_seconds = sync_conf.get('write_batch_seconds', WRITE_BATCH_SECONDS)
+        # batches of at least this many records are loaded with COPY, 0 disables it
+        self.copy_threshold = sync_conf.get('copy_threshold', COPY_THRESHOLD)
+        self.list_workers = sync_conf.get('list_workers', LIST_WORKERS)
+        self.watermark_overlap = sync_conf.get('watermark_overlap', WATERMARK_OVERLAP)
+        # full syncs load a shadow table that is swapped in when complete,
+        # False truncates the table before loading it instead
+        self.shadow_full_sync = sync_conf.get('shadow_full_sync', True)
+        # reconcile marks records deleted in Teamleader with tl_deleted_at
+        # instead of deleting the rows
+        self.soft_delete = sync_conf.get('soft_delete', False)
+        # adaptive delta sync schedule run by the api, see SyncScheduler
+        self.schedule_conf = sync_conf.get('schedule') or {}
+        # shared secret passed as token in the webhook url, webhooks are
+        # refused when it is not configured
+        self.webhook_secret = sync_conf.get('webhook_secret')
+        self.resource_workers = sync_conf.get('resource_workers', RESOURCE_WORKERS)
+        # resources listed here are started first by teamleader_sync
+        self.resource_priority = sync_conf.get('resource_priority') or []
+        # multiplies detail_workers per resource, ex: {'contacts': 4}
+        self.resource_weights = sync_conf.get('resource_weights') or {}
+
     def init_teamleader_client(self):
         self.tlc = TeamleaderClient(config.app_cfg)
+        self.atlc = AsyncTeamleaderClient(self.tlc)
 
     def init_database_models(self):
         db_conf = config.app_cfg['postgresql_teamleader']
@@ -53,134 +141,955 @@ class App:
         self.projects = Projects(db_conf, table_names)
         self.users = Users(db_conf, table_names)
         self.custom_fields = CustomFields(db_conf, table_names)
+        for _, _, model in self.sync_resources().values():
+            model.copy_threshold = self.copy_threshold
+        self.sync_state = SyncState(db_conf, table_names)
+        self.webhook_queue = WebhookQueue(db_conf, table_names)
 
     def auth_callback(self, code, state):
         return self.tlc.authcode_callback(code, state)
 
-    def resource_sync(self, list_call, details_call, model, full_sync=False):
-        if full_sync:
-            model.truncate_table()
+    def sync_calls(self, details_call, model):
+        """ For resources configured in list_only whose list call can sideload
+        the data of the details call (see LIST_INCLUDES) we only use the list call.
+        Other resources fall back to a details call for each listed record.
+        Returns the details call (None in list only mode) and the list includes.
+        """
+        if model.name not in self.list_only:
+            return details_call, None
+
+        if model.name not in LIST_INCLUDES:
+            logger.warning(
+                f"{model.name} has no list includes, falling back to details calls")
+            return details_call, None
+
+        return None, LIST_INCLUDES[model.name]
 
+    def sync_watermark(self, model):
+        """ Teamleader updated_at of the most recently modified synced entry, at
+        most the start of the last completed sync, minus the safety overlap.
+        None when nothing is synced yet or the resource has no updated_at, in
+        that case everything is listed.
+        """
         modified_since = model.max_last_modified_timestamp()
+        state = self.sync_state.read(model.name)
+        if modified_since and state and state['watermark_cap']:
+            # changes made while the last sync ran (ex: the live rows replaced
+            # by a shadow table swap) are listed again
+            modified_since = min(modified_since, state['watermark_cap'])
+        if modified_since:
+            modified_since -= timedelta(seconds=self.watermark_overlap)
+
+        return modified_since
+
+    @contextmanager
+    def resource_lock(self, name):
+        """ Serializes the writes of a resource: the scheduled and manual syncs,
+        ids_sync and the webhook drain of the same resource wait for each other
+        instead of loading the same table (or shadow table) at the same time.
+        """
+        with self.resource_mutex(name):
+            yield
+
+    def resource_mutex(self, name):
+        with self.resource_locks_guard:
+            return self.resource_locks[name]
+
+    def resource_busy(self, name):
+        """ True while a sync of the resource holds its resource_lock """
+        return self.resource_mutex(name).locked()
+
+    def resource_detail_workers(self, model):
+        """ Detail workers for a resource, scaled by its weight so the large
+        resources get a bigger share of the shared rate limit budget.
+        """
+        weight = self.resource_weights.get(model.name, 1)
+        return max(1, int(self.detail_workers * weight))
+
+    @staticmethod
+    def request_list(list_call, page, modified_since, includes=None):
+        if includes:
+            return list_call(page, PAGE_SIZE, modified_since, includes=includes)
+
+        return list_call(page, PAGE_SIZE, modified_since)
+
+    def fetch_details(self, details_call, resp, executor=None):
+        """ Fetches the details of a listed page. With an executor the detail calls
+        are fanned out over its workers (all sharing the client rate limiter).
+        Returns the detailed entries in listing order and the ids that failed.
+        """
+        ids = [res['id'] for res in resp]
+        if executor:
+            pending = [executor.submit(details_call, uid) for uid in ids]
+        else:
+            pending = [None] * len(ids)
+
+        detailed_list = []
+        failed_ids = []
+        for uid, future in zip(ids, pending):
+            print('.', end='', flush=True)
+            try:
+                detail = future.result() if future else details_call(uid)
+            except Exception as e:
+                logger.error(f"details call for {uid} failed: {e}")
+                detail = None
+
+            if detail:
+                detailed_list.append(detail)
+            else:
+                failed_ids.append(uid)
+
+        return detailed_list, failed_ids
+
+    def changed_entries(self, model, resp, versions):
+        """ Listed entries that are new or whose list version differs from the
+        one stored with the last upsert. Only these need a details call.
+        """
+        if not self.skip_unchanged:
+            return resp
+
+        stored = model.stored_list_versions(list(versions.keys()))
+        return [res for res in resp if stored.get(str(res['id'])) != versions[str(res['id'])]]
+
+    def list_pages(self, list_call, modified_since, lookahead=0, includes=None, start_page=1):
+        """ Yields the listed pages, starting at start_page, until an empty page is
+        returned. With a lookahead the next pages are already requested in a
+        background thread while the caller is still processing the current page.
+        """
+        if self.list_workers > 1:
+            yield from self.list_pages_fan_out(
+                list_call, modified_since, lookahead, includes, start_page)
+            return
+
+        if lookahead < 1:
+            page = start_page
+            resp = self.request_list(list_call, page, modified_since, includes)
+            while len(resp) > 0:
+                yield resp
+                page += 1
+                resp = self.request_list(list_call, page, modified_since, includes)
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            pending = deque([
+                prefetcher.submit(self.request_list, list_call, start_page, modified_since, includes)
+            ])
+            next_page = start_page + 1
+            try:
+                while True:
+                    resp = pending.popleft().result()
+                    if len(resp) == 0:
+                        return
+
+                    while len(pending) < lookahead:
+                        pending.append(prefetcher.submit(
+                            self.request_list, list_call, next_page, modified_since, includes))
+                        next_page += 1
+
+                    yield resp
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def list_pages_fan_out(self, list_call, modified_since, lookahead=0, includes=None, start_page=1):
+        """ Requests the first page with includes=pagination to learn the number
+        of matches, then requests the remaining pages with list_workers threads.
+        Pages are yielded in order and at most list_workers + lookahead pages are
+        held in memory. There is no trailing request for an empty page.
+        """
+        first_includes = ','.join(filter(None, [includes, 'pagination']))
+        resp = self.request_list(list_call, start_page, modified_since, first_includes)
+        if len(resp) == 0:
+            return
+
+        matches = getattr(resp, 'matches', None)
+        if matches is None:
+            # no pagination metadata (ex: departments), continue page by page
+            page = start_page
+            while len(resp) > 0:
+                yield resp
+                page += 1
+                resp = self.request_list(list_call, page, modified_since, includes)
+            return
+
+        last_page = math.ceil(matches / PAGE_SIZE)
+        window = self.list_workers + lookahead
+        with ThreadPoolExecutor(max_workers=self.list_workers) as pool:
+            pending = deque()
+            next_page = start_page + 1
+            try:
+                while True:
+                    while next_page <= last_page and len(pending) < window:
+                        pending.append(pool.submit(
+                            self.request_list, list_call, next_page, modified_since, includes))
+                        next_page += 1
+
+                    yield resp
+
+                    if not pending:
+                        return
+
+                    resp = pending.popleft().result()
+                    if len(resp) == 0:
+                        # fewer matches than announced, records changed while listing
+                        return
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def fetch_page(self, model, details_call, resp, executor=None):
+        """ Fetches the details of the new or changed entries of a listed page
+        (or takes the list data as is in list only mode).
+        Returns the entries to upsert, their list versions and the page result.
+        """
+        versions = {str(res['id']): model.list_version(res) for res in resp}
+        if details_call:
+            changed = self.changed_entries(model, resp, versions)
+            detailed_list, failed_ids = self.fetch_details(details_call, changed, executor)
+        else:
+            changed = detailed_list = resp
+            failed_ids = []
+
+        page_result = {
+            'synced': len(detailed_list),
+            'skipped': len(resp) - len(changed),
+            'failed_ids': failed_ids
+        }
+
+        return detailed_list, versions, page_result
+
+    def write_page(self, model, detailed_list, versions, page=None, page_ids=None):
+        """ Upserts the entries of a page, returns the inserted, updated and
+        unchanged counts. The checkpoint holds page_ids, by default the listed
+        ids in versions. """
+        counts = {}
+        if detailed_list:
+            counts = model.upsert_results([(detailed_list, model.name)], versions)
+
+        if page is not None:
+            # checkpoint once the page is committed, a resumed sync continues after it
+            if page_ids is None:
+                page_ids = list(versions.keys())
+            self.sync_state.checkpoint(model.name, page, page_ids)
+
+        return counts
+
+    @staticmethod
+    def sync_result():
+        return {
+            'synced': 0, 'skipped': 0, 'failed_ids': [],
+            'inserted': 0, 'updated': 0, 'unchanged': 0
+        }
+
+    @staticmethod
+    def add_page_result(result, page_result):
+        result['synced'] += page_result['synced']
+        result['skipped'] += page_result['skipped']
+        result['failed_ids'].extend(page_result['failed_ids'])
+
+    @staticmethod
+    def add_write_result(result, counts):
+        for key in ('inserted', 'updated', 'unchanged'):
+            result[key] += counts.get(key, 0)
+
+    def log_sync_result(self, model, result):
+        if result['failed_ids']:
+            logger.error(
+                f"{model.name} details failed for {len(result['failed_ids'])} ids: {result['failed_ids']}")
+
+        logger.info(
+            f"Done, synchronized {result['synced']} {model.name}, {result['skipped']} unchanged, "
+            f"written {result['inserted']} inserted, {result['updated']} updated, "
+            f"{result['unchanged']} identical")
+
+    def resume_page(self, model, state, relist=None):
+        """ First page to list when resuming the sync of state. The checkpointed
+        page is listed again with relist(page, watermark) and compared with its
+        ids. When records were added or removed in front of it the pages shifted,
+        the sync then continues one page early (the repeated records are
+        upserted again, which changes nothing). When the page has none of the
+        checkpointed ids anymore the shift is too large and None is returned,
+        the sync has to start over.
+        """
+        last_page = state['last_page']
+        last_ids = state.get('last_ids') or []
+        if relist is None or last_page < 1 or not last_ids:
+            return last_page + 1
+
+        listed_ids = {str(res['id']) for res in relist(last_page, state['watermark'])}
+        if listed_ids == set(last_ids):
+            return last_page + 1
+
+        if listed_ids & set(last_ids):
+            logger.warning(
+                f"{model.name} page {last_page} changed since the checkpoint, "
+                f"resuming from that page.")
+            return last_page
+
+        logger.warning(
+            f"{model.name} page {last_page} no longer holds the checkpointed records, "
+            f"starting the synchronization over.")
+        return None
+
+    def start_sync(self, model, full_sync=False, resume=False, relist=None):
+        """ Starts a new sync of model or, with resume, continues the last one when
+        it did not complete. A resumed sync keeps its mode and watermark and does
+        not truncate or recreate the table again. With relist(page, watermark)
+        the checkpointed page is verified first, see resume_page.
+        In shadow_full_sync mode a full sync is loaded into the shadow table
+        of the model, which is swapped in by finish_sync.
+        Returns the model to write to, the watermark and the first page to list.
+        """
+        state = self.sync_state.resumable(model.name) if resume else None
+        if state:
+            target = model
+            if state['full_sync'] and self.shadow_full_sync:
+                target = model.shadow_model()
+                if not target.table_exists():
+                    logger.warning(
+                        f"{model.name} shadow table is missing, not resuming full synchronization.")
+                    state = None
+
+        if state:
+            start_page = self.resume_page(model, state, relist)
+            if start_page is None:
+                # start over in the mode of the interrupted sync
+                full_sync = state['full_sync']
+                state = None
+
+        if state:
+            modified_since = state['watermark']
+            mode = 'full' if state['full_sync'] else 'delta'
+            logger.info(
+                f"{model.name} resuming {mode} synchronization at page {start_page}.")
+            return target, modified_since, start_page
+
+        target = model
+        if full_sync:
+            if self.shadow_full_sync:
+                model.create_shadow_table()
+                target = model.shadow_model()
+            else:
+                model.truncate_table()
+
+        # the emptied table or shadow table of a full sync has no watermark
+        modified_since = None if full_sync else self.sync_watermark(target)
+        self.sync_state.start(model.name, full_sync, modified_since)
         if modified_since:
             logger.info(
                 f"{model.name} delta since {modified_since.isoformat()} started.")
         else:
             logger.info(f"{model.name} full synchronization started.")
 
-        page = 1
-        resp = [1]
-        total_synced = 0
-        while len(resp) > 0:
-            resp = list_call(page, 100, modified_since)
-            if len(resp) > 0:
-                detailed_list = []
-                for res in resp:
-                    print('.', end='', flush=True)
-                    detailed_list.append(details_call(res['id']))
-                model.upsert_results([(detailed_list, model.name)])
-                page += 1
-                total_synced += len(resp)
-                print(f"\n{model.name} synced {len(resp)} records", flush=True)
+        return target, modified_since, 1
+
+    def finish_sync(self, model, target):
+        """ Swaps in the shadow table loaded by a full sync and marks the sync completed """
+        if target is not model:
+            model.swap_shadow_table()
+            logger.info(f"{model.name} full synchronization swapped in.")
+
+        self.sync_state.finish(model.name)
+
+    def sync_pipeline(self):
+        return SyncPipeline(
+            self.pipeline_lookahead,
+            self.write_batch_records,
+            self.write_batch_bytes,
+            self.write_batch_seconds
+        )
+
+    def resource_sync(self, list_call, details_call, model, full_sync=False, resume=False):
+        """ Lists the pages of a resource, fetches the details of the changed
+        entries and writes them. A resource is synced by one caller at a time,
+        a second sync of it waits for the running one, see resource_lock.
+        """
+        with self.resource_lock(model.name):
+            details_call, includes = self.sync_calls(details_call, model)
+
+            def relist(page, since):
+                return self.request_list(list_call, page, since, includes)
+
+            target, modified_since, start_page = self.start_sync(
+                model, full_sync, resume, relist)
+
+            executor = None
+            detail_workers = self.resource_detail_workers(model)
+            if details_call and detail_workers > 1:
+                executor = ThreadPoolExecutor(max_workers=detail_workers)
+
+            result = self.sync_result()
+
+            def fetch(resp):
+                detailed_list, versions, page_result = self.fetch_page(
+                    target, details_call, resp, executor)
+                self.add_page_result(result, page_result)
+                print(
+                    f"\n{model.name} synced {page_result['synced']} records, "
+                    f"{page_result['skipped']} unchanged",
+                    flush=True
+                )
+                return detailed_list, versions
+
+            # ids of each listed page, a batch is checkpointed with the ids of
+            # its last page so a resume can verify that page
+            page_ids = {}
+            written = [start_page - 1]
+
+            def listed(pages):
+                for page, resp in pages:
+                    page_ids[page] = [str(res['id']) for res in resp]
+                    yield page, resp
+
+            def write(detailed_list, versions, page):
+                for done in range(written[0] + 1, page):
+                    page_ids.pop(done, None)
+                written[0] = page
+                self.add_write_result(
+                    result, self.write_page(
+                        target, detailed_list, versions, page, page_ids.pop(page, None)))
 
-        logger.info(f"Done, synchronized {total_synced} {model.name}")
+            pages = listed(enumerate(
+                self.list_pages(list_call, modified_since, 0, includes, start_page), start_page))
+            try:
+                if self.pipeline_lookahead > 0:
+                    # listing, details and writes run in their own stage
+                    self.sync_pipeline().run(pages, fetch, write)
+                else:
+                    for page, resp in pages:
+                        write(*fetch(resp), page)
 
-    def companies_sync(self, full_sync=False):
+                self.finish_sync(model, target)
+            except Exception:
+                self.sync_state.finish(model.name, SYNC_FAILED)
+                raise
+            finally:
+                if executor:
+                    executor.shutdown()
+                self.queue_failed_ids(model, result['failed_ids'])
+
+            self.log_sync_result(model, result)
+
+        if result['failed_ids']:
+            self.drain_webhook_queue(resources=[model.name])
+
+        return result
+
+    def queue_failed_ids(self, model, failed_ids):
+        """ Puts the records whose details call failed in the webhook queue, the
+        watermark of the next delta sync is already past them. drain_webhook_queue
+        retries them with a backoff until they are written.
+        """
+        for uid in failed_ids:
+            self.webhook_queue.enqueue(model.name, uid, SYNC_FAILED_EVENT)
+
+    def resource_reconcile(self, list_call, model, soft_delete=None):
+        """ Removes the records that were deleted in Teamleader. Only the list
+        calls are used to collect the ids that still exist. The stored uuids are
+        compared with them batch by batch and the missing ones are deleted (or
+        soft deleted). Records written after the listing started are kept.
+        """
+        if soft_delete is None:
+            soft_delete = self.soft_delete
+
+        logger.info(f"{model.name} reconciliation started.")
+        started = datetime.now(timezone.utc)
+        listed_ids = set()
+        for resp in self.list_pages(list_call, None, self.pipeline_lookahead):
+            listed_ids.update(str(res['id']) for res in resp)
+
+        result = {'listed': len(listed_ids), 'deleted': 0}
+        if not listed_ids:
+            # never wipe a table because of an empty list response
+            logger.warning(f"{model.name} list is empty, nothing is deleted.")
+            return result
+
+        for uuids in model.stored_uuids(RECONCILE_BATCH_SIZE, started):
+            missing = [uid for uid in uuids if uid not in listed_ids]
+            result['deleted'] += model.delete_uuids(missing, soft_delete)
+
+        logger.info(
+            f"Done, reconciled {result['listed']} {model.name}, "
+            f"{'soft ' if soft_delete else ''}deleted {result['deleted']}")
+
+        return result
+
+    def sync_resources(self):
+        """ List call, details call and model of each resource """
+        return {
+            'companies': (self.tlc.list_companies, self.tlc.get_company, self.companies),
+            'contacts': (self.tlc.list_contacts, self.tlc.get_contact, self.contacts),
+            'custom_fields': (self.tlc.list_custom_fields, self.tlc.get_custom_field, self.custom_fields),
+            'departments': (self.tlc.list_departments, self.tlc.get_department, self.departments),
+            'events': (self.tlc.list_events, self.tlc.get_event, self.events),
+            'invoices': (self.tlc.list_invoices, self.tlc.get_invoice, self.invoices),
+            'projects': (self.tlc.list_projects, self.tlc.get_project, self.projects),
+            'users': (self.tlc.list_users, self.tlc.get_user, self.users),
+        }
+
+    def ids_list_call(self, resource):
+        """ List call filtered on ids, only used for the list only resources
+        whose list call holds the same data as the details call """
+        calls = {
+            'companies': self.tlc.list_companies_by_ids,
+            'contacts': self.tlc.list_contacts_by_ids,
+        }
+        return calls.get(resource)
+
+    def fetch_ids(self, resource, ids, executor=None):
+        """ Fetches records of a resource by id. List only resources use the list
+        call filtered on the ids, so they store the same payload as their sync,
+        the others the details call of each id. Returns the records and the ids
+        that could not be fetched.
+        """
+        _, details_call, model = self.sync_resources()[resource]
+        details_call, includes = self.sync_calls(details_call, model)
+        if details_call is None:
+            detailed_list = list(self.ids_list_call(resource)(ids, includes=includes))
+            found = {str(res['id']) for res in detailed_list}
+            return detailed_list, [uid for uid in ids if uid not in found]
+
+        return self.fetch_details(details_call, [{'id': uid} for uid in ids], executor)
+
+    def ids_sync(self, resource, ids):
+        """ Refreshes specific records of a resource. The ids are fetched in
+        batches of PAGE_SIZE with fetch_ids and upserted as in a regular sync.
+        """
+        resources = self.sync_resources()
+        if resource not in resources:
+            raise ValueError(f"unknown resource {resource}, use one of {', '.join(resources)}")
+
+        model = resources[resource][2]
+        ids = list(dict.fromkeys(str(uid) for uid in ids))
+        result = self.sync_result()
+        result['requested'] = len(ids)
+        executor = None
+        workers = self.resource_detail_workers(model)
+        if workers > 1:
+            executor = ThreadPoolExecutor(max_workers=workers)
+
+        try:
+            with self.resource_lock(resource):
+                for start in range(0, len(ids), PAGE_SIZE):
+                    detailed_list, failed_ids = self.fetch_ids(
+                        resource, ids[start:start + PAGE_SIZE], executor)
+                    if detailed_list:
+                        self.add_write_result(
+                            result, model.upsert_results([(detailed_list, model.name)]))
+                    result['synced'] += len(detailed_list)
+                    result['failed_ids'].extend(failed_ids)
+        finally:
+            if executor:
+                executor.shutdown()
+
+        self.log_sync_result(model, result)
+
+        return result
+
+    def refresh_ids(self, resource, *ids):
+        """ Refreshes the given records of a resource (ex: contacts) without
+        syncing the whole resource
+
+            Arguments:
+            resource -- companies, contacts, custom_fields, departments,
+                        events, invoices, projects or users
+            ids -- uuids of the records to fetch again
+        """
+        return self.ids_sync(resource, ids)
+
+    def webhook_event(self, event_type, subject_type, subject_id):
+        """ Queues the record of a Teamleader webhook event (ex: contact.updated)
+        to be synced by drain_webhook_queue. Returns the resource or None when
+        the subject is not a resource we sync.
+        """
+        resource = WEBHOOK_RESOURCES.get(subject_type)
+        if resource is None:
+            return None
+
+        deleted = event_type.endswith('.deleted')
+        self.webhook_queue.enqueue(resource, subject_id, event_type, deleted)
+
+        return resource
+
+    def drain_webhook_queue(self, batch_size=WEBHOOK_BATCH_SIZE, resources=None):
+        """ Syncs the queued webhook records in batches until no entry is due,
+        only the entries of the given resource names when resources is set.
+        Updated records are fetched with fetch_ids and upserted, deleted records
+        are deleted (or soft deleted). Entries are only removed from the queue
+        once their record is written, the ones that could not be fetched stay
+        queued and are retried after a backoff.
+        """
+        sync_resources = self.sync_resources()
+        result = {'synced': 0, 'deleted': 0, 'failed_ids': []}
+        executor = None
+        if self.detail_workers > 1:
+            executor = ThreadPoolExecutor(max_workers=self.detail_workers)
+
+        try:
+            entries = self.webhook_queue.peek(batch_size, resources)
+            while entries:
+                failed = []
+                for resource, (_, _, model) in sync_resources.items():
+                    batch = [entry for entry in entries if entry[0] == resource]
+                    if not batch:
+                        continue
+
+                    deleted_ids = [entry[1] for entry in batch if entry[2]]
+                    updated = [entry[1] for entry in batch if not entry[2]]
+                    with self.resource_lock(resource):
+                        if deleted_ids:
+                            result['deleted'] += model.delete_uuids(deleted_ids, self.soft_delete)
+                        if updated:
+                            detailed_list, failed_ids = self.fetch_ids(resource, updated, executor)
+                            if detailed_list:
+                                model.upsert_results([(detailed_list, model.name)])
+                            result['synced'] += len(detailed_list)
+                            result['failed_ids'].extend(failed_ids)
+                            failed_ids = set(failed_ids)
+                            failed.extend(
+                                entry for entry in batch if not entry[2] and entry[1] in failed_ids)
+
+                self.webhook_queue.ack([entry for entry in entries if entry not in failed])
+                self.webhook_queue.retry(failed)
+                entries = self.webhook_queue.peek(batch_size, resources)
+        finally:
+            if executor:
+                executor.shutdown()
+
+        if result['synced'] or result['deleted'] or result['failed_ids']:
+            logger.info(
+                f"Webhook queue synced {result['synced']} records, deleted {result['deleted']}, "
+                f"failed {len(result['failed_ids'])}")
+
+        return result
+
+    async def fetch_details_async(self, details_call, resp, semaphore):
+        """ Async version of fetch_details, at most semaphore width detail calls
+        are in flight at the same time.
+        """
+        async def fetch(uid):
+            async with semaphore:
+                return await details_call(uid)
+
+        ids = [res['id'] for res in resp]
+        results = await asyncio.gather(
+            *[fetch(uid) for uid in ids],
+            return_exceptions=True
+        )
+
+        detailed_list = []
+        failed_ids = []
+        for uid, detail in zip(ids, results):
+            if isinstance(detail, Exception):
+                logger.error(f"details call for {uid} failed: {detail}")
+                detail = None
+
+            if detail:
+                detailed_list.append(detail)
+            else:
+                failed_ids.append(uid)
+
+        return detailed_list, failed_ids
+
+    async def sync_page_async(self, model, details_call, resp, semaphore, page=None):
+        """ Async version of fetch_page and write_page """
+        loop = asyncio.get_event_loop()
+        versions = {str(res['id']): model.list_version(res) for res in resp}
+        if details_call:
+            changed = await loop.run_in_executor(
+                None, self.changed_entries, model, resp, versions)
+            detailed_list, failed_ids = await self.fetch_details_async(
+                details_call, changed, semaphore)
+        else:
+            changed = detailed_list = resp
+            failed_ids = []
+
+        counts = await loop.run_in_executor(
+            None, self.write_page, model, detailed_list, versions, page)
+
+        return {
+            'synced': len(detailed_list),
+            'skipped': len(resp) - len(changed),
+            'failed_ids': failed_ids,
+            'counts': counts
+        }
+
+    async def resource_sync_async(self, list_call, details_call, model, full_sync=False, resume=False):
+        """ Same as resource_sync but with coroutines of the AsyncTeamleaderClient.
+        The blocking database calls are run in the default executor so the
+        event loop stays responsive.
+        """
+        loop = asyncio.get_event_loop()
+        # waits for a running sync of the resource without blocking the loop
+        lock = self.resource_mutex(model.name)
+        await loop.run_in_executor(None, lock.acquire)
+        try:
+            details_call, includes = self.sync_calls(details_call, model)
+
+            def relist(page, since):
+                # called from the executor thread, the listing runs on the loop
+                return asyncio.run_coroutine_threadsafe(
+                    self.request_list(list_call, page, since, includes), loop).result()
+
+            target, modified_since, page = await loop.run_in_executor(
+                None, self.start_sync, model, full_sync, resume, relist)
+
+            semaphore = asyncio.Semaphore(self.async_detail_workers)
+            resp = [1]
+            result = self.sync_result()
+            try:
+                while len(resp) > 0:
+                    resp = await self.request_list(list_call, page, modified_since, includes)
+                    if len(resp) > 0:
+                        page_result = await self.sync_page_async(
+                            target, details_call, resp, semaphore, page)
+                        self.add_page_result(result, page_result)
+                        self.add_write_result(result, page_result['counts'])
+                        page += 1
+                        logger.info(
+                            f"{model.name} synced {page_result['synced']} records, "
+                            f"{page_result['skipped']} unchanged")
+
+                await loop.run_in_executor(None, self.finish_sync, model, target)
+            except Exception:
+                await loop.run_in_executor(None, self.sync_state.finish, model.name, SYNC_FAILED)
+                raise
+            finally:
+                await loop.run_in_executor(
+                    None, self.queue_failed_ids, model, result['failed_ids'])
+            self.log_sync_result(model, result)
+        finally:
+            lock.release()
+
+        if result['failed_ids']:
+            await loop.run_in_executor(
+                None, lambda: self.drain_webhook_queue(resources=[model.name]))
+
+        return result
+
+    def companies_sync(self, full_sync=False, resume=False):
         """ Syncs teamleader companies into target database
 
             Arguments:
             modified_since -- Filters teamleader results with updated_since
                               If None, it will retrieve all teamleader companies.
+            resume -- continues the last companies sync when it did not complete
         """
-        self.resource_sync(self.tlc.list_companies, self.tlc.get_company,
-                           self.companies, full_sync)
+        return self.resource_sync(self.tlc.list_companies, self.tlc.get_company,
+                                  self.companies, full_sync, resume)
 
-    def contacts_sync(self, full_sync=False):
+    def contacts_sync(self, full_sync=False, resume=False):
         """ Syncs teamleader contacts into target database
 
             Arguments:
             modified_since -- Filters teamleader results with updated_since
                               If None, it will retrieve all teamleader contacts.
+            resume -- continues the last contacts sync when it did not complete
         """
-        self.resource_sync(self.tlc.list_contacts, self.tlc.get_contact,
-                           self.contacts, full_sync)
+        return self.resource_sync(self.tlc.list_contacts, self.tlc.get_contact,
+                                  self.contacts, full_sync, resume)
 
-    def custom_fields_sync(self, full_sync=False):
+    def custom_fields_sync(self, full_sync=False, resume=False):
         """ Syncs teamleader custom_fields into target database
 
             Arguments:
             modified_since -- Filters teamleader results with updated_since
                               If None, it will retrieve all teamleader custom_fields.
+            resume -- continues the last custom_fields sync when it did not complete
         """
-        self.resource_sync(self.tlc.list_custom_fields, self.tlc.get_custom_field,
-                           self.custom_fields, full_sync)
+        return self.resource_sync(self.tlc.list_custom_fields, self.tlc.get_custom_field,
+                                  self.custom_fields, full_sync, resume)
 
-    def departments_sync(self, full_sync=False):
+    def departments_sync(self, full_sync=False, resume=False):
         """ Syncs teamleader departments into target database
 
             Arguments:
             modified_since -- Filters teamleader results with updated_since
                               If None, it will retrieve all teamleader departments.
+            resume -- continues the last departments sync when it did not complete
         """
-        self.resource_sync(self.tlc.list_departments, self.tlc.get_department,
-                           self.departments, full_sync)
+        return self.resource_sync(self.tlc.list_departments, self.tlc.get_department,
+                                  self.departments, full_sync, resume)
 
-    def events_sync(self, full_sync=False):
+    def events_sync(self, full_sync=False, resume=False):
         """ Syncs teamleader events into target database
 
             Arguments:
             modified_since -- Filters teamleader results with updated_since
                               If None, it will retrieve all teamleader events.
+            resume -- continues the last events sync when it did not complete
         """
-        self.resource_sync(self.tlc.list_events, self.tlc.get_event,
-                           self.events, full_sync)
+        return self.resource_sync(self.tlc.list_events, self.tlc.get_event,
+                                  self.events, full_sync, resume)
 
-    def invoices_sync(self, full_sync=False):
+    def invoices_sync(self, full_sync=False, resume=False):
         """ Syncs teamleader invoices into target database
 
             Arguments:
             modified_since -- Filters teamleader results with updated_since
                               If None, it will retrieve all teamleader invoices.
+            resume -- continues the last invoices sync when it did not complete
         """
-        self.resource_sync(self.tlc.list_invoices, self.tlc.get_invoice,
-                           self.invoices, full_sync)
+        return self.resource_sync(self.tlc.list_invoices, self.tlc.get_invoice,
+                                  self.invoices, full_sync, resume)
 
-    def projects_sync(self, full_sync=False):
+    def projects_sync(self, full_sync=False, resume=False):
         """ Syncs teamleader projects into target database
 
             Arguments:
             modified_since -- Filters teamleader projects with updated_since
                               If None, it will retrieve all teamleader projects.
+            resume -- continues the last projects sync when it did not complete
         """
-        self.resource_sync(self.tlc.list_projects, self.tlc.get_project,
-                           self.projects, full_sync)
+        return self.resource_sync(self.tlc.list_projects, self.tlc.get_project,
+                                  self.projects, full_sync, resume)
 
-    def users_sync(self, full_sync=False):
+    def users_sync(self, full_sync=False, resume=False):
         """ Syncs teamleader users into target database
 
             Arguments:
             modified_since -- Filters teamleader users with updated_since
                               If None, it will retrieve all teamleader users.
+            resume -- continues the last users sync when it did not complete
         """
-        self.resource_sync(self.tlc.list_users, self.tlc.get_user,
-                           self.users, full_sync)
+        return self.resource_sync(self.tlc.list_users, self.tlc.get_user,
+                                  self.users, full_sync, resume)
 
-    def teamleader_sync(self, full_sync=False):
+    def resource_syncs(self):
+        """ The resource syncs run by teamleader_sync, the ones in resource_priority
+        first and the others in their usual order.
+        """
+        syncs = [
+            ('companies', self.companies_sync),
+            ('contacts', self.contacts_sync),
+            ('custom_fields', self.custom_fields_sync),
+            ('departments', self.departments_sync),
+            ('events', self.events_sync),
+            ('invoices', self.invoices_sync),
+            ('projects', self.projects_sync),
+            ('users', self.users_sync),
+        ]
+        priority = {name: i for i, name in enumerate(self.resource_priority)}
+
+        return sorted(syncs, key=lambda sync: priority.get(sync[0], len(priority)))
+
+    @staticmethod
+    def sync_report(full_sync, results, started):
+        """ Combined result of the resource syncs with totals over all resources """
+        report = {
+            'full_sync': full_sync,
+            'duration': round(time.monotonic() - started, 3),
+            'synced': 0,
+            'skipped': 0,
+            'failed_ids': 0,
+            'inserted': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'resources': results
+        }
+        for result in results.values():
+            if result and 'error' not in result:
+                report['synced'] += result['synced']
+                report['skipped'] += result['skipped']
+                report['failed_ids'] += len(result['failed_ids'])
+                for key in ('inserted', 'updated', 'unchanged'):
+                    report[key] += result.get(key, 0)
+
+        return report
+
+    def teamleader_sync(self, full_sync=False, resume=False):
+        """ Syncs all teamleader resources. With resource_workers above 1 the
+        resources are synced concurrently, all drawing from the rate limit
+        budget of the shared TeamleaderClient. A failing resource does not stop
+        the others, its error is in the report and raised once all are done.
+        With resume the resources whose last sync did not complete continue
+        where they stopped.
+        """
         if full_sync:
             logger.info("Start full sync from teamleader")
         else:
             logger.info("Start delta sync from teamleader")
 
-        self.companies_sync(full_sync)
-        self.contacts_sync(full_sync)
-        self.custom_fields_sync(full_sync)
-        self.departments_sync(full_sync)
-        self.events_sync(full_sync)
-        self.invoices_sync(full_sync)
-        self.projects_sync(full_sync)
-        self.users_sync(full_sync)
+        started = time.monotonic()
+        results = {}
+        errors = []
+        if self.resource_workers <= 1:
+            for name, resource_sync in self.resource_syncs():
+                results[name] = resource_sync(full_sync, resume)
+        else:
+            with ThreadPoolExecutor(max_workers=self.resource_workers) as pool:
+                futures = {
+                    pool.submit(resource_sync, full_sync, resume): name
+                    for name, resource_sync in self.resource_syncs()
+                }
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        logger.error(f"{name} sync failed: {e}")
+                        results[name] = {'error': str(e)}
+                        errors.append(e)
+
+        report = self.sync_report(full_sync, results, started)
+        logger.info(
+            f"Teamleader sync completed in {report['duration']}s, "
+            f"synchronized {report['synced']} records, {report['skipped']} unchanged")
+
+        if errors:
+            raise errors[0]
+
+        return report
+
+    def teamleader_reconcile(self, soft_delete=False):
+        """ Deletes (or with soft_delete marks as deleted) the records of all
+        resources that no longer exist in Teamleader, using list calls only.
+        """
+        soft_delete = soft_delete or self.soft_delete
+        resources = [
+            (self.tlc.list_companies, self.companies),
+            (self.tlc.list_contacts, self.contacts),
+            (self.tlc.list_custom_fields, self.custom_fields),
+            (self.tlc.list_departments, self.departments),
+            (self.tlc.list_events, self.events),
+            (self.tlc.list_invoices, self.invoices),
+            (self.tlc.list_projects, self.projects),
+            (self.tlc.list_users, self.users),
+        ]
+        results = {}
+        for list_call, model in resources:
+            results[model.name] = self.resource_reconcile(list_call, model, soft_delete)
+
+        logger.info("Teamleader reconciliation completed")
+
+        return results
+
+    async def teamleader_sync_async(self, full_sync=False, resume=False):
+        """ Teamleader sync using the AsyncTeamleaderClient, can be awaited
+        directly from the api without blocking the event loop.
+        """
+        if full_sync:
+            logger.info("Start async full sync from teamleader")
+        else:
+            logger.info("Start async delta sync from teamleader")
+
+        resources = [
+            (self.atlc.list_companies, self.atlc.get_company, self.companies),
+            (self.atlc.list_contacts, self.atlc.get_contact, self.contacts),
+            (self.atlc.list_custom_fields, self.atlc.get_custom_field, self.custom_fields),
+            (self.atlc.list_departments, self.atlc.get_department, self.departments),
+            (self.atlc.list_events, self.atlc.get_event, self.events),
+            (self.atlc.list_invoices, self.atlc.get_invoice, self.invoices),
+            (self.atlc.list_projects, self.atlc.get_project, self.projects),
+            (self.atlc.list_users, self.atlc.get_user, self.users),
+        ]
+        try:
+            for list_call, details_call, model in resources:
+                await self.resource_sync_async(list_call, details_call, model, full_sync, resume)
+        finally:
+            await self.atlc.aclose()
 
-        logger.info("Teamleader sync completed")
+        logger.info("Teamleader async sync completed")
 
     def teamleader_status(self):
         status = {}
@@ -213,6 +1122,8 @@ class App:
                 self.projects_sync,
                 self.users_sync,
                 self.teamleader_sync,
+                self.teamleader_reconcile,
+                self.refresh_ids,
                 self.teamleader_status
             ])
         except (PSQLError) as e:
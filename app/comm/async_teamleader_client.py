@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/comm/async_teamleader_client.py
+#
+#   AsyncTeamleaderClient is the asyncio twin of TeamleaderClient. It exposes
+#   the same list_* and get_* calls as coroutines, backed by a httpx AsyncClient
+#   using HTTP/2 so many in-flight list and detail calls are multiplexed over a
+#   handful of connections.
+#
+#   Authorization (tokens, refresh, code callback), the token manager and the
+#   rate limit budget are shared with the TeamleaderClient passed in the constructor. This way a sync
+#   started from the api and one started from the cli never use a different
+#   token pair. Failed calls are retried with the same RetryPolicy.
+#
+import asyncio
+import httpx
+from datetime import datetime
+from app.comm.retry_policy import TeamleaderApiError
+from app.comm.teamleader_client import TeamleaderClient
+
+
+class AsyncTeamleaderClient:
+    """Acts as an asyncio client to query information from Teamleader API"""
+
+    def __init__(self, tlc: TeamleaderClient, transport=None):
+        self.tlc = tlc
+        self.transport = transport
+        self.client = None
+
+    def http_client(self):
+        """ The httpx client is bound to the running event loop, so we create
+        it on first use instead of in the constructor.
+        """
+        if self.client is None:
+            connect_timeout, read_timeout = self.tlc.timeout
+            self.client = httpx.AsyncClient(
+                http2=True,
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=self.tlc.pool_size,
+                    max_keepalive_connections=self.tlc.pool_size
+                ),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+            )
+
+        return self.client
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def auth_token_refresh(self, seen_generation=None):
+        """ The token manager makes sure only one refresh is done, other callers
+        wait in the executor and then retry with the refreshed token.
+        """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(
+            None,
+            self.tlc.token_manager.refresh,
+            self.tlc.auth_token_refresh,
+            seen_generation
+        )
+
+    async def api_get(self, path, params):
+        """ rate limited get request on the shared http/2 client """
+        client = self.http_client()
+        wait = self.tlc.rate_limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        res = await client.get(path, params=params, headers=self.tlc.auth_header())
+        self.tlc.rate_limiter.update(res.headers)
+
+        return res
+
+    async def authorized_get(self, path, params):
+        if self.tlc.token_manager.needs_refresh():
+            await self.auth_token_refresh()
+
+        generation = self.tlc.token_manager.generation
+        res = await self.api_get(path, params)
+
+        if res.status_code == 401:
+            await self.auth_token_refresh(generation)
+            res = await self.api_get(path, params)
+
+        return res
+
+    async def request(self, path, params):
+        """ see TeamleaderClient.api_request """
+        retry_policy = self.tlc.retry_policy
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                res = await self.authorized_get(path, params)
+            except httpx.TransportError as e:
+                # timeouts, connection and protocol errors
+                status_code, text, retry_after = None, str(e), None
+            else:
+                if res.status_code == 200:
+                    return self.tlc.response_data(res)
+                status_code, text, retry_after = res.status_code, res.text, res.headers.get('Retry-After')
+
+            if not retry_policy.should_retry(status_code, attempt):
+                raise TeamleaderApiError(path, status_code, text, params, attempt)
+
+            delay = retry_policy.delay(attempt, status_code, retry_after)
+            print(f"call to {path} failed with {status_code}, retry {attempt} in {delay:.1f}s", flush=True)
+            if status_code == 429:
+                self.tlc.rate_limiter.pause(delay)
+            await asyncio.sleep(delay)
+
+    async def request_page(self, resource_path, page=None, page_size=None, updated_since: datetime = None,
+                           includes=None):
+        path = self.tlc.api_uri + resource_path
+        params = self.tlc.page_params(page, page_size, updated_since, includes)
+
+        return await self.request(path, params)
+
+    async def request_item(self, resource_path, resource_id):
+        path = self.tlc.api_uri + resource_path
+        params = {}
+        params['id'] = resource_id
+
+        return await self.request(path, params)
+
+    async def list_companies(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return await self.request_page('/companies.list', page, page_size, updated_since, includes)
+
+    async def get_company(self, uid):
+        return await self.request_item('/companies.info', uid)
+
+    async def list_contacts(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return await self.request_page('/contacts.list', page, page_size, updated_since, includes)
+
+    async def get_contact(self, uid):
+        return await self.request_item('/contacts.info', uid)
+
+    async def list_invoices(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return await self.request_page('/invoices.list', page, page_size, updated_since, includes)
+
+    async def get_invoice(self, uid):
+        return await self.request_item('/invoices.info', uid)
+
+    async def list_departments(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        # departments.list has no pagination, see TeamleaderClient.list_departments
+        if page > 1:
+            return []
+        else:
+            return await self.request_page('/departments.list', page, page_size, updated_since)
+
+    async def get_department(self, uid):
+        return await self.request_item('/departments.info', uid)
+
+    async def list_events(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return await self.request_page('/events.list', page, page_size, updated_since, includes)
+
+    async def get_event(self, uid):
+        return await self.request_item('/events.info', uid)
+
+    async def list_projects(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return await self.request_page('/projects.list', page, page_size, updated_since, includes)
+
+    async def get_project(self, uid):
+        return await self.request_item('/projects.info', uid)
+
+    async def list_users(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return await self.request_page('/users.list', page, page_size, updated_since, includes)
+
+    async def get_user(self, uid):
+        return await self.request_item('/users.info', uid)
+
+    async def current_user(self):
+        return await self.request_page('/users.me')
+
+    async def list_custom_fields(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return await self.request_page('/customFieldDefinitions.list', page, page_size, None, includes)
+
+    async def get_custom_field(self, uid):
+        return await self.request_item('/customFieldDefinitions.info', uid)
@@ -9,27 +9,146 @@
 #   and also allows for our unit and integration tests to more
 #   easily mock it.
 #
+#   Connections come from a connection pool that is shared by all wrappers
+#   with the same connection parameters in the process, so the models and
+#   the sync threads reuse a handful of connections instead of opening one
+#   per statement. The pool size can be set with pool_min_size and
+#   pool_max_size next to the connection parameters.
+#
+import os
+import threading
+import time
+import uuid
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 from functools import wraps
 
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+# a connection that was idle this many seconds is checked before it is used
+POOL_PING_INTERVAL = 30
+# rows fetched per round trip by a server-side cursor
+STREAM_FETCH_SIZE = 1000
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool. Getting a connection blocks while
+    all max_size connections are in use and broken connections are replaced."""
+
+    def __init__(self, min_size, max_size, params):
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(min_size, max_size, **params)
+        self.lock = threading.Lock()
+        self.last_used = {}
+
+    def healthy(self, conn):
+        if conn.closed:
+            return False
+
+        with self.lock:
+            last_used = self.last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < POOL_PING_INTERVAL:
+            return True
+
+        try:
+            with conn.cursor() as curs:
+                curs.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def discard(self, conn):
+        with self.lock:
+            self.last_used.pop(id(conn), None)
+        self.pool.putconn(conn, close=True)
+
+    def getconn(self):
+        self.slots.acquire()
+        try:
+            conn = self.pool.getconn()
+            while not self.healthy(conn):
+                self.discard(conn)
+                conn = self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+
+        return conn
+
+    def putconn(self, conn):
+        try:
+            if conn.closed:
+                self.discard(conn)
+            else:
+                with self.lock:
+                    self.last_used[id(conn)] = time.monotonic()
+                self.pool.putconn(conn)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        self.pool.closeall()
+
 
 class PostgresqlWrapper:
     """Allows for executing SQL statements to a postgresql database"""
 
+    pools = {}
+    pools_lock = threading.Lock()
+
     def __init__(self, params: dict):
         self.params_postgresql = params
 
+    @classmethod
+    def connection_pool(cls, params: dict) -> ConnectionPool:
+        """The pool of this process for the connection parameters, after a
+        fork the child process creates its own pool"""
+        params = dict(params)
+        min_size = params.pop('pool_min_size', POOL_MIN_SIZE)
+        max_size = params.pop('pool_max_size', POOL_MAX_SIZE)
+        key = (os.getpid(), tuple(sorted((k, str(v)) for k, v in params.items())))
+
+        with cls.pools_lock:
+            pool = cls.pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(min_size, max_size, params)
+                cls.pools[key] = pool
+
+        return pool
+
+    @classmethod
+    def close_pools(cls):
+        """Closes the connections of all pools"""
+        with cls.pools_lock:
+            pools = list(cls.pools.values())
+            cls.pools.clear()
+
+        for pool in pools:
+            pool.close()
+
     def _connect_curs_postgresql(function):
-        """Wrapper function that connects and authenticates to the PostgreSQL DB.
+        """Wrapper function that takes a connection from the pool.
 
-        The passed function will receive the open cursor.
+        The passed function will receive the open cursor. The statement is
+        committed (or rolled back) before the connection is returned. When the
+        server dropped the connection the statement is retried once on a new one.
         """
         @wraps(function)
         def wrapper_connect(self, *args, **kwargs):
-            with psycopg2.connect(**self.params_postgresql) as conn:
-                with conn.cursor() as curs:
-                    val = function(self, cursor=curs, *args, **kwargs)
-            return val
+            pool = PostgresqlWrapper.connection_pool(self.params_postgresql)
+            for attempt in range(2):
+                conn = pool.getconn()
+                try:
+                    with conn as transaction:
+                        with transaction.cursor() as curs:
+                            return function(self, cursor=curs, *args, **kwargs)
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    if attempt > 0 or not conn.closed:
+                        raise
+                finally:
+                    pool.putconn(conn)
         return wrapper_connect
 
     @_connect_curs_postgresql
@@ -46,3 +165,52 @@ class PostgresqlWrapper:
     def executemany(self, query: str, vars_list: list, cursor=None):
         """Connects to the postgresql DB and executes the many statement"""
         cursor.executemany(query, vars_list)
+
+    @_connect_curs_postgresql
+    def execute_values(self, query: str, vars_list: list, template=None, page_size=100,
+                       fetch=False, cursor=None):
+        """Connects to the postgresql DB and executes the statement with the
+        VALUES %s placeholder filled in by pages of page_size rows.
+
+        Returns the rows returned by all pages when fetch is True.
+        """
+        return psycopg2.extras.execute_values(
+            cursor, query, vars_list, template=template, page_size=page_size, fetch=fetch
+        )
+
+    @_connect_curs_postgresql
+    def copy_from_stdin(self, copy_sql: str, data, before: str = None, after: str = None,
+                        cursor=None):
+        """Connects to the postgresql DB and streams data (a file like object)
+        with the COPY ... FROM STDIN statement. The optional before and after
+        statements run in the same transaction, ex: to create a staging table
+        and merge it.
+
+        Returns all results of the after statement if applicable.
+        """
+        if before:
+            cursor.execute(before)
+        data.seek(0)
+        cursor.copy_expert(copy_sql, data)
+        if after:
+            cursor.execute(after)
+            if cursor.description is not None:
+                return cursor.fetchall()
+
+    def stream(self, query: str, vars=None, fetch_size=STREAM_FETCH_SIZE):
+        """Yields the rows of the query through a named server-side cursor,
+        fetching fetch_size rows per round trip. All rows are read in one
+        transaction, the connection goes back to the pool when the iteration
+        ends or the generator is closed.
+        """
+        pool = PostgresqlWrapper.connection_pool(self.params_postgresql)
+        conn = pool.getconn()
+        try:
+            with conn as transaction:
+                with transaction.cursor(name=f'stream_{uuid.uuid4().hex}') as curs:
+                    curs.itersize = fetch_size
+                    curs.execute(query, vars)
+                    for row in curs:
+                        yield row
+        finally:
+            pool.putconn(conn)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/comm/rate_limiter.py
+#
+#   RateLimiter is a token bucket shared by all calls to the Teamleader api.
+#   The bucket refills at limit/period requests per second (scaled down by
+#   utilisation to keep some headroom) and is kept in line with the
+#   X-RateLimit-Remaining and X-RateLimit-Reset headers returned by the api.
+#   We only wait when the budget is actually exhausted instead of sleeping
+#   a fixed amount of time after every request.
+#
+import threading
+import time
+from datetime import datetime, timezone
+
+# Teamleader allows 200 requests per minute
+RATE_LIMIT = 200
+RATE_LIMIT_PERIOD = 60
+RATE_LIMIT_UTILISATION = 0.9
+
+
+class RateLimiter:
+    """Thread safe token bucket driven by the Teamleader rate limit headers"""
+
+    def __init__(self, limit=RATE_LIMIT, period=RATE_LIMIT_PERIOD,
+                 utilisation=RATE_LIMIT_UTILISATION):
+        self.period = period
+        self.utilisation = utilisation
+        self.capacity = max(1.0, limit * utilisation)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.last_refill = now
+
+    def reserve(self) -> float:
+        """Takes a token from the bucket and returns the number of seconds
+        the caller needs to wait before sending its request.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0.0
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate
+
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        """Blocks until a request may be sent"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Holds back all requests for the given seconds, ex: after a 429 response"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def update(self, headers):
+        """Synchronizes the bucket with the rate limit headers of a response"""
+        remaining = self.parse_int(headers.get('X-RateLimit-Remaining'))
+        if remaining is None:
+            return
+
+        limit = self.parse_int(headers.get('X-RateLimit-Limit'))
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if limit:
+                self.capacity = max(1.0, limit * self.utilisation)
+                self.rate = self.capacity / self.period
+                headroom = limit - self.capacity
+            else:
+                headroom = 0
+
+            # never assume more budget than the api reports
+            self.tokens = min(self.tokens, remaining - headroom)
+
+            if remaining <= 0:
+                reset_seconds = self.parse_reset(headers.get('X-RateLimit-Reset'))
+                self.blocked_until = max(
+                    self.blocked_until,
+                    now + (reset_seconds if reset_seconds is not None else self.period)
+                )
+
+    @staticmethod
+    def parse_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def parse_reset(value):
+        """X-RateLimit-Reset is either an iso timestamp or a number of seconds.
+        Returns the seconds left until the budget is reset.
+        """
+        if value is None:
+            return None
+
+        try:
+            seconds = float(value)
+            if seconds > 1e9:
+                # epoch timestamp
+                seconds = seconds - time.time()
+            return max(0.0, seconds)
+        except (TypeError, ValueError):
+            pass
+
+        try:
+            reset_at = datetime.fromisoformat(str(value))
+            if reset_at.tzinfo is None:
+                reset_at = reset_at.replace(tzinfo=timezone.utc)
+            return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+        except ValueError:
+            return None
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/comm/retry_policy.py
+#
+#   RetryPolicy decides if and how long to wait before a failed Teamleader api
+#   call is retried:
+#   - 429 Too Many Requests: wait as long as the Retry-After header says
+#   - 5xx server errors: exponential backoff with full jitter
+#   - timeouts and connection errors: exponential backoff with full jitter,
+#     starting from a longer base delay to give the api time to recover
+#   Other errors (400, 404, ...) are not retried. When a call is not retried or
+#   all attempts are used up a TeamleaderApiError is raised, so a sync stops with
+#   an error instead of treating the failed page as the end of the list.
+#
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 60.0
+
+
+class TeamleaderApiError(Exception):
+    """Raised when a Teamleader api call failed and will not be retried"""
+
+    def __init__(self, path, status_code, text, params, attempts=1):
+        self.path = path
+        self.status_code = status_code
+        self.text = text
+        self.params = params
+        self.attempts = attempts
+        super().__init__(
+            'call to {} failed after {} attempt(s)\n error code={}\n error response {}\n used params {}\n'.format(
+                path,
+                attempts,
+                status_code,
+                text,
+                params
+            )
+        )
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter that honours Retry-After on 429 responses"""
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, backoff_base=RETRY_BACKOFF_BASE,
+                 backoff_max=RETRY_BACKOFF_MAX):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def should_retry(self, status_code, attempt) -> bool:
+        """status_code None means a timeout or connection error"""
+        if attempt >= self.max_attempts:
+            return False
+
+        return status_code is None or status_code == 429 or status_code >= 500
+
+    def backoff(self, attempt, base) -> float:
+        return random.uniform(0, min(self.backoff_max, base * 2 ** (attempt - 1)))
+
+    def delay(self, attempt, status_code=None, retry_after=None) -> float:
+        """Seconds to wait before the next attempt"""
+        if status_code == 429:
+            seconds = self.parse_retry_after(retry_after)
+            if seconds is not None:
+                return min(self.backoff_max, seconds)
+            return self.backoff(attempt, self.backoff_base)
+
+        if status_code is None:
+            # timeout or connection error
+            return self.backoff(attempt, 2 * self.backoff_base)
+
+        return self.backoff(attempt, self.backoff_base)
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Retry-After is either a number of seconds or a http date"""
+        if value is None:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            pass
+
+        try:
+            retry_at = parsedate_to_datetime(str(value))
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
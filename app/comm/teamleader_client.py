@@ -8,8 +8,9 @@
 #   TeamleaderClient handles communication with the exposed
 #   json api from Teamleader.
 #   a code, token and refresh_token is maintaned and updated in
-#   the database. Whenever a 401 response is returned we call
-#   auth_token_refresh to refresh the token and refresh_tokens.
+#   the database. Shortly before the token expires, or whenever a 401
+#   response is returned, we call auth_token_refresh to refresh the token
+#   and refresh_tokens (see token_manager.py, only one refresh runs at a time).
 #   In case this fails (or when none have been saved yet) a url
 #   is generated using authcode_request_link. This links needs to
 #   be pasted into a browser and will result in a code response that
@@ -33,13 +34,49 @@
 #
 #   A similar approach is done for companies, events etc.
 #
+#   For contacts and companies the custom fields can also be sideloaded in the list
+#   call using the includes parameter (see LIST_INCLUDES). A list only sync uses this
+#   to skip the details call for every record. With includes=pagination the list calls
+#   return a ListPage holding the total number of matches, so the remaining pages can
+#   be requested concurrently. The same list calls can also be filtered on a batch of
+#   ids (list_contacts_by_ids, ...) to refresh specific records.
+#
+#   All calls go through a single pooled keep-alive requests.Session so the
+#   many detail calls of a sync reuse the same connections. A shared RateLimiter
+#   (see rate_limiter.py) avoids getting 429 Too Many Requests errors.
+#   Failed calls are retried according to the RetryPolicy (see retry_policy.py)
+#   and raise a TeamleaderApiError when they keep failing.
+#
 import requests
 import time
 from datetime import datetime
+from requests.exceptions import Timeout, ConnectionError as RequestsConnectionError
+from app.comm.rate_limiter import RateLimiter, RATE_LIMIT, RATE_LIMIT_PERIOD, RATE_LIMIT_UTILISATION
+from app.comm.retry_policy import (
+    RetryPolicy, TeamleaderApiError, RETRY_MAX_ATTEMPTS, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX
+)
+from app.comm.token_manager import TokenManager, TOKEN_EXPIRES_IN, TOKEN_REFRESH_MARGIN
 from app.models.teamleader_auth import TeamleaderAuth
 
-# Avoid getting 429 Too Many Requests error
-RATE_LIMIT_SLEEP = 0.6
+# Keep-alive connection pool and timeouts (connect, read) in seconds
+HTTP_POOL_SIZE = 10
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
+
+# Sideloaded includes that make a list call as complete as the details call
+LIST_INCLUDES = {
+    'companies': 'custom_fields',
+    'contacts': 'custom_fields',
+}
+
+
+class ListPage(list):
+    """Data of a list call together with the total number of matches,
+    which is only known when includes=pagination was requested"""
+
+    def __init__(self, data, matches=None):
+        super().__init__(data)
+        self.matches = matches
 
 
 class TeamleaderClient:
@@ -56,6 +93,28 @@ class TeamleaderClient:
 
         self.secret_code_state = params['secret_code_state']
 
+        self.pool_size = params.get('pool_size', HTTP_POOL_SIZE)
+        self.timeout = (
+            params.get('connect_timeout', HTTP_CONNECT_TIMEOUT),
+            params.get('read_timeout', HTTP_READ_TIMEOUT)
+        )
+
+        self.rate_limiter = RateLimiter(
+            params.get('rate_limit', RATE_LIMIT),
+            params.get('rate_limit_period', RATE_LIMIT_PERIOD),
+            params.get('rate_limit_utilisation', RATE_LIMIT_UTILISATION)
+        )
+
+        self.retry_policy = RetryPolicy(
+            params.get('max_attempts', RETRY_MAX_ATTEMPTS),
+            params.get('backoff_base', RETRY_BACKOFF_BASE),
+            params.get('backoff_max', RETRY_BACKOFF_MAX)
+        )
+
+        self.token_manager = TokenManager(
+            params.get('token_refresh_margin', TOKEN_REFRESH_MARGIN)
+        )
+
         self.token_store = TeamleaderAuth(
             app_config['postgresql_teamleader'],
             app_config['table_names']
@@ -69,6 +128,27 @@ class TeamleaderClient:
         else:
             self.code, self.token, self.refresh_token = self.token_store.read()
 
+        self.session = self.create_session()
+
+    def create_session(self):
+        """ Session shared by all list and detail calls. This keeps the connections
+        to the api alive so we only pay the TCP + TLS handshake once per pooled
+        connection instead of once per request.
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update(self.auth_header())
+
+        return session
+
+    def auth_header(self):
+        return {'Authorization': "Bearer {}".format(self.token)}
+
     def authcode_request_link(self):
         """ First request that results in a callback to redirect_uri that supplies a code
         for auth_token_request. We return a link to be opened in browser while the user
@@ -109,6 +189,10 @@ class TeamleaderClient:
             self.token = response['access_token']  # expires in 1 hour
             self.refresh_token = response['refresh_token']
             self.token_store.save(self.code, self.token, self.refresh_token)
+            self.token_manager.token_updated(
+                response.get('expires_in', TOKEN_EXPIRES_IN))
+            # update bearer token in place, existing pooled connections are reused
+            self.session.headers.update(self.auth_header())
         else:
             print(
                 f"Error {token_response.status_code}: {token_response.text} in handle_token_response",
@@ -129,13 +213,15 @@ class TeamleaderClient:
             'redirect_uri': self.redirect_uri,
             'grant_type': 'authorization_code'
         }
-        r = requests.post(req_uri, data=req_params)
-        time.sleep(RATE_LIMIT_SLEEP)
+        self.rate_limiter.acquire()
+        r = self.session.post(req_uri, data=req_params, timeout=self.timeout)
         self.handle_token_response(r)
 
     def auth_token_refresh(self):
-        """ to be called whenever we get 401 from expiry on api calls """
-        r = requests.post(
+        """ to be called through token_manager.refresh before the token expires
+        or whenever we get 401 from expiry on api calls """
+        self.rate_limiter.acquire()
+        r = self.session.post(
             self.auth_uri + '/oauth2/access_token',
             data={
                 'refresh_token': self.refresh_token,
@@ -143,14 +229,61 @@ class TeamleaderClient:
                 'client_secret': self.client_secret,
                 'redirect_uri': self.redirect_uri,
                 'grant_type': 'refresh_token'
-            }
+            },
+            timeout=self.timeout
         )
-        time.sleep(RATE_LIMIT_SLEEP)
         self.handle_token_response(r)
 
-    def request_page(self, resource_path, page=None, page_size=None, updated_since: datetime = None):
-        path = self.api_uri + resource_path
-        headers = {'Authorization': "Bearer {}".format(self.token)}
+    def api_get(self, path, params):
+        """ rate limited get request on the shared session """
+        self.rate_limiter.acquire()
+        res = self.session.get(path, params=params, timeout=self.timeout)
+        self.rate_limiter.update(res.headers)
+
+        return res
+
+    def authorized_get(self, path, params):
+        """ get request with a valid token, refreshed before it expires
+        or after a 401 response """
+        if self.token_manager.needs_refresh():
+            self.token_manager.refresh(self.auth_token_refresh)
+
+        generation = self.token_manager.generation
+        res = self.api_get(path, params)
+
+        if res.status_code == 401:
+            self.token_manager.refresh(self.auth_token_refresh, generation)
+            res = self.api_get(path, params)
+
+        return res
+
+    def api_request(self, path, params):
+        """ authorized get request, retried according to the retry policy.
+        Returns a 200 response or raises TeamleaderApiError """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                res = self.authorized_get(path, params)
+            except (Timeout, RequestsConnectionError) as e:
+                status_code, text, retry_after = None, str(e), None
+            else:
+                if res.status_code == 200:
+                    return res
+                status_code, text, retry_after = res.status_code, res.text, res.headers.get('Retry-After')
+
+            if not self.retry_policy.should_retry(status_code, attempt):
+                raise TeamleaderApiError(path, status_code, text, params, attempt)
+
+            delay = self.retry_policy.delay(attempt, status_code, retry_after)
+            print(f"call to {path} failed with {status_code}, retry {attempt} in {delay:.1f}s", flush=True)
+            if status_code == 429:
+                # hold back the other workers as well
+                self.rate_limiter.pause(delay)
+            time.sleep(delay)
+
+    @staticmethod
+    def page_params(page=None, page_size=None, updated_since: datetime = None, includes=None):
         params = {}
         if page:
             params['page[number]'] = page
@@ -163,74 +296,77 @@ class TeamleaderClient:
             params['filter[updated_since]'] = updated_since.replace(
                 microsecond=0).isoformat()
 
-        res = requests.get(path, params=params, headers=headers)
+        if includes:
+            params['includes'] = includes
 
-        if res.status_code == 401:
-            self.auth_token_refresh()
-            headers = {'Authorization': "Bearer {}".format(self.token)}
-            res = requests.get(path, params=params, headers=headers)
+        return params
 
-        time.sleep(RATE_LIMIT_SLEEP)
+    @staticmethod
+    def response_data(res):
+        body = res.json()
+        data = body['data']
+        meta = body.get('meta') or {}
+        if isinstance(data, list) and 'matches' in meta:
+            return ListPage(data, meta['matches'])
 
-        if res.status_code == 200:
-            return res.json()['data']
-        else:
-            print('call to {} failed\n error code={}\n error response {}\n used params {}\n'.format(
-                path,
-                res.status_code,
-                res.text,
-                params
-            ),
-                flush=True)
-            return []
+        return data
+
+    def request_page(self, resource_path, page=None, page_size=None, updated_since: datetime = None,
+                     includes=None):
+        path = self.api_uri + resource_path
+        params = self.page_params(page, page_size, updated_since, includes)
+
+        res = self.api_request(path, params)
+
+        return self.response_data(res)
+
+    def request_ids(self, resource_path, ids, includes=None):
+        """ list call filtered on the given ids, all on a single page """
+        path = self.api_uri + resource_path
+        params = self.page_params(1, len(ids), None, includes)
+        params['filter[ids][]'] = [str(uid) for uid in ids]
+
+        res = self.api_request(path, params)
+
+        return self.response_data(res)
 
     def request_item(self, resource_path, resource_id):
         path = self.api_uri + resource_path
-        headers = {'Authorization': "Bearer {}".format(self.token)}
         params = {}
         params['id'] = resource_id
 
-        res = requests.get(path, params=params, headers=headers)
-        if res.status_code == 401:
-            self.auth_token_refresh()
-            headers = {'Authorization': "Bearer {}".format(self.token)}
-            res = requests.get(path, params=params, headers=headers)
+        res = self.api_request(path, params)
 
-        time.sleep(RATE_LIMIT_SLEEP)
+        return self.response_data(res)
 
-        if res.status_code == 200:
-            return res.json()['data']
-        else:
-            print('call to {} failed\n error code={}\n error response {}\n used params {}\n'.format(
-                path,
-                res.status_code,
-                res.text,
-                params
-            ),
-                flush=True)
-            return []
+    def list_companies(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return self.request_page('/companies.list', page, page_size, updated_since, includes)
 
-    def list_companies(self, page=1, page_size=20, updated_since: datetime = None):
-        return self.request_page('/companies.list', page, page_size, updated_since)
+    def list_companies_by_ids(self, ids, includes=None):
+        return self.request_ids('/companies.list', ids, includes)
 
     def get_company(self, uid):
         return self.request_item('/companies.info', uid)
 
-    def list_contacts(self, page=1, page_size=20, updated_since: datetime = None):
-        return self.request_page('/contacts.list', page, page_size, updated_since)
+    def list_contacts(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return self.request_page('/contacts.list', page, page_size, updated_since, includes)
+
+    def list_contacts_by_ids(self, ids, includes=None):
+        return self.request_ids('/contacts.list', ids, includes)
 
     def get_contact(self, uid):
         return self.request_item('/contacts.info', uid)
 
-    def list_invoices(self, page=1, page_size=20, updated_since: datetime = None):
-        return self.request_page('/invoices.list', page, page_size, updated_since)
+    def list_invoices(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return self.request_page('/invoices.list', page, page_size, updated_since, includes)
 
     def get_invoice(self, uid):
         return self.request_item('/invoices.info', uid)
 
-    def list_departments(self, page=1, page_size=20, updated_since: datetime = None):
+    def list_departments(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
         # departments.list has no pagination and no updated_since support
-        # however its only 3 entries and full sync is always used
+        # however its only 3 entries and full sync is always used.
+        # includes are ignored, there is nothing to sideload or paginate.
         if page > 1:
             # Departments has no pagination. We want a similar interface however.
             # So if page > 1 we return []. Otherwise our sync goes into an infinite loop.
@@ -241,23 +377,23 @@ class TeamleaderClient:
     def get_department(self, uid):
         return self.request_item('/departments.info', uid)
 
-    def list_events(self, page=1, page_size=20, updated_since: datetime = None):
+    def list_events(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
         # events.list has no updated_since support, always full sync here
-        return self.request_page('/events.list', page, page_size, updated_since)
+        return self.request_page('/events.list', page, page_size, updated_since, includes)
 
     def get_event(self, uid):
         return self.request_item('/events.info', uid)
 
-    def list_projects(self, page=1, page_size=20, updated_since: datetime = None):
+    def list_projects(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
         # projects.list has no updated_since support, always full sync here
-        return self.request_page('/projects.list', page, page_size, updated_since)
+        return self.request_page('/projects.list', page, page_size, updated_since, includes)
 
     def get_project(self, uid):
         return self.request_item('/projects.info', uid)
 
-    def list_users(self, page=1, page_size=20, updated_since: datetime = None):
+    def list_users(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
         # users.list has no updated_since support, always full sync here
-        return self.request_page('/users.list', page, page_size, updated_since)
+        return self.request_page('/users.list', page, page_size, updated_since, includes)
 
     def get_user(self, uid):
         return self.request_item('/users.info', uid)
@@ -265,8 +401,8 @@ class TeamleaderClient:
     def current_user(self):
         return self.request_page('/users.me')
 
-    def list_custom_fields(self, page=1, page_size=20, updated_since: datetime = None):
-        return self.request_page('/customFieldDefinitions.list', page, page_size)
+    def list_custom_fields(self, page=1, page_size=20, updated_since: datetime = None, includes=None):
+        return self.request_page('/customFieldDefinitions.list', page, page_size, None, includes)
 
     def get_custom_field(self, uid):
         return self.request_item('/customFieldDefinitions.info', uid)
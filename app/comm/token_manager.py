@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/comm/token_manager.py
+#
+#   TokenManager tracks when the Teamleader access token expires so it can be
+#   refreshed shortly before expiry instead of after a 401 response.
+#   Teamleader refresh tokens are only usable once, so when several threads or
+#   coroutines want a refresh at the same time only one of them may actually do it.
+#   The others wait for it to finish and continue with the new token.
+#
+import threading
+import time
+
+# Teamleader access tokens expire after 1 hour
+TOKEN_EXPIRES_IN = 3600
+# Refresh this many seconds before the token actually expires
+TOKEN_REFRESH_MARGIN = 60
+
+
+class TokenManager:
+    """Single-flight proactive refresh of the Teamleader access token"""
+
+    def __init__(self, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self.expires_at = None
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def token_updated(self, expires_in=TOKEN_EXPIRES_IN):
+        """Called whenever a new access token was received"""
+        self.expires_at = time.monotonic() + (expires_in or TOKEN_EXPIRES_IN)
+        self.generation += 1
+
+    def needs_refresh(self) -> bool:
+        """True when the token expires within the refresh margin. When the expiry
+        is unknown (token read from database) we rely on 401 responses instead.
+        """
+        if self.expires_at is None:
+            return False
+
+        return time.monotonic() >= self.expires_at - self.refresh_margin
+
+    def refresh(self, refresh_call, seen_generation=None):
+        """Runs refresh_call unless another caller refreshed in the meantime.
+
+        Arguments:
+            refresh_call -- does the actual refresh, calls token_updated on success
+            seen_generation -- generation of the token that got a 401 response.
+                               None for a proactive refresh.
+        """
+        with self.lock:
+            if seen_generation is None:
+                if not self.needs_refresh():
+                    return
+            elif seen_generation != self.generation:
+                return
+
+            generation = self.generation
+            refresh_call()
+
+            if generation == self.generation:
+                # refresh failed, fall back to refreshing on 401 responses
+                self.expires_at = None
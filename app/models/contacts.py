@@ -79,32 +79,26 @@ class Contacts(SyncModel):
             ]
         )
 
-        # write contacts csv export rows based on tl_content json
-        batch_size = 100
-        total_contacts = self.count()
-        export_offset = 0
+        # write contacts csv export rows based on tl_content json,
+        # the rows are streamed from a server-side cursor
         export_rows = 0
-        print(f"Contacts count in database = {total_contacts}", flush=True)
-
-        while export_offset < total_contacts:
-            contact_data = self.select_page(batch_size, export_offset)
-            export_offset += batch_size
-
-            for row in contact_data:
-                # TODO: make dictionary cursor so we can use row['tl_content'] instead
-                contact_json = row[2]
-
-                export.writerow([
-                    self.parse_or_id(contact_json),
-                    self.parse_cp_name_catpro(contact_json),
-                    self.parse_email(contact_json),
-                    self.parse_phone(contact_json),
-                    self.parse_website(contact_json),
-                    self.parse_form_url(contact_json),
-                    self.parse_description(contact_json),
-                    self.parse_accountmanager(contact_json)
-                ])
-                export_rows += 1
+        print(f"Contacts count in database = {self.count()}", flush=True)
+
+        for row in self.stream_rows():
+            # TODO: make dictionary cursor so we can use row['tl_content'] instead
+            contact_json = row[2]
+
+            export.writerow([
+                self.parse_or_id(contact_json),
+                self.parse_cp_name_catpro(contact_json),
+                self.parse_email(contact_json),
+                self.parse_phone(contact_json),
+                self.parse_website(contact_json),
+                self.parse_form_url(contact_json),
+                self.parse_description(contact_json),
+                self.parse_accountmanager(contact_json)
+            ])
+            export_rows += 1
 
         print(f"Exported {export_rows} contacts to csv file.", flush=True)
 
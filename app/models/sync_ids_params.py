@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/models/sync_ids_params.py
+#
+#   Ids of the records to refresh in POST /sync/{resource}/ids call
+#
+from typing import List
+from uuid import UUID
+from pydantic import BaseModel, Field
+
+
+class SyncIdsParams(BaseModel):
+    ids: List[UUID] = Field(
+        ...,
+        description="Teamleader ids of the records to fetch again and upsert"
+    )
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "ids": ["1f0a5e5e-2b8c-4c1a-9f7e-3c7d2a8b9e10"]
+            }
+        }
@@ -1,8 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import base64
+import copy
+import csv
+import hashlib
+import io
 import json
 from datetime import datetime
+from app.comm.psql_wrapper import STREAM_FETCH_SIZE
+
+# rows sent per multi-row INSERT statement by upsert_results
+UPSERT_PAGE_SIZE = 100
+# batches of at least this many rows are loaded with COPY into a staging table
+COPY_THRESHOLD = 500
 
 
 class SyncModel:
@@ -10,6 +21,13 @@ class SyncModel:
     currently following models use this: Companies, Contacts, Departments, Events,
     Invoices, Projects, Users."""
 
+    # upsert_results sends pages of rows in one statement, False executes
+    # the upsert once per changed row
+    bulk_upsert = True
+    upsert_page_size = UPSERT_PAGE_SIZE
+    # 0 disables the COPY load
+    copy_threshold = COPY_THRESHOLD
+
     def __init(self, db_params: dict, table_names: dict):
         self.name = 'syncmodel'
         pass
@@ -29,14 +47,80 @@ class SyncModel:
             f'TRUNCATE TABLE {self.table};'
         )
 
+    def shadow_table_name(self):
+        return f'{self.table}_shadow'
+
+    def shadow_model(self):
+        """Copy of this model that reads and writes the shadow table, used to
+        load a full sync while the table itself stays available to readers."""
+        shadow = copy.copy(self)
+        shadow.table = self.shadow_table_name()
+        return shadow
+
+    def create_shadow_table(self):
+        """(Re)creates an empty shadow table with the schema and indexes of the table"""
+        shadow_table = self.shadow_table_name()
+        self.postgresql_wrapper.execute(
+            f'DROP TABLE IF EXISTS {shadow_table};' + self.create_table_sql(shadow_table)
+        )
+
+    def table_exists(self) -> bool:
+        return self.postgresql_wrapper.execute(
+            'SELECT to_regclass(%s) IS NOT NULL', (self.table,)
+        )[0][0]
+
+    def swap_shadow_table(self):
+        """Replaces the table by its shadow table in a single transaction, so readers
+        either see the old or the new data. The indexes, constraints and id sequence
+        of the shadow table are renamed to the names used for the table."""
+        shadow_table = self.shadow_table_name()
+        schema, _, shadow_name = shadow_table.rpartition('.')
+        table_name = self.table.rpartition('.')[2]
+        schema_prefix = f'{schema}.' if schema else ''
+
+        # our own index names replace the '.' of the table name, names
+        # generated by postgres (pkey) use the table name without schema
+        renames = [
+            (shadow_table.replace('.', '_'), self.table.replace('.', '_')),
+            (shadow_name, table_name)
+        ]
+
+        def renamed(name):
+            for shadow_prefix, prefix in renames:
+                if name.startswith(shadow_prefix):
+                    return prefix + name[len(shadow_prefix):]
+            return name
+
+        indexes = self.postgresql_wrapper.execute(
+            '''
+                SELECT indexname FROM pg_indexes
+                WHERE schemaname = coalesce(%s, current_schema()) AND tablename = %s
+            ''',
+            (schema or None, shadow_name)
+        )
+
+        statements = [
+            f'DROP TABLE IF EXISTS {self.table};',
+            f'ALTER TABLE {shadow_table} RENAME TO {table_name};'
+        ]
+        statements.extend([
+            f'ALTER INDEX {schema_prefix}{row[0]} RENAME TO {renamed(row[0])};'
+            for row in indexes
+        ])
+        statements.append(
+            f'ALTER SEQUENCE IF EXISTS {schema_prefix}{shadow_name}_id_seq RENAME TO {table_name}_id_seq;'
+        )
+        self.postgresql_wrapper.execute('\n'.join(statements))
+
     def count_sql(self):
-        return f'SELECT COUNT(*) FROM {self.table}'
+        return f'SELECT COUNT(*) FROM {self.table} WHERE tl_deleted_at IS NULL'
 
     def max_last_modified_sql(self):
-        return f'SELECT max(updated_at) FROM {self.table}'
+        return f'SELECT max(tl_updated_at) FROM {self.table}'
 
     def max_last_modified_timestamp(self) -> datetime:
-        """Returns the highest ldap_modifytimestamp"""
+        """Returns the highest Teamleader updated_at of the synced entries.
+        This is None for resources without updated_at (users, projects, ...)"""
         return self.postgresql_wrapper.execute(
             self.max_last_modified_sql()
         )[0][0]
@@ -57,29 +141,262 @@ class SyncModel:
             updated_at timestamp with time zone NOT NULL DEFAULT now(),
             CONSTRAINT {table_name.replace(".","_")}_constraint_key UNIQUE (tl_uuid)
         );
+        ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS tl_list_version VARCHAR;
+        ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS tl_updated_at timestamp with time zone;
+        ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS tl_content_hash VARCHAR;
+        ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS tl_deleted_at timestamp with time zone;
+        CREATE INDEX IF NOT EXISTS {table_name.replace(".","_")}_tl_updated_at_idx
+            ON {table_name} (tl_updated_at);
+        UPDATE {table_name} SET tl_updated_at = (tl_content->>'updated_at')::timestamptz
+            WHERE tl_updated_at IS NULL AND tl_content ? 'updated_at';
         '''
 
     # selects a page of data from our models database table
     def select_page(self, limit=0, offset=0):
         return self.postgresql_wrapper.execute(
             f'''
-                SELECT * from {self.table} ORDER BY id LIMIT %s OFFSET %s
+                SELECT * from {self.table} WHERE tl_deleted_at IS NULL
+                ORDER BY id LIMIT %s OFFSET %s
             ''',
             (limit, offset)
         )
 
-    def upsert_entities_sql(self):
-        return f'''INSERT INTO {self.table} (
+    # keyset columns of select_keyset_page, the id makes every key unique
+    KEYSET_ORDERS = {
+        'id': ['id'],
+        'updated_at': ['tl_updated_at', 'id'],
+    }
+
+    @staticmethod
+    def encode_cursor(order, last_key) -> str:
+        last_key = [v.isoformat() if isinstance(v, datetime) else v for v in last_key]
+        payload = json.dumps({'order': order, 'last': last_key}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def decode_cursor(cls, cursor: str):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            order, last_key = payload['order'], payload['last']
+        except (ValueError, TypeError, KeyError):
+            raise ValueError(f"invalid cursor {cursor}")
+
+        if order not in cls.KEYSET_ORDERS or len(last_key) != len(cls.KEYSET_ORDERS[order]):
+            raise ValueError(f"invalid cursor {cursor}")
+
+        return order, last_key
+
+    def select_keyset_page(self, limit=100, cursor: str = None, order='id'):
+        """Selects a page of (not soft deleted) rows after the given cursor using
+        keyset pagination, so every page costs the same however deep we are in
+        the table. order is 'id' or 'updated_at' (Teamleader's updated_at, rows
+        without one are left out). The order of a cursor takes precedence.
+
+        Returns the rows and the cursor of the next page, None on the last page.
+        """
+        if cursor:
+            order, last_key = self.decode_cursor(cursor)
+        if order not in self.KEYSET_ORDERS:
+            raise ValueError(f"unknown order {order}, use one of {', '.join(self.KEYSET_ORDERS)}")
+
+        key_columns = self.KEYSET_ORDERS[order]
+        conditions = ['tl_deleted_at IS NULL']
+        params = []
+        if order == 'updated_at':
+            conditions.append('tl_updated_at IS NOT NULL')
+        if cursor:
+            placeholders = ['%s::timestamptz' if col == 'tl_updated_at' else '%s' for col in key_columns]
+            conditions.append(f"({', '.join(key_columns)}) > ({', '.join(placeholders)})")
+            params.extend(last_key)
+
+        # the key columns are selected again at the end of each row
+        rows = self.postgresql_wrapper.execute(
+            f'''
+                SELECT *, {', '.join(key_columns)} FROM {self.table}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY {', '.join(key_columns)} LIMIT %s
+            ''',
+            tuple(params) + (limit,)
+        )
+
+        key_size = len(key_columns)
+        next_cursor = None
+        if rows and len(rows) == limit:
+            next_cursor = self.encode_cursor(order, list(rows[-1][-key_size:]))
+
+        return [row[:-key_size] for row in rows], next_cursor
+
+    def stream_rows(self, fetch_size=STREAM_FETCH_SIZE):
+        """Yields all (not soft deleted) rows in id order, read lazily with a
+        server-side cursor in a single transaction"""
+        return self.postgresql_wrapper.stream(
+            f'SELECT * from {self.table} WHERE tl_deleted_at IS NULL ORDER BY id',
+            fetch_size=fetch_size
+        )
+
+    @staticmethod
+    def upsert_returning_sql(bulk):
+        # xmax is 0 for a freshly inserted row, rows that were left alone are not returned
+        return '\n        RETURNING (xmax = 0) AS inserted' if bulk else ''
+
+    def upsert_entities_sql(self, bulk=False, source=None):
+        # tl_updated_at is the updated_at of Teamleader itself, used as delta watermark.
+        # rows whose content hash did not change are left alone (no new row version)
+        # with bulk the VALUES are filled in by execute_values, a page of rows at a time
+        # or the rows are read from the given source (ex: a staging table)
+        values = '%s' if bulk else '(%s, %s, %s, %s)'
+        source = source or f'(VALUES {values}) AS v(tl_uuid, tl_type, tl_content, tl_content_hash)'
+        return f'''INSERT INTO {self.table} AS t (
                                   tl_uuid,
                                   tl_type,
-                                  tl_content)
-        VALUES (%s, %s, %s) ON CONFLICT (tl_uuid) DO
+                                  tl_content,
+                                  tl_content_hash,
+                                  tl_updated_at)
+        SELECT v.tl_uuid::uuid, v.tl_type, v.tl_content::jsonb, v.tl_content_hash,
+               (v.tl_content::jsonb->>'updated_at')::timestamptz
+        FROM {source}
+        ON CONFLICT (tl_uuid) DO
         UPDATE
         SET tl_content = EXCLUDED.tl_content,
             tl_type = EXCLUDED.tl_type,
-            updated_at = now();
+            tl_content_hash = EXCLUDED.tl_content_hash,
+            tl_updated_at = EXCLUDED.tl_updated_at,
+            tl_deleted_at = NULL,
+            updated_at = now()
+        WHERE t.tl_content_hash IS DISTINCT FROM EXCLUDED.tl_content_hash
+           OR t.tl_deleted_at IS NOT NULL{self.upsert_returning_sql(bulk)};
         '''
 
+    def upsert_versioned_entities_sql(self, bulk=False, source=None):
+        values = '%s' if bulk else '(%s, %s, %s, %s, %s)'
+        source = source or (
+            f'(VALUES {values})\n'
+            '            AS v(tl_uuid, tl_type, tl_content, tl_content_hash, tl_list_version)'
+        )
+        return f'''INSERT INTO {self.table} AS t (
+                                  tl_uuid,
+                                  tl_type,
+                                  tl_content,
+                                  tl_content_hash,
+                                  tl_updated_at,
+                                  tl_list_version)
+        SELECT v.tl_uuid::uuid, v.tl_type, v.tl_content::jsonb, v.tl_content_hash,
+               (v.tl_content::jsonb->>'updated_at')::timestamptz, v.tl_list_version
+        FROM {source}
+        ON CONFLICT (tl_uuid) DO
+        UPDATE
+        SET tl_content = EXCLUDED.tl_content,
+            tl_type = EXCLUDED.tl_type,
+            tl_content_hash = EXCLUDED.tl_content_hash,
+            tl_updated_at = EXCLUDED.tl_updated_at,
+            tl_list_version = EXCLUDED.tl_list_version,
+            tl_deleted_at = NULL,
+            updated_at = now()
+        WHERE t.tl_content_hash IS DISTINCT FROM EXCLUDED.tl_content_hash
+           OR t.tl_list_version IS DISTINCT FROM EXCLUDED.tl_list_version
+           OR t.tl_deleted_at IS NOT NULL{self.upsert_returning_sql(bulk)};
+        '''
+
+    @staticmethod
+    def canonical_json(entry) -> str:
+        return json.dumps(entry, sort_keys=True, separators=(',', ':'))
+
+    @classmethod
+    def content_hash(cls, entry) -> str:
+        """sha1 of the canonicalised json of a teamleader entry, so the same
+        content always has the same hash regardless of the key order."""
+        return hashlib.sha1(cls.canonical_json(entry).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def list_version(list_entry) -> str:
+        """Version of a list call entry. This is the updated_at of the entry or,
+        for resources without one (users, projects, departments...), a hash of
+        the list payload.
+        """
+        updated_at = list_entry.get('updated_at')
+        if updated_at:
+            return str(updated_at)
+
+        return SyncModel.content_hash(list_entry)
+
+    def stored_list_versions(self, tl_uuids: list) -> dict:
+        """Returns the stored list version for each of the given uuids that exist"""
+        if not tl_uuids:
+            return {}
+
+        rows = self.postgresql_wrapper.execute(
+            f'''
+                SELECT tl_uuid, tl_list_version FROM {self.table}
+                WHERE tl_uuid = ANY(%s::uuid[]) AND tl_deleted_at IS NULL
+            ''',
+            ([str(uid) for uid in tl_uuids],)
+        )
+        return {str(row[0]): row[1] for row in rows}
+
+    def stored_content_hashes(self, tl_uuids: list) -> dict:
+        """Returns the stored content hash and list version for each of the given
+        uuids that exist"""
+        if not tl_uuids:
+            return {}
+
+        rows = self.postgresql_wrapper.execute(
+            f'''
+                SELECT tl_uuid, tl_content_hash, tl_list_version FROM {self.table}
+                WHERE tl_uuid = ANY(%s::uuid[]) AND tl_deleted_at IS NULL
+            ''',
+            ([str(uid) for uid in tl_uuids],)
+        )
+        return {str(row[0]): (row[1], row[2]) for row in rows}
+
+    def stored_uuids(self, batch_size=10000, written_before: datetime = None):
+        """Yields the uuids of the stored (not soft deleted) entries in batches,
+        using keyset pagination on tl_uuid so rows deleted in between are no issue.
+        With written_before only rows that we wrote before that time are returned.
+        """
+        last_uuid = None
+        while True:
+            conditions = ['tl_deleted_at IS NULL']
+            params = []
+            if written_before is not None:
+                conditions.append('updated_at < %s')
+                params.append(written_before)
+            if last_uuid is not None:
+                conditions.append('tl_uuid > %s::uuid')
+                params.append(last_uuid)
+
+            rows = self.postgresql_wrapper.execute(
+                f'''
+                    SELECT tl_uuid FROM {self.table} WHERE {' AND '.join(conditions)}
+                    ORDER BY tl_uuid LIMIT %s
+                ''',
+                tuple(params) + (batch_size,)
+            )
+            if not rows:
+                return
+
+            uuids = [str(row[0]) for row in rows]
+            yield uuids
+            if len(uuids) < batch_size:
+                return
+            last_uuid = uuids[-1]
+
+    def delete_uuids(self, tl_uuids: list, soft_delete=False) -> int:
+        """Deletes the entries with the given uuids or, with soft_delete, only
+        marks them as deleted in tl_deleted_at. Returns the number of rows."""
+        if not tl_uuids:
+            return 0
+
+        if soft_delete:
+            sql = f'''
+                UPDATE {self.table} SET tl_deleted_at = now(), updated_at = now()
+                WHERE tl_uuid = ANY(%s::uuid[]) AND tl_deleted_at IS NULL
+            '''
+        else:
+            sql = f'DELETE FROM {self.table} WHERE tl_uuid = ANY(%s::uuid[])'
+
+        self.postgresql_wrapper.execute(sql, ([str(uid) for uid in tl_uuids],))
+        return len(tl_uuids)
+
     def _prepare_vars_upsert(self, teamleader_result, tl_type: str) -> tuple:
         """Transforms teamleader entry to pass to the psycopg2 execute function.
 
@@ -88,17 +405,23 @@ class SyncModel:
         return (
             str(teamleader_result['id']),
             tl_type,
-            json.dumps(teamleader_result)
+            json.dumps(teamleader_result),
+            self.content_hash(teamleader_result)
         )
 
-    def upsert_results(self, teamleader_results: list):
+    def upsert_results(self, teamleader_results: list, list_versions: dict = None) -> dict:
         """Upsert the teamleader entries into PostgreSQL.
 
        Transforms and flattens the teamleader entries to one list,
-       in order to execute in one transaction.
+       in order to execute in one transaction. Entries whose content hash
+       (and list version) match the stored ones are not written again.
 
         Arguments:
             teamleader_results -- list of Tuple[list[teamleader_entry], str].
+            list_versions -- optional dict of tl_uuid to list_version, stored
+                             to skip unchanged entries in later syncs.
+
+        Returns the number of inserted, updated and unchanged entries.
         """
         vars_list = []
         for result_tuple in teamleader_results:
@@ -112,8 +435,110 @@ class SyncModel:
                     in result_tuple[0]
                 ]
             )
-        self.postgresql_wrapper.executemany(
-            self.upsert_entities_sql(), vars_list)
+
+        versioned = list_versions is not None
+        if versioned:
+            vars_list = [vars + (list_versions.get(vars[0]),) for vars in vars_list]
+
+        if self.copy_threshold and len(vars_list) >= self.copy_threshold:
+            return self.upsert_rows_copy(vars_list, versioned)
+
+        if self.bulk_upsert:
+            return self.upsert_rows_bulk(vars_list, versioned)
+
+        return self.upsert_rows_each(vars_list, versioned)
+
+    def upsert_rows_bulk(self, vars_list: list, versioned: bool) -> dict:
+        """Upserts the rows as multi-row VALUES, one round trip per page of
+        upsert_page_size rows. The counts are taken from the returned rows:
+        rows that were left alone because they did not change return nothing.
+        """
+        vars_list = self.unique_rows(vars_list)
+        if not vars_list:
+            return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+        if versioned:
+            upsert_sql = self.upsert_versioned_entities_sql(bulk=True)
+        else:
+            upsert_sql = self.upsert_entities_sql(bulk=True)
+        rows = self.postgresql_wrapper.execute_values(
+            upsert_sql, vars_list, page_size=self.upsert_page_size, fetch=True
+        )
+
+        return self.upsert_counts(rows, len(vars_list))
+
+    def staging_table_name(self):
+        return f'{self.table.replace(".", "_")}_staging'
+
+    def upsert_rows_copy(self, vars_list: list, versioned: bool) -> dict:
+        """Streams the rows as csv with COPY into a temporary staging table and
+        merges it into the table with a single INSERT ... SELECT, all in one
+        transaction. The staging table is dropped on commit.
+        """
+        vars_list = self.unique_rows(vars_list)
+        if not vars_list:
+            return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+        staging = self.staging_table_name()
+        columns = ['tl_uuid', 'tl_type', 'tl_content', 'tl_content_hash']
+        if versioned:
+            columns.append('tl_list_version')
+            merge_sql = self.upsert_versioned_entities_sql(bulk=True, source=f'{staging} AS v')
+        else:
+            merge_sql = self.upsert_entities_sql(bulk=True, source=f'{staging} AS v')
+
+        data = io.StringIO()
+        csv.writer(data).writerows(vars_list)
+
+        rows = self.postgresql_wrapper.copy_from_stdin(
+            f"COPY {staging} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            data,
+            before=f"CREATE TEMP TABLE {staging} ({', '.join(c + ' text' for c in columns)}) ON COMMIT DROP;",
+            after=merge_sql
+        )
+
+        return self.upsert_counts(rows, len(vars_list))
+
+    @staticmethod
+    def unique_rows(vars_list: list) -> list:
+        """One statement cannot update the same row twice, the last entry of a uuid wins"""
+        return list({vars[0]: vars for vars in vars_list}.values())
+
+    @staticmethod
+    def upsert_counts(rows: list, written: int) -> dict:
+        """Counts from the (xmax = 0) rows returned by a bulk upsert of written rows"""
+        inserted = sum(1 for row in rows if row[0])
+        return {
+            'inserted': inserted,
+            'updated': len(rows) - inserted,
+            'unchanged': written - len(rows)
+        }
+
+    def upsert_rows_each(self, vars_list: list, versioned: bool) -> dict:
+        """Upserts the rows that changed one statement per row, the stored
+        content hashes are selected first to count and skip unchanged rows."""
+        stored = self.stored_content_hashes([vars[0] for vars in vars_list])
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        changed_list = []
+        for vars in vars_list:
+            if vars[0] not in stored:
+                counts['inserted'] += 1
+            else:
+                stored_hash, stored_version = stored[vars[0]]
+                if stored_hash == vars[3] and (not versioned or stored_version == vars[4]):
+                    counts['unchanged'] += 1
+                    continue
+                counts['updated'] += 1
+            changed_list.append(vars)
+
+        if changed_list:
+            if versioned:
+                upsert_sql = self.upsert_versioned_entities_sql()
+            else:
+                upsert_sql = self.upsert_entities_sql()
+            self.postgresql_wrapper.executemany(upsert_sql, changed_list)
+
+        return counts
 
 # deprecated/unused
 # import uuid
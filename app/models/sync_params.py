@@ -18,10 +18,28 @@ class SyncParams(BaseModel):
         False: only synchronizes starting from max last_modified timestamp in database.
         """
     )
+    use_async: bool = Field(
+        False,
+        description="""
+        True:  sync with the asyncio http/2 client on the api event loop.
+        False: sync with the threaded requests client.
+        """
+    )
+
+    resume: bool = Field(
+        False,
+        description="""
+        True:  resources whose last sync did not complete continue at the page
+               after the last one written, with the same mode and watermark.
+        False: start a new sync.
+        """
+    )
 
     class Config:
         schema_extra = {
             "example": {
-                "full_sync": False
+                "full_sync": False,
+                "use_async": False,
+                "resume": False
             }
         }
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/models/sync_state.py
+#
+#   SyncState keeps the progress of the running sync of each resource:
+#   mode, watermark and the last page (and its ids) that was written to the
+#   database. A sync that stopped halfway can be resumed from there instead of
+#   starting again from page 1.
+#   When a sync completes its start time is kept as watermark_cap: records that
+#   changed while it ran may be missing (ex: live rows dropped by the swap of a
+#   shadow table), so the next delta sync lists everything changed since then.
+#
+import json
+from app.comm.psql_wrapper import PostgresqlWrapper
+
+SYNC_RUNNING = 'running'
+SYNC_FAILED = 'failed'
+SYNC_COMPLETED = 'completed'
+
+
+class SyncState():
+    """Acts as a client to query and modify information from and to database"""
+
+    def __init__(self, db_params: dict, table_names: dict):
+        self.table = table_names.get('sync_state_table', 'tl_sync_state')
+        self.postgresql_wrapper = PostgresqlWrapper(db_params)
+        self.postgresql_wrapper.execute(
+            SyncState.create_table_sql(self.table)
+        )
+
+    @classmethod
+    def create_table_sql(cls, table_name):
+        return f'''CREATE TABLE IF NOT EXISTS {table_name}(
+            resource VARCHAR PRIMARY KEY,
+            full_sync boolean NOT NULL DEFAULT false,
+            watermark timestamp with time zone,
+            last_page integer NOT NULL DEFAULT 0,
+            last_ids jsonb NOT NULL DEFAULT '[]',
+            status VARCHAR NOT NULL,
+            created_at timestamp with time zone NOT NULL DEFAULT now(),
+            updated_at timestamp with time zone NOT NULL DEFAULT now(),
+            watermark_cap timestamp with time zone
+        );
+        '''
+
+    def start(self, resource, full_sync, watermark):
+        """Registers a new sync of resource, this replaces the previous state"""
+        self.postgresql_wrapper.execute(
+            f'''
+                INSERT INTO {self.table} (resource, full_sync, watermark, last_page, last_ids, status)
+                VALUES (%s, %s, %s, 0, '[]', %s)
+                ON CONFLICT (resource) DO
+                UPDATE
+                SET full_sync = EXCLUDED.full_sync,
+                    watermark = EXCLUDED.watermark,
+                    last_page = 0,
+                    last_ids = '[]',
+                    status = EXCLUDED.status,
+                    created_at = now(),
+                    updated_at = now();
+            ''',
+            (resource, full_sync, watermark, SYNC_RUNNING)
+        )
+
+    def checkpoint(self, resource, page, ids):
+        """Called after the entries of a listed page are written to the database"""
+        self.postgresql_wrapper.execute(
+            f'''
+                UPDATE {self.table}
+                SET last_page = %s, last_ids = %s, updated_at = now()
+                WHERE resource = %s;
+            ''',
+            (page, json.dumps([str(uid) for uid in ids]), resource)
+        )
+
+    def finish(self, resource, status=SYNC_COMPLETED):
+        """Sets the status, a completed sync caps the next watermark at its start"""
+        self.postgresql_wrapper.execute(
+            f'''
+                UPDATE {self.table}
+                SET status = %s,
+                    watermark_cap = CASE WHEN %s = %s THEN created_at ELSE watermark_cap END,
+                    updated_at = now()
+                WHERE resource = %s;
+            ''',
+            (status, status, SYNC_COMPLETED, resource)
+        )
+
+    def read(self, resource) -> dict:
+        rows = self.postgresql_wrapper.execute(
+            f'''
+                SELECT resource, full_sync, watermark, last_page, last_ids, status, updated_at,
+                    watermark_cap
+                FROM {self.table} WHERE resource = %s;
+            ''',
+            (resource,)
+        )
+        if not rows:
+            return None
+
+        row = rows[0]
+        return {
+            'resource': row[0],
+            'full_sync': row[1],
+            'watermark': row[2],
+            'last_page': row[3],
+            'last_ids': row[4],
+            'status': row[5],
+            'updated_at': row[6],
+            'watermark_cap': row[7]
+        }
+
+    def resumable(self, resource) -> dict:
+        """State of the last sync of resource when it did not complete, else None"""
+        state = self.read(resource)
+        if state and state['status'] != SYNC_COMPLETED:
+            return state
+
+        return None
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/models/webhook_params.py
+#
+#   Teamleader webhook event received in POST /sync/webhook
+#
+from uuid import UUID
+from pydantic import BaseModel, Field
+
+
+class WebhookSubject(BaseModel):
+    type: str = Field(..., description="type of the changed record, ex: contact")
+    id: UUID = Field(..., description="id of the changed record")
+
+
+class WebhookEvent(BaseModel):
+    type: str = Field(..., description="event type, ex: contact.updated")
+    subject: WebhookSubject
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "type": "contact.updated",
+                "subject": {
+                    "type": "contact",
+                    "id": "4ab96fa3-01fb-0a8b-b21c-c9e2d4b0e0d5"
+                }
+            }
+        }
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/models/webhook_queue.py
+#
+#   WebhookQueue stores the ids of the records Teamleader reported through a
+#   webhook until they are synced. There is one row per resource and id, so
+#   many events for the same record are coalesced into a single detail call.
+#   As the queue is a table, events survive a restart of the api.
+#   An entry whose record could not be fetched stays queued and is retried
+#   after a backoff that doubles with every failed attempt. The records whose
+#   details call failed during a sync are queued here as well.
+#
+from app.comm.psql_wrapper import PostgresqlWrapper
+
+# seconds before the first retry of a failed entry, doubled per attempt
+RETRY_BACKOFF = 60
+RETRY_BACKOFF_MAX = 3600
+
+
+class WebhookQueue():
+    """Acts as a client to query and modify information from and to database"""
+
+    def __init__(self, db_params: dict, table_names: dict):
+        self.table = table_names.get('webhook_queue_table', 'tl_webhook_queue')
+        self.postgresql_wrapper = PostgresqlWrapper(db_params)
+        self.postgresql_wrapper.execute(
+            WebhookQueue.create_table_sql(self.table)
+        )
+
+    @classmethod
+    def create_table_sql(cls, table_name):
+        return f'''CREATE TABLE IF NOT EXISTS {table_name}(
+            resource VARCHAR NOT NULL,
+            tl_uuid uuid NOT NULL,
+            event_type VARCHAR,
+            deleted boolean NOT NULL DEFAULT false,
+            received_at timestamp with time zone NOT NULL DEFAULT clock_timestamp(),
+            attempts integer NOT NULL DEFAULT 0,
+            next_attempt_at timestamp with time zone NOT NULL DEFAULT clock_timestamp(),
+            PRIMARY KEY (resource, tl_uuid)
+        );
+        '''
+
+    def enqueue(self, resource, tl_uuid, event_type, deleted=False):
+        """Adds a record to the queue, a pending entry for the same record is
+        replaced by the latest event and is due right away"""
+        self.postgresql_wrapper.execute(
+            f'''
+                INSERT INTO {self.table} (resource, tl_uuid, event_type, deleted)
+                VALUES (%s, %s::uuid, %s, %s)
+                ON CONFLICT (resource, tl_uuid) DO
+                UPDATE
+                SET event_type = EXCLUDED.event_type,
+                    deleted = EXCLUDED.deleted,
+                    received_at = EXCLUDED.received_at,
+                    attempts = 0,
+                    next_attempt_at = EXCLUDED.next_attempt_at;
+            ''',
+            (resource, str(tl_uuid), event_type, deleted)
+        )
+
+    def peek(self, limit=100, resources=None) -> list:
+        """Oldest due entries as (resource, tl_uuid, deleted, received_at),
+        entries waiting for a retry are left out. With resources only the
+        entries of those resources are returned."""
+        rows = self.postgresql_wrapper.execute(
+            f'''
+                SELECT resource, tl_uuid, deleted, received_at FROM {self.table}
+                WHERE next_attempt_at <= clock_timestamp()
+                AND (%s::varchar[] IS NULL OR resource = ANY(%s::varchar[]))
+                ORDER BY received_at LIMIT %s
+            ''',
+            (resources, resources, limit)
+        )
+        return [(row[0], str(row[1]), row[2], row[3]) for row in rows]
+
+    def ack(self, entries: list):
+        """Removes processed entries. An entry that received a new event in the
+        meantime has a newer received_at and stays queued."""
+        if not entries:
+            return
+
+        self.postgresql_wrapper.executemany(
+            f'''
+                DELETE FROM {self.table}
+                WHERE resource = %s AND tl_uuid = %s::uuid AND received_at = %s
+            ''',
+            [(entry[0], entry[1], entry[3]) for entry in entries]
+        )
+
+    def retry(self, entries: list, backoff=RETRY_BACKOFF, backoff_max=RETRY_BACKOFF_MAX):
+        """Keeps failed entries queued, they are due again after backoff
+        seconds doubled for each earlier attempt, at most backoff_max"""
+        if not entries:
+            return
+
+        self.postgresql_wrapper.executemany(
+            f'''
+                UPDATE {self.table}
+                SET attempts = attempts + 1,
+                    next_attempt_at = clock_timestamp() +
+                        LEAST(%s * power(2, attempts), %s) * interval '1 second'
+                WHERE resource = %s AND tl_uuid = %s::uuid AND received_at = %s
+            ''',
+            [(backoff, backoff_max, entry[0], entry[1], entry[3]) for entry in entries]
+        )
+
+    def next_attempt_in(self):
+        """Seconds until the next queued entry is due, None when the queue is empty"""
+        rows = self.postgresql_wrapper.execute(
+            f'''
+                SELECT EXTRACT(EPOCH FROM MIN(next_attempt_at) - clock_timestamp())
+                FROM {self.table}
+            '''
+        )
+        if not rows or rows[0][0] is None:
+            return None
+
+        return max(0.0, float(rows[0][0]))
+
+    def count(self) -> int:
+        return self.postgresql_wrapper.execute(f'SELECT COUNT(*) FROM {self.table}')[0][0]
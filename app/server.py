@@ -15,6 +15,7 @@ from fastapi_route_logger_middleware import RouteLoggerMiddleware
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 from app.api.api import api_router
+from app.comm.psql_wrapper import PostgresqlWrapper
 
 
 app = FastAPI(
@@ -39,3 +40,8 @@ app.add_middleware(
 @app.get("/", include_in_schema=False)
 def read_root():
     return RedirectResponse("/docs")
+
+
+@app.on_event("shutdown")
+def close_database_connections():
+    PostgresqlWrapper.close_pools()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/sync_pipeline.py
+#
+#   SyncPipeline runs a resource sync as three stages connected by bounded
+#   queues: a list thread requests the pages, the calling thread fetches the
+#   details of each page and a writer thread upserts them. A stage blocks when
+#   the queue to the next one is full, so a slow database slows down the
+#   listing instead of piling up pages in memory, and the api calls go on
+#   while a batch is written.
+#   The writer buffers whole pages and flushes them as one batch when the
+#   buffered records, their json size or the age of the oldest page reach a
+#   limit. Batches are written in page order and report the last page they
+#   hold, so the sync can still be checkpointed and resumed.
+#
+import json
+import queue
+import threading
+import time
+
+PIPELINE_QUEUE_SIZE = 2
+WRITE_BATCH_RECORDS = 500
+WRITE_BATCH_BYTES = 8 * 1024 * 1024
+WRITE_BATCH_SECONDS = 5
+
+# marks the end of the items passed to the next stage
+END_OF_STAGE = object()
+
+
+class SyncPipeline:
+    """Bounded list -> details -> write pipeline of a resource sync"""
+
+    def __init__(self, queue_size=PIPELINE_QUEUE_SIZE, batch_records=WRITE_BATCH_RECORDS,
+                 batch_bytes=WRITE_BATCH_BYTES, batch_seconds=WRITE_BATCH_SECONDS):
+        """
+        Arguments:
+            queue_size -- pages held between two stages
+            batch_records -- flush the write buffer at this number of records
+            batch_bytes -- flush the write buffer at this json size
+            batch_seconds -- flush the write buffer when its oldest page waited this long
+        """
+        self.list_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.write_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.batch_records = batch_records
+        self.batch_bytes = batch_bytes
+        self.batch_seconds = batch_seconds
+        # set when the details stage stopped, the list thread gives up
+        self.stopped = threading.Event()
+        # set when a write failed, the details stage gives up
+        self.write_failed = threading.Event()
+        self.list_error = None
+        self.write_error = None
+
+    @staticmethod
+    def put(stage_queue, item, abort):
+        """Blocks while the queue is full, returns False when abort is set"""
+        while not abort.is_set():
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def list_stage(self, pages):
+        try:
+            for page, resp in pages:
+                if not self.put(self.list_queue, (page, resp), self.stopped):
+                    return
+        except Exception as e:
+            self.list_error = e
+        finally:
+            self.put(self.list_queue, END_OF_STAGE, self.stopped)
+
+    def batch_full(self, records, size, started):
+        return (
+            len(records) >= self.batch_records or
+            size >= self.batch_bytes or
+            time.monotonic() - started >= self.batch_seconds
+        )
+
+    def write_stage(self, write):
+        records, versions, size = [], {}, 0
+        last_page = started = None
+        try:
+            while True:
+                timeout = None
+                if last_page is not None:
+                    timeout = max(0, started + self.batch_seconds - time.monotonic())
+                try:
+                    item = self.write_queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is END_OF_STAGE:
+                    break
+
+                if item is not None:
+                    page, detailed_list, page_versions = item
+                    if last_page is None:
+                        started = time.monotonic()
+                    records.extend(detailed_list)
+                    versions.update(page_versions)
+                    size += len(json.dumps(detailed_list, default=str))
+                    last_page = page
+
+                if last_page is not None and self.batch_full(records, size, started):
+                    write(records, versions, last_page)
+                    records, versions, size = [], {}, 0
+                    last_page = None
+
+            if last_page is not None:
+                write(records, versions, last_page)
+        except Exception as e:
+            self.write_error = e
+            self.write_failed.set()
+
+    def run(self, pages, fetch, write):
+        """
+        Arguments:
+            pages -- iterable of (page number, listed entries), read by the list thread
+            fetch -- fetch(listed entries) returns (records, list versions),
+                     called in the calling thread for each page
+            write -- write(records, list versions, last page), called in the
+                     writer thread for each batch
+        """
+        lister = threading.Thread(
+            target=self.list_stage, args=(pages,), name='sync-list', daemon=True)
+        writer = threading.Thread(
+            target=self.write_stage, args=(write,), name='sync-write', daemon=True)
+        lister.start()
+        writer.start()
+
+        try:
+            while True:
+                item = self.list_queue.get()
+                if item is END_OF_STAGE:
+                    break
+
+                page, resp = item
+                detailed_list, versions = fetch(resp)
+                if not self.put(self.write_queue, (page, detailed_list, versions), self.write_failed):
+                    break
+        finally:
+            # pages fetched so far are still written before a failure is raised
+            self.stopped.set()
+            self.put(self.write_queue, END_OF_STAGE, self.write_failed)
+            writer.join()
+            lister.join()
+
+        if self.write_error:
+            raise self.write_error
+        if self.list_error:
+            raise self.list_error
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/sync_scheduler.py
+#
+#   SyncScheduler runs the delta sync of each resource on its own interval in a
+#   background thread of the api. The interval adapts to the changes found:
+#   when a run synced records the interval is halved (down to min_interval),
+#   when nothing changed it grows by 50% (up to max_interval). So contacts end
+#   up being synced often and departments rarely, and the api budget is spent
+#   where data actually changes. A random jitter spreads the runs and a
+#   resource is skipped while its previous run (or a full teamleader sync, or
+#   any other sync holding the resource lock) is still going.
+#
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+config = ConfigParser()
+logger = logging.get_logger(__name__, config=config)
+
+SCHEDULE_INTERVAL = 900
+SCHEDULE_MIN_INTERVAL = 300
+SCHEDULE_MAX_INTERVAL = 86400
+SCHEDULE_JITTER = 0.1
+SCHEDULE_GROWTH = 1.5
+
+
+class SyncScheduler:
+    """Adaptive interval scheduler for the resource delta syncs"""
+
+    def __init__(self, resource_syncs, schedule_conf=None, busy=None, workers=1,
+                 resource_busy=None):
+        """
+        Arguments:
+            resource_syncs -- list of (name, sync_function) as returned by App.resource_syncs
+            schedule_conf -- the sync.schedule section of config.yml
+            busy -- optional function, no runs are started while it returns True
+            workers -- resource syncs that may run at the same time
+            resource_busy -- optional function, a resource is not started while
+                             it returns True for its name (ex: App.resource_busy)
+        """
+        schedule_conf = schedule_conf or {}
+        self.min_interval = schedule_conf.get('min_interval', SCHEDULE_MIN_INTERVAL)
+        self.max_interval = schedule_conf.get('max_interval', SCHEDULE_MAX_INTERVAL)
+        self.jitter = schedule_conf.get('jitter', SCHEDULE_JITTER)
+        intervals = schedule_conf.get('intervals') or {}
+        default_interval = schedule_conf.get('interval', SCHEDULE_INTERVAL)
+
+        self.busy = busy or (lambda: False)
+        self.resource_busy = resource_busy or (lambda name: False)
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = True
+        self.thread = None
+        self.pool = None
+
+        now = time.monotonic()
+        self.resources = {}
+        for name, sync in resource_syncs:
+            interval = self.clamp(intervals.get(name, default_interval))
+            self.resources[name] = {
+                'sync': sync,
+                'interval': interval,
+                'next_run': now + self.jittered(interval),
+                'running': False,
+                'last_run': None,
+                'last_changes': None,
+                'last_error': None
+            }
+
+    def clamp(self, interval):
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def jittered(self, interval):
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    @staticmethod
+    def changes(result):
+        """Records that were inserted or updated by a sync"""
+        if not result:
+            return 0
+        return result.get('inserted', 0) + result.get('updated', 0)
+
+    def adapt(self, resource, changes):
+        """Halves the interval when the run found changes, else lets it grow"""
+        if changes > 0:
+            resource['interval'] = self.clamp(resource['interval'] / 2)
+        else:
+            resource['interval'] = self.clamp(resource['interval'] * SCHEDULE_GROWTH)
+
+    def due_resources(self, now):
+        """Names of the resources that should run now and marks them running"""
+        if self.busy():
+            return []
+
+        with self.lock:
+            due = [
+                name for name, resource in self.resources.items()
+                if not resource['running'] and resource['next_run'] <= now and
+                not self.resource_busy(name)
+            ]
+            for name in due:
+                self.resources[name]['running'] = True
+
+        return due
+
+    def run_resource(self, name):
+        resource = self.resources[name]
+        changes = 0
+        error = None
+        try:
+            changes = self.changes(resource['sync'](False))
+        except Exception as e:
+            logger.error(f"scheduled {name} sync failed: {e}")
+            error = str(e)
+
+        with self.lock:
+            if error is None:
+                self.adapt(resource, changes)
+            resource['running'] = False
+            resource['last_run'] = datetime.now(timezone.utc)
+            resource['last_changes'] = changes
+            resource['last_error'] = error
+            resource['next_run'] = time.monotonic() + self.jittered(resource['interval'])
+
+        self.wakeup.set()
+
+    def seconds_to_next_run(self, now):
+        with self.lock:
+            waiting = [r['next_run'] for r in self.resources.values() if not r['running']]
+
+        if not waiting:
+            return self.max_interval
+
+        return max(0.0, min(waiting) - now)
+
+    def loop(self):
+        while not self.stopped:
+            now = time.monotonic()
+            for name in self.due_resources(now):
+                self.pool.submit(self.run_resource, name)
+
+            # when busy, check again in a minute instead of spinning
+            wait = self.seconds_to_next_run(now) if not self.busy() else 60
+            self.wakeup.wait(max(1.0, wait))
+            self.wakeup.clear()
+
+    def start(self):
+        if not self.stopped:
+            return
+
+        logger.info(f"Sync scheduler started for {', '.join(self.resources.keys())}")
+        self.stopped = False
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.thread = threading.Thread(target=self.loop, name='sync-scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.stopped:
+            return
+
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join()
+        self.pool.shutdown(wait=False)
+        logger.info("Sync scheduler stopped")
+
+    def status(self):
+        """Interval and next run time of each resource"""
+        now = time.monotonic()
+        wall_now = datetime.now(timezone.utc)
+        with self.lock:
+            return {
+                'enabled': not self.stopped,
+                'resources': {
+                    name: {
+                        'interval': round(resource['interval']),
+                        'next_run': None if resource['running'] else (
+                            wall_now + timedelta(seconds=resource['next_run'] - now)
+                        ).isoformat(),
+                        'running': resource['running'],
+                        'last_run': resource['last_run'].isoformat() if resource['last_run'] else None,
+                        'last_changes': resource['last_changes'],
+                        'last_error': resource['last_error']
+                    }
+                    for name, resource in self.resources.items()
+                }
+            }
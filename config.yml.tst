@@ -29,3 +29,5 @@ app:
     projects_table: 'tl_projects'
     users_table: 'tl_users'
     custom_fields_table: 'tl_custom_fields'
+    sync_state_table: 'tl_sync_state'
+    webhook_queue_table: 'tl_webhook_queue'
@@ -2,12 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import pytest
+import uuid
 from unittest.mock import patch
 from fastapi.testclient import TestClient
 
 
 class TestApi:
     @pytest.fixture
+    @patch('app.app.WebhookQueue')
+    @patch('app.app.SyncState')
     @patch('app.app.Users')
     @patch('app.app.Projects')
     @patch('app.app.Invoices')
@@ -32,6 +35,8 @@ class TestApi:
         assert 'Teamleader sync started' in content['status']
 
     def test_teamleader_delta_sync(self, client):
+        from app.api.routers.sync import worker
+        worker.app.sync_state.read.return_value = None
         response = client.post(
             "/sync/teamleader",
             json={"full_sync": False}
@@ -81,3 +86,56 @@ class TestApi:
     def test_teamleader_status(self, client):
         response = client.get("/sync/teamleader")
         assert response.status_code == 200
+
+    def test_sync_schedule(self, client):
+        response = client.get("/sync/schedule")
+        assert response.status_code == 200
+        content = response.json()
+        assert content['enabled'] is False
+        assert 'next_run' in content['resources']['contacts']
+
+    def test_webhook_invalid_token(self, client):
+        response = client.post(
+            "/sync/webhook?token=wrong",
+            json={"type": "contact.updated", "subject": {"type": "contact", "id": str(uuid.uuid4())}}
+        )
+        assert response.status_code == 401
+
+    def test_webhook_queued(self, client):
+        from app.api.routers.sync import worker
+        worker.app.webhook_secret = 'webhook_secret'
+        worker.app.webhook_queue.peek.return_value = []
+        worker.app.webhook_queue.next_attempt_in.return_value = None
+        uid = str(uuid.uuid4())
+
+        response = client.post(
+            "/sync/webhook?token=webhook_secret",
+            json={"type": "contact.updated", "subject": {"type": "contact", "id": uid}}
+        )
+        assert response.status_code == 200
+        assert response.json()['resource'] == 'contacts'
+        worker.app.webhook_queue.enqueue.assert_called_with('contacts', uuid.UUID(uid), 'contact.updated', False)
+        # no failed entries are waiting for a retry
+        assert worker.webhook_timer is None
+
+        response = client.post(
+            "/sync/webhook?token=webhook_secret",
+            json={"type": "meeting.created", "subject": {"type": "meeting", "id": uid}}
+        )
+        assert response.status_code == 200
+        assert 'Ignored' in response.json()['status']
+
+    def test_refresh_ids(self, client):
+        from app.api.routers.sync import worker
+        worker.app.invoices.upsert_results.return_value = {'inserted': 0, 'updated': 1, 'unchanged': 0}
+        worker.app.tlc.get_invoice.side_effect = lambda uid: {'id': uid}
+        uid = str(uuid.uuid4())
+
+        response = client.post("/sync/invoices/ids", json={"ids": [uid]})
+        assert response.status_code == 200
+        assert response.json()['synced'] == 1
+        assert response.json()['updated'] == 1
+        assert response.json()['failed_ids'] == []
+
+        response = client.post("/sync/meetings/ids", json={"ids": [uid]})
+        assert response.status_code == 404
@@ -8,14 +8,18 @@ API_URL = 'https://api.focus.teamleader.eu'
 
 
 class MockResponse:
-    def __init__(self, code, data):
+    def __init__(self, code, data, headers={}):
         self.status_code = code
         self.data = data
+        self.headers = headers
+        self.text = str(data)
 
     def json(self):
         return self.data
 
 
+@patch('app.app.WebhookQueue')
+@patch('app.app.SyncState')
 @patch('app.app.Users')
 @patch('app.app.Projects')
 @patch('app.app.Invoices')
@@ -26,7 +30,6 @@ class MockResponse:
 @patch('app.app.CustomFields')
 @patch('app.comm.teamleader_client.TeamleaderAuth')
 @patch('app.comm.teamleader_client.requests')
-@patch('app.comm.teamleader_client.RATE_LIMIT_SLEEP', 0)
 class TestSync:
 
     def mock_api_calls(self, *args, **kwargs):
@@ -53,7 +56,7 @@ class TestSync:
         app = App()
 
         self.resource_name = 'contacts'
-        mock_requests.get = MagicMock(side_effect=self.mock_api_calls)
+        mock_requests.Session.return_value.get = MagicMock(side_effect=self.mock_api_calls)
         app.contacts_sync(full_sync=True)
 
     def test_companies_sync(self, mock_requests, mock_auth_table, *models):
@@ -62,7 +65,7 @@ class TestSync:
         app = App()
 
         self.resource_name = 'companies'
-        mock_requests.get = MagicMock(side_effect=self.mock_api_calls)
+        mock_requests.Session.return_value.get = MagicMock(side_effect=self.mock_api_calls)
         app.companies_sync(full_sync=True)
 
     def test_invoices_sync(self, mock_requests, mock_auth_table, *models):
@@ -71,7 +74,7 @@ class TestSync:
         app = App()
 
         self.resource_name = 'invoices'
-        mock_requests.get = MagicMock(side_effect=self.mock_api_calls)
+        mock_requests.Session.return_value.get = MagicMock(side_effect=self.mock_api_calls)
         app.invoices_sync(full_sync=True)
 
     def test_departments_sync(self, mock_requests, mock_auth_table, *models):
@@ -80,7 +83,7 @@ class TestSync:
         app = App()
 
         self.resource_name = 'departments'
-        mock_requests.get = MagicMock(side_effect=self.mock_api_calls)
+        mock_requests.Session.return_value.get = MagicMock(side_effect=self.mock_api_calls)
         app.departments_sync(full_sync=True)
 
     def test_events_sync(self, mock_requests, mock_auth_table, *models):
@@ -89,7 +92,7 @@ class TestSync:
         app = App()
 
         self.resource_name = 'events'
-        mock_requests.get = MagicMock(side_effect=self.mock_api_calls)
+        mock_requests.Session.return_value.get = MagicMock(side_effect=self.mock_api_calls)
         app.events_sync(full_sync=True)
 
     def test_projects_sync(self, mock_requests, mock_auth_table, *models):
@@ -98,7 +101,7 @@ class TestSync:
         app = App()
 
         self.resource_name = 'projects'
-        mock_requests.get = MagicMock(side_effect=self.mock_api_calls)
+        mock_requests.Session.return_value.get = MagicMock(side_effect=self.mock_api_calls)
         app.projects_sync(full_sync=True)
 
     def test_users_sync(self, mock_requests, mock_auth_table, *models):
@@ -107,5 +110,5 @@ class TestSync:
         app = App()
 
         self.resource_name = 'users'
-        mock_requests.get = MagicMock(side_effect=self.mock_api_calls)
+        mock_requests.Session.return_value.get = MagicMock(side_effect=self.mock_api_calls)
         app.users_sync(full_sync=True)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch, Mock
+from app.app import App
+from app.comm.async_teamleader_client import AsyncTeamleaderClient
+from app.comm.retry_policy import TeamleaderApiError
+
+API_URL = 'https://api.focus.teamleader.eu'
+
+
+@patch('app.app.WebhookQueue')
+@patch('app.app.SyncState')
+@patch('app.app.Users')
+@patch('app.app.Projects')
+@patch('app.app.Invoices')
+@patch('app.app.Events')
+@patch('app.app.Departments')
+@patch('app.app.Companies')
+@patch('app.app.Contacts')
+@patch('app.app.CustomFields')
+@patch('app.comm.teamleader_client.TeamleaderAuth')
+@patch('app.comm.teamleader_client.requests')
+class TestAsyncTeamleaderClient:
+
+    def mock_api_calls(self, request):
+        self.requests.append(request)
+        path = request.url.path
+        if self.unauthorized and request.headers['Authorization'] == 'Bearer valid_auth_token':
+            return httpx.Response(401, json={'error': 'access denied'})
+
+        if path == '/contacts.list':
+            assert request.url.params['page[number]'] == '1'
+            return httpx.Response(200, json={'data': [{'id': 'uuid1'}]})
+
+        if path == '/contacts.info':
+            uid = request.url.params['id']
+            return httpx.Response(200, json={'data': {'id': uid, 'data': 'resource data here'}})
+
+        return httpx.Response(404, json={'error': 'not found'})
+
+    def async_client(self, mock_requests, mock_auth_table):
+        mock_auth_table.return_value.count.return_value = 0
+        self.requests = []
+        self.unauthorized = False
+        app = App()
+        return AsyncTeamleaderClient(
+            app.tlc,
+            transport=httpx.MockTransport(self.mock_api_calls)
+        )
+
+    def test_list_contacts(self, mock_requests, mock_auth_table, *models):
+        atlc = self.async_client(mock_requests, mock_auth_table)
+
+        async def run():
+            result = await atlc.list_contacts(1, 100)
+            await atlc.aclose()
+            return result
+
+        assert asyncio.run(run()) == [{'id': 'uuid1'}]
+        assert str(self.requests[0].url).startswith(f'{API_URL}/contacts.list')
+
+    def test_concurrent_details(self, mock_requests, mock_auth_table, *models):
+        atlc = self.async_client(mock_requests, mock_auth_table)
+
+        async def run():
+            result = await asyncio.gather(
+                *[atlc.get_contact(f'uuid{i}') for i in range(5)]
+            )
+            await atlc.aclose()
+            return result
+
+        results = asyncio.run(run())
+        assert [r['id'] for r in results] == [f'uuid{i}' for i in range(5)]
+
+    def test_unauthorized_single_refresh(self, mock_requests, mock_auth_table, *models):
+        atlc = self.async_client(mock_requests, mock_auth_table)
+        self.unauthorized = True
+        token_response = Mock()
+        token_response.status_code = 200
+        token_response.json.return_value = {
+            'access_token': 'new_token',
+            'refresh_token': 'new_refresh_token'
+        }
+        session = mock_requests.Session.return_value
+        session.post.return_value = token_response
+
+        async def run():
+            result = await asyncio.gather(
+                *[atlc.get_contact(f'uuid{i}') for i in range(3)]
+            )
+            await atlc.aclose()
+            return result
+
+        results = asyncio.run(run())
+        assert [r['id'] for r in results] == ['uuid0', 'uuid1', 'uuid2']
+        # three 401 responses but only one token refresh
+        assert session.post.call_count == 1
+        assert atlc.tlc.token == 'new_token'
+
+    def test_failed_call(self, mock_requests, mock_auth_table, *models):
+        atlc = self.async_client(mock_requests, mock_auth_table)
+
+        async def run():
+            try:
+                return await atlc.get_user('uuid1')
+            finally:
+                await atlc.aclose()
+
+        with pytest.raises(TeamleaderApiError) as e:
+            asyncio.run(run())
+
+        # 404 is not retried
+        assert e.value.status_code == 404
+        assert len(self.requests) == 1
+
+    def test_retry_server_error(self, mock_requests, mock_auth_table, *models):
+        atlc = self.async_client(mock_requests, mock_auth_table)
+        atlc.tlc.retry_policy.backoff_base = 0
+        responses = [
+            httpx.Response(503, text='unavailable'),
+            httpx.Response(200, json={'data': {'id': 'uuid1'}})
+        ]
+        atlc.transport = httpx.MockTransport(lambda request: responses.pop(0))
+
+        async def run():
+            try:
+                return await atlc.get_contact('uuid1')
+            finally:
+                await atlc.aclose()
+
+        assert asyncio.run(run()) == {'id': 'uuid1'}
+        assert responses == []
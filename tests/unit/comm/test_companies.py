@@ -46,6 +46,7 @@ class TestCompanies:
             tlres.id,
             'companies',
             tlres.entry_to_json(),
+            companies.content_hash(asdict(tlres)),
         )
 
     def test_upsert_results_many(self, companies):
@@ -54,7 +55,7 @@ class TestCompanies:
         # Create 2 mock companies
         result_1 = TeamleaderEntryMock()
         result_1.attributes['name'] = 'comp1'
-        result_2 = TeamleaderEntryMock()
+        result_2 = TeamleaderEntryMock(id=str(uuid.uuid4()))
         result_2.attributes['name'] = 'comp2'
         # Prepare to pass
         results = [([asdict(result_1), asdict(result_2)], 'companies')]
@@ -64,10 +65,10 @@ class TestCompanies:
         val1 = companies._prepare_vars_upsert(asdict(result_1), 'companies')
         val2 = companies._prepare_vars_upsert(asdict(result_2), 'companies')
 
-        assert psql_wrapper_mock.executemany.call_count == 1
-        assert psql_wrapper_mock.executemany.call_args[0][0] == companies.upsert_entities_sql(
-        )
-        assert psql_wrapper_mock.executemany.call_args[0][1] == [val1, val2]
+        assert psql_wrapper_mock.execute_values.call_count == 1
+        assert psql_wrapper_mock.execute_values.call_args[0][0] == companies.upsert_entities_sql(
+            bulk=True)
+        assert psql_wrapper_mock.execute_values.call_args[0][1] == [val1, val2]
 
     def test_max_last_modified_timestamp(self, companies):
         psql_wrapper_mock = companies.postgresql_wrapper
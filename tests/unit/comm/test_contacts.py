@@ -1,3 +1,4 @@
+import csv
 import pytest
 import uuid
 import json
@@ -47,6 +48,7 @@ class TestContacts:
             tlres.id,
             'contacts',
             tlres.entry_to_json(),
+            contacts.content_hash(asdict(tlres)),
         )
 
     def test_contact_upsert_results_many(self, contacts):
@@ -55,7 +57,7 @@ class TestContacts:
         # Create 2 mock contacts
         result_1 = TeamleaderEntryMock()
         result_1.attributes['name'] = 'contact1'
-        result_2 = TeamleaderEntryMock()
+        result_2 = TeamleaderEntryMock(id=str(uuid.uuid4()))
         result_2.attributes['name'] = 'contact2'
         # Prepare to pass
         results = [([asdict(result_1), asdict(result_2)], 'contacts')]
@@ -65,10 +67,39 @@ class TestContacts:
         val1 = contacts._prepare_vars_upsert(asdict(result_1), 'contacts')
         val2 = contacts._prepare_vars_upsert(asdict(result_2), 'contacts')
 
-        assert psql_wrapper_mock.executemany.call_count == 1
-        assert psql_wrapper_mock.executemany.call_args[0][0] == contacts.upsert_entities_sql(
-        )
-        assert psql_wrapper_mock.executemany.call_args[0][1] == [val1, val2]
+        assert psql_wrapper_mock.execute_values.call_count == 1
+        assert psql_wrapper_mock.execute_values.call_args[0][0] == contacts.upsert_entities_sql(
+            bulk=True)
+        assert psql_wrapper_mock.execute_values.call_args[0][1] == [val1, val2]
+
+    def test_contact_upsert_results_versioned(self, contacts):
+        psql_wrapper_mock = contacts.postgresql_wrapper
+        result_1 = TeamleaderEntryMock()
+        results = [([asdict(result_1)], 'contacts')]
+        contacts.upsert_results(results, {result_1.id: 'v1'})
+
+        val1 = contacts._prepare_vars_upsert(asdict(result_1), 'contacts')
+        assert psql_wrapper_mock.execute_values.call_args[0][0] == contacts.upsert_versioned_entities_sql(
+            bulk=True)
+        assert psql_wrapper_mock.execute_values.call_args[0][1] == [val1 + ('v1',)]
+
+    def test_list_version(self, contacts):
+        assert contacts.list_version(
+            {'id': 'uuid1', 'updated_at': '2021-03-29T16:44:33+00:00'}
+        ) == '2021-03-29T16:44:33+00:00'
+
+        # without updated_at a hash of the list entry is used, independent of key order
+        version = contacts.list_version({'id': 'uuid1', 'name': 'meemoo'})
+        assert version == contacts.list_version({'name': 'meemoo', 'id': 'uuid1'})
+        assert version != contacts.list_version({'id': 'uuid1', 'name': 'viaa'})
+
+    def test_stored_list_versions(self, contacts):
+        psql_wrapper_mock = contacts.postgresql_wrapper
+        psql_wrapper_mock.execute.return_value = [('uuid1', 'v1')]
+        versions = contacts.stored_list_versions(['uuid1', 'uuid2'])
+
+        assert versions == {'uuid1': 'v1'}
+        assert psql_wrapper_mock.execute.call_args[0][1] == (['uuid1', 'uuid2'],)
 
     def test_contact_last_modified_timestamp(self, contacts):
         psql_wrapper_mock = contacts.postgresql_wrapper
@@ -79,6 +110,137 @@ class TestContacts:
         )
         assert value == dt
 
+    def test_source_timestamp_watermark(self, contacts):
+        # the watermark is Teamleader's updated_at, not our local write time
+        assert 'max(tl_updated_at)' in contacts.max_last_modified_sql()
+        assert "(v.tl_content::jsonb->>'updated_at')::timestamptz" in contacts.upsert_entities_sql()
+        create_sql = Contacts.create_table_sql('tl_contacts')
+        assert 'ADD COLUMN IF NOT EXISTS tl_updated_at' in create_sql
+        assert 'CREATE INDEX IF NOT EXISTS tl_contacts_tl_updated_at_idx' in create_sql
+
+    def test_upsert_results_bulk_counts(self, contacts):
+        psql_wrapper_mock = contacts.postgresql_wrapper
+        first = {'id': str(uuid.uuid4()), 'name': 'first'}
+        second = {'id': str(uuid.uuid4()), 'name': 'second'}
+        third = {'id': str(uuid.uuid4()), 'name': 'third'}
+        renamed = dict(first, name='renamed')
+        # one row inserted, one updated, the unchanged one is not returned
+        psql_wrapper_mock.execute_values.return_value = [(True,), (False,)]
+        psql_wrapper_mock.execute.reset_mock()
+
+        counts = contacts.upsert_results([([first, second, third, renamed], 'contacts')])
+
+        assert counts == {'inserted': 1, 'updated': 1, 'unchanged': 1}
+        assert psql_wrapper_mock.execute_values.call_count == 1
+        # no select of the stored hashes is needed
+        psql_wrapper_mock.execute.assert_not_called()
+        written = psql_wrapper_mock.execute_values.call_args[0][1]
+        # a uuid is sent once per statement, with its last content
+        assert [vars[0] for vars in written] == [first['id'], second['id'], third['id']]
+        assert written[0][2] == json.dumps(renamed)
+        assert psql_wrapper_mock.execute_values.call_args[1] == {'page_size': 100, 'fetch': True}
+        assert 'VALUES %s' in contacts.upsert_entities_sql(bulk=True)
+        assert 'RETURNING (xmax = 0)' in contacts.upsert_entities_sql(bulk=True)
+
+    def test_upsert_results_copy(self, contacts):
+        psql_wrapper_mock = contacts.postgresql_wrapper
+        contacts.copy_threshold = 2
+        first = {'id': str(uuid.uuid4()), 'name': 'quote " and, comma'}
+        second = {'id': str(uuid.uuid4()), 'name': 'line\nbreak'}
+        psql_wrapper_mock.copy_from_stdin.return_value = [(True,)]
+
+        counts = contacts.upsert_results([([first, second], 'contacts')], {first['id']: 'v1'})
+
+        assert counts == {'inserted': 1, 'updated': 0, 'unchanged': 1}
+        psql_wrapper_mock.execute_values.assert_not_called()
+        copy_sql, data = psql_wrapper_mock.copy_from_stdin.call_args[0]
+        kwargs = psql_wrapper_mock.copy_from_stdin.call_args[1]
+        assert copy_sql.startswith('COPY tl_contacts_staging (tl_uuid, tl_type, tl_content, tl_content_hash, '
+                                   'tl_list_version) FROM STDIN')
+        assert 'CREATE TEMP TABLE tl_contacts_staging' in kwargs['before']
+        assert 'ON COMMIT DROP' in kwargs['before']
+        assert kwargs['after'] == contacts.upsert_versioned_entities_sql(
+            bulk=True, source='tl_contacts_staging AS v')
+        # the csv holds the same values as the parameterised upsert
+        data.seek(0)
+        assert list(csv.reader(data)) == [
+            list(contacts._prepare_vars_upsert(first, 'contacts')) + ['v1'],
+            list(contacts._prepare_vars_upsert(second, 'contacts')) + ['']
+        ]
+
+    def test_upsert_results_content_hash(self, contacts):
+        contacts.bulk_upsert = False
+        psql_wrapper_mock = contacts.postgresql_wrapper
+        unchanged = {'id': str(uuid.uuid4()), 'name': 'same'}
+        changed = {'id': str(uuid.uuid4()), 'name': 'new name'}
+        new = {'id': str(uuid.uuid4()), 'name': 'new'}
+        psql_wrapper_mock.execute.return_value = [
+            (unchanged['id'], contacts.content_hash(unchanged), None),
+            (changed['id'], contacts.content_hash({'id': changed['id'], 'name': 'old'}), None),
+        ]
+
+        counts = contacts.upsert_results([([unchanged, changed, new], 'contacts')])
+
+        assert counts == {'inserted': 1, 'updated': 1, 'unchanged': 1}
+        written = [vars[0] for vars in psql_wrapper_mock.executemany.call_args[0][1]]
+        assert written == [changed['id'], new['id']]
+        assert 'IS DISTINCT FROM EXCLUDED.tl_content_hash' in contacts.upsert_entities_sql()
+
+    def test_content_hash_canonical(self, contacts):
+        assert contacts.content_hash({'a': 1, 'b': [1, 2]}) == contacts.content_hash({'b': [1, 2], 'a': 1})
+        assert contacts.content_hash({'a': 1}) != contacts.content_hash({'a': 2})
+
+    def test_stored_uuids(self, contacts):
+        psql_wrapper_mock = contacts.postgresql_wrapper
+        psql_wrapper_mock.execute.side_effect = [[('uuid1',), ('uuid2',)], [('uuid3',)]]
+
+        batches = list(contacts.stored_uuids(batch_size=2))
+
+        assert batches == [['uuid1', 'uuid2'], ['uuid3']]
+        qry, vars = psql_wrapper_mock.execute.call_args[0]
+        assert 'tl_uuid > %s::uuid' in qry
+        assert 'ORDER BY tl_uuid LIMIT %s' in qry
+        assert vars == ('uuid2', 2)
+
+    def test_delete_uuids(self, contacts):
+        psql_wrapper_mock = contacts.postgresql_wrapper
+        assert contacts.delete_uuids([]) == 0
+        psql_wrapper_mock.execute.reset_mock()
+
+        assert contacts.delete_uuids(['uuid1', 'uuid2']) == 2
+        qry, vars = psql_wrapper_mock.execute.call_args[0]
+        assert qry == 'DELETE FROM tl_contacts WHERE tl_uuid = ANY(%s::uuid[])'
+        assert vars == (['uuid1', 'uuid2'],)
+
+        contacts.delete_uuids(['uuid1'], soft_delete=True)
+        qry = psql_wrapper_mock.execute.call_args[0][0]
+        assert 'SET tl_deleted_at = now()' in qry
+
+    def test_swap_shadow_table(self, contacts):
+        psql_wrapper_mock = contacts.postgresql_wrapper
+        psql_wrapper_mock.execute.return_value = [
+            ('tl_contacts_shadow_pkey',),
+            ('tl_contacts_shadow_constraint_key',),
+            ('tl_contacts_shadow_tl_updated_at_idx',)
+        ]
+        contacts.swap_shadow_table()
+        qry_executed = psql_wrapper_mock.execute.call_args[0][0]
+        assert qry_executed.split('\n') == [
+            'DROP TABLE IF EXISTS tl_contacts;',
+            'ALTER TABLE tl_contacts_shadow RENAME TO tl_contacts;',
+            'ALTER INDEX tl_contacts_shadow_pkey RENAME TO tl_contacts_pkey;',
+            'ALTER INDEX tl_contacts_shadow_constraint_key RENAME TO tl_contacts_constraint_key;',
+            'ALTER INDEX tl_contacts_shadow_tl_updated_at_idx RENAME TO tl_contacts_tl_updated_at_idx;',
+            'ALTER SEQUENCE IF EXISTS tl_contacts_shadow_id_seq RENAME TO tl_contacts_id_seq;'
+        ]
+
+    def test_shadow_model(self, contacts):
+        shadow = contacts.shadow_model()
+        assert shadow.table == 'tl_contacts_shadow'
+        assert shadow.name == 'contacts'
+        assert contacts.table == 'tl_contacts'
+        assert 'INSERT INTO tl_contacts_shadow' in shadow.upsert_entities_sql()
+
     def test_contact_count(self, contacts):
         psql_wrapper_mock = contacts.postgresql_wrapper
         psql_wrapper_mock.execute.return_value = [[5]]
@@ -145,9 +307,9 @@ class TestContacts:
         count_mock.side_effect = contact_count_result
 
         # return 2 fixtures with json like we get back from VKC
-        # by mocking the select_page call with some seed/fixture data
+        # by mocking the streamed rows with some seed/fixture data
         psql_wrapper_mock = contacts.postgresql_wrapper
-        psql_wrapper_mock.execute.return_value = self.select_contacts_fixture()
+        psql_wrapper_mock.stream.return_value = iter(self.select_contacts_fixture())
 
         # this would work but writes an actual file
         # contacts.export_csv('tests/test_export.csv')
@@ -178,3 +340,50 @@ class TestContacts:
         assert csv_rows[2].strip(
         ) == ';;somebodye@meemoo.be;0486118833;http://website2.com;;;'
         assert csv_rows[3].strip() == ';;;;;;beschrijving test;'
+        # one streaming query instead of LIMIT/OFFSET pages
+        assert psql_wrapper_mock.stream.call_count == 1
+        assert 'ORDER BY id' in psql_wrapper_mock.stream.call_args[0][0]
+        assert 'OFFSET' not in psql_wrapper_mock.stream.call_args[0][0]
+
+    def test_select_keyset_page(self, contacts):
+        psql_wrapper_mock = contacts.postgresql_wrapper
+        updated = datetime(2021, 3, 29, 16, 44, 33)
+        psql_wrapper_mock.execute.return_value = [
+            (7, 'uuid7', {}, updated, 7),
+            (9, 'uuid9', {}, updated, 9),
+        ]
+
+        rows, cursor = contacts.select_keyset_page(2)
+
+        # the trailing key column is stripped from the rows
+        assert rows == [(7, 'uuid7', {}, updated), (9, 'uuid9', {}, updated)]
+        sql, params = psql_wrapper_mock.execute.call_args[0]
+        assert 'OFFSET' not in sql and 'ORDER BY id LIMIT %s' in sql
+        assert params == (2,)
+
+        # the next page continues after the last id of the cursor
+        psql_wrapper_mock.execute.return_value = [(12, 'uuid12', {}, updated, 12)]
+        rows, next_cursor = contacts.select_keyset_page(2, cursor)
+        sql, params = psql_wrapper_mock.execute.call_args[0]
+        assert '(id) > (%s)' in sql
+        assert params == (9, 2)
+        assert next_cursor is None
+
+    def test_select_keyset_page_updated_at(self, contacts):
+        psql_wrapper_mock = contacts.postgresql_wrapper
+        updated = datetime(2021, 3, 29, 16, 44, 33)
+        psql_wrapper_mock.execute.return_value = [(3, 'uuid3', {}, updated, updated, 3)]
+
+        rows, cursor = contacts.select_keyset_page(1, order='updated_at')
+        assert rows == [(3, 'uuid3', {}, updated)]
+        assert 'ORDER BY tl_updated_at, id' in psql_wrapper_mock.execute.call_args[0][0]
+
+        contacts.select_keyset_page(1, cursor)
+        sql, params = psql_wrapper_mock.execute.call_args[0]
+        assert '(tl_updated_at, id) > (%s::timestamptz, %s)' in sql
+        assert params == (updated.isoformat(), 3, 1)
+
+        with pytest.raises(ValueError):
+            contacts.select_keyset_page(1, 'not a cursor')
+        with pytest.raises(ValueError):
+            contacts.select_keyset_page(1, order='name')
@@ -47,6 +47,7 @@ class TestCustomFields:
             tlres.id,
             'custom_fields',
             tlres.entry_to_json(),
+            custom_fields.content_hash(asdict(tlres)),
         )
 
     def test_upsert_results_many(self, custom_fields):
@@ -55,7 +56,7 @@ class TestCustomFields:
         # Create 2 mock custom_fields
         result_1 = TeamleaderEntryMock()
         result_1.attributes['name'] = 'custom_field1'
-        result_2 = TeamleaderEntryMock()
+        result_2 = TeamleaderEntryMock(id=str(uuid.uuid4()))
         result_2.attributes['name'] = 'custom_field2'
 
         # Prepare to pass
@@ -68,10 +69,10 @@ class TestCustomFields:
         val2 = custom_fields._prepare_vars_upsert(
             asdict(result_2), 'custom_fields')
 
-        assert psql_wrapper_mock.executemany.call_count == 1
-        assert psql_wrapper_mock.executemany.call_args[0][0] == custom_fields.upsert_entities_sql(
-        )
-        assert psql_wrapper_mock.executemany.call_args[0][1] == [val1, val2]
+        assert psql_wrapper_mock.execute_values.call_count == 1
+        assert psql_wrapper_mock.execute_values.call_args[0][0] == custom_fields.upsert_entities_sql(
+            bulk=True)
+        assert psql_wrapper_mock.execute_values.call_args[0][1] == [val1, val2]
 
     def test_max_last_modified_timestamp(self, custom_fields):
         psql_wrapper_mock = custom_fields.postgresql_wrapper
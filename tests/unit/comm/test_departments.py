@@ -46,6 +46,7 @@ class TestDepartments:
             tlres.id,
             'departments',
             tlres.entry_to_json(),
+            departments.content_hash(asdict(tlres)),
         )
 
     def test_upsert_results_many(self, departments):
@@ -54,7 +55,7 @@ class TestDepartments:
         # Create 2 mock departments
         result_1 = TeamleaderEntryMock()
         result_1.attributes['name'] = 'department1'
-        result_2 = TeamleaderEntryMock()
+        result_2 = TeamleaderEntryMock(id=str(uuid.uuid4()))
         result_2.attributes['name'] = 'department2'
         # Prepare to pass
         results = [([asdict(result_1), asdict(result_2)], 'departments')]
@@ -66,10 +67,10 @@ class TestDepartments:
         val2 = departments._prepare_vars_upsert(
             asdict(result_2), 'departments')
 
-        assert psql_wrapper_mock.executemany.call_count == 1
-        assert psql_wrapper_mock.executemany.call_args[0][0] == departments.upsert_entities_sql(
-        )
-        assert psql_wrapper_mock.executemany.call_args[0][1] == [val1, val2]
+        assert psql_wrapper_mock.execute_values.call_count == 1
+        assert psql_wrapper_mock.execute_values.call_args[0][0] == departments.upsert_entities_sql(
+            bulk=True)
+        assert psql_wrapper_mock.execute_values.call_args[0][1] == [val1, val2]
 
     def test_max_last_modified_timestamp(self, departments):
         psql_wrapper_mock = departments.postgresql_wrapper
@@ -46,6 +46,7 @@ class TestEvents:
             tlres.id,
             'events',
             tlres.entry_to_json(),
+            events.content_hash(asdict(tlres)),
         )
 
     def test_upsert_results_many(self, events):
@@ -54,7 +55,7 @@ class TestEvents:
         # Create 2 mock events
         result_1 = TeamleaderEntryMock()
         result_1.attributes['name'] = 'event1'
-        result_2 = TeamleaderEntryMock()
+        result_2 = TeamleaderEntryMock(id=str(uuid.uuid4()))
         result_2.attributes['name'] = 'event2'
         # Prepare to pass
         results = [([asdict(result_1), asdict(result_2)], 'events')]
@@ -64,10 +65,10 @@ class TestEvents:
         val1 = events._prepare_vars_upsert(asdict(result_1), 'events')
         val2 = events._prepare_vars_upsert(asdict(result_2), 'events')
 
-        assert psql_wrapper_mock.executemany.call_count == 1
-        assert psql_wrapper_mock.executemany.call_args[0][0] == events.upsert_entities_sql(
-        )
-        assert psql_wrapper_mock.executemany.call_args[0][1] == [val1, val2]
+        assert psql_wrapper_mock.execute_values.call_count == 1
+        assert psql_wrapper_mock.execute_values.call_args[0][0] == events.upsert_entities_sql(
+            bulk=True)
+        assert psql_wrapper_mock.execute_values.call_args[0][1] == [val1, val2]
 
     def test_max_last_modified_timestamp(self, events):
         psql_wrapper_mock = events.postgresql_wrapper
@@ -46,6 +46,7 @@ class TestInvoices:
             tlres.id,
             'invoices',
             tlres.entry_to_json(),
+            invoices.content_hash(asdict(tlres)),
         )
 
     def test_upsert_results_many(self, invoices):
@@ -54,7 +55,7 @@ class TestInvoices:
         # Create 2 mock invoices
         result_1 = TeamleaderEntryMock()
         result_1.attributes['name'] = 'invoice1'
-        result_2 = TeamleaderEntryMock()
+        result_2 = TeamleaderEntryMock(id=str(uuid.uuid4()))
         result_2.attributes['name'] = 'invoice2'
         # Prepare to pass
         results = [([asdict(result_1), asdict(result_2)], 'invoices')]
@@ -64,10 +65,10 @@ class TestInvoices:
         val1 = invoices._prepare_vars_upsert(asdict(result_1), 'invoices')
         val2 = invoices._prepare_vars_upsert(asdict(result_2), 'invoices')
 
-        assert psql_wrapper_mock.executemany.call_count == 1
-        assert psql_wrapper_mock.executemany.call_args[0][0] == invoices.upsert_entities_sql(
-        )
-        assert psql_wrapper_mock.executemany.call_args[0][1] == [val1, val2]
+        assert psql_wrapper_mock.execute_values.call_count == 1
+        assert psql_wrapper_mock.execute_values.call_args[0][0] == invoices.upsert_entities_sql(
+            bulk=True)
+        assert psql_wrapper_mock.execute_values.call_args[0][1] == [val1, val2]
 
     def test_max_last_modified_timestamp(self, invoices):
         psql_wrapper_mock = invoices.postgresql_wrapper
@@ -46,6 +46,7 @@ class TestProjects:
             tlres.id,
             'projects',
             tlres.entry_to_json(),
+            projects.content_hash(asdict(tlres)),
         )
 
     def test_upsert_results_many(self, projects):
@@ -54,7 +55,7 @@ class TestProjects:
         # Create 2 mock projects
         result_1 = TeamleaderEntryMock()
         result_1.attributes['name'] = 'project1'
-        result_2 = TeamleaderEntryMock()
+        result_2 = TeamleaderEntryMock(id=str(uuid.uuid4()))
         result_2.attributes['name'] = 'project2'
         # Prepare to pass
         results = [([asdict(result_1), asdict(result_2)], 'projects')]
@@ -64,10 +65,10 @@ class TestProjects:
         val1 = projects._prepare_vars_upsert(asdict(result_1), 'projects')
         val2 = projects._prepare_vars_upsert(asdict(result_2), 'projects')
 
-        assert psql_wrapper_mock.executemany.call_count == 1
-        assert psql_wrapper_mock.executemany.call_args[0][0] == projects.upsert_entities_sql(
-        )
-        assert psql_wrapper_mock.executemany.call_args[0][1] == [val1, val2]
+        assert psql_wrapper_mock.execute_values.call_count == 1
+        assert psql_wrapper_mock.execute_values.call_args[0][0] == projects.upsert_entities_sql(
+            bulk=True)
+        assert psql_wrapper_mock.execute_values.call_args[0][1] == [val1, val2]
 
     def test_max_last_modified_timestamp(self, projects):
         psql_wrapper_mock = projects.postgresql_wrapper
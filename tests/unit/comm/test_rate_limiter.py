@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+from datetime import datetime, timedelta, timezone
+from app.comm.rate_limiter import RateLimiter
+
+
+class TestRateLimiter:
+
+    def test_no_wait_below_budget(self):
+        limiter = RateLimiter(200, 60, 0.9)
+        for _ in range(100):
+            assert limiter.reserve() == 0
+
+    def test_wait_when_bucket_empty(self):
+        limiter = RateLimiter(10, 10, 1.0)
+        for _ in range(10):
+            assert limiter.reserve() == 0
+
+        # bucket refills at 1 request per second
+        assert limiter.reserve() > 0.9
+
+    def test_remaining_header_limits_tokens(self):
+        limiter = RateLimiter(200, 60, 0.9)
+        limiter.update({
+            'X-RateLimit-Limit': '200',
+            'X-RateLimit-Remaining': '20'
+        })
+        # 20 remaining is exactly the 10% headroom we keep
+        assert limiter.reserve() > 0
+
+    def test_remaining_header_above_budget(self):
+        limiter = RateLimiter(200, 60, 0.9)
+        limiter.update({
+            'X-RateLimit-Limit': '200',
+            'X-RateLimit-Remaining': '150'
+        })
+        assert limiter.reserve() == 0
+
+    def test_exhausted_waits_for_reset(self):
+        limiter = RateLimiter(200, 60, 0.9)
+        reset_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        limiter.update({
+            'X-RateLimit-Limit': '200',
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': reset_at.isoformat()
+        })
+        wait = limiter.reserve()
+        assert 25 < wait <= 30
+
+    def test_missing_headers_ignored(self):
+        limiter = RateLimiter(200, 60, 0.9)
+        limiter.update({})
+        assert limiter.reserve() == 0
+
+    def test_parse_reset(self):
+        assert RateLimiter.parse_reset('12') == 12
+        assert RateLimiter.parse_reset(None) is None
+        assert RateLimiter.parse_reset('invalid') is None
+
+    @patch('app.comm.rate_limiter.time.sleep')
+    def test_acquire_sleeps(self, sleep_mock):
+        limiter = RateLimiter(1, 1, 1.0)
+        limiter.acquire()
+        assert sleep_mock.call_count == 0
+        limiter.acquire()
+        assert sleep_mock.call_count == 1
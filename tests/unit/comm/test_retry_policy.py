@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from app.comm.retry_policy import RetryPolicy, TeamleaderApiError
+
+
+class TestRetryPolicy:
+
+    def test_should_retry(self):
+        policy = RetryPolicy(max_attempts=3)
+        assert policy.should_retry(429, 1)
+        assert policy.should_retry(500, 1)
+        assert policy.should_retry(503, 2)
+        assert policy.should_retry(None, 1)
+        assert not policy.should_retry(400, 1)
+        assert not policy.should_retry(404, 1)
+        assert not policy.should_retry(500, 3)
+
+    def test_backoff_bounds(self):
+        policy = RetryPolicy(max_attempts=10, backoff_base=1, backoff_max=8)
+        for attempt in range(1, 10):
+            delay = policy.delay(attempt, 500)
+            assert 0 <= delay <= min(8, 2 ** (attempt - 1))
+
+    def test_retry_after_seconds(self):
+        policy = RetryPolicy()
+        assert policy.delay(1, 429, '12') == 12
+
+    def test_retry_after_capped(self):
+        policy = RetryPolicy(backoff_max=30)
+        assert policy.delay(1, 429, '120') == 30
+
+    def test_retry_after_http_date(self):
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=20)
+        seconds = RetryPolicy.parse_retry_after(format_datetime(retry_at, usegmt=True))
+        assert 15 < seconds <= 20
+
+    def test_retry_after_invalid(self):
+        assert RetryPolicy.parse_retry_after('soon') is None
+        assert RetryPolicy.parse_retry_after(None) is None
+
+    def test_api_error_message(self):
+        error = TeamleaderApiError('/contacts.list', 502, 'bad gateway', {'page[number]': 2}, 5)
+        assert 'call to /contacts.list failed after 5 attempt(s)' in str(error)
+        assert error.status_code == 502
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import io
 import pytest
 import uuid
-from unittest.mock import patch
+from psycopg2 import OperationalError
+from unittest.mock import patch, MagicMock
 from viaa.configuration import ConfigParser
 from app.models.contacts import Contacts
 from app.comm.psql_wrapper import PostgresqlWrapper
@@ -14,14 +16,27 @@ COUNT_ENTITIES_SQL = f'SELECT COUNT(*) FROM {TABLE_NAME}'
 
 class TestPostgresqlWrapper:
 
+    @pytest.fixture(autouse=True)
+    def close_pools(self):
+        """Each test gets a new pool using its own mocked psycopg2.connect"""
+        PostgresqlWrapper.close_pools()
+        yield
+        PostgresqlWrapper.close_pools()
+
+    @staticmethod
+    def mock_connection():
+        connection = MagicMock()
+        connection.closed = 0
+        return connection
+
     @pytest.fixture
     def postgresql_wrapper(self):
         """Returns a PostgresqlWrapper initiliazed by the parameters in config.yml"""
         return PostgresqlWrapper(ConfigParser().app_cfg['postgresql_teamleader'])
 
     @pytest.fixture
-    @patch('psycopg2.connect')
-    def upsert_entities_sql(self, mock_connect):
+    @patch('app.models.contacts.PostgresqlWrapper')
+    def upsert_entities_sql(self, mock_wrapper):
         config = ConfigParser()
         db_conf = config.app_cfg['postgresql_teamleader']
         table_names = config.app_cfg['table_names']
@@ -30,6 +45,7 @@ class TestPostgresqlWrapper:
 
     @patch('psycopg2.connect')
     def test_execute(self, mock_connect, postgresql_wrapper):
+        mock_connect.return_value.closed = 0
         connect = mock_connect.return_value.__enter__.return_value
         connect.cursor.return_value.__enter__.return_value.fetchall.return_value = 5
         result = postgresql_wrapper.execute(COUNT_ENTITIES_SQL)
@@ -38,6 +54,7 @@ class TestPostgresqlWrapper:
     @patch('psycopg2.connect')
     def test_execute_insert(self, mock_connect, postgresql_wrapper, upsert_entities_sql):
         key = str(uuid.uuid4())
+        mock_connect.return_value.closed = 0
         mock_connect.cursor.return_value.description = None
         postgresql_wrapper.execute(upsert_entities_sql, [key])
         connect = mock_connect.return_value.__enter__.return_value
@@ -49,9 +66,100 @@ class TestPostgresqlWrapper:
     @patch('psycopg2.connect')
     def test_executemany(self, mock_connect, postgresql_wrapper, upsert_entities_sql):
         values = [(str(uuid.uuid4()),), (str(uuid.uuid4()),)]
+        mock_connect.return_value.closed = 0
         postgresql_wrapper.executemany(upsert_entities_sql, values)
         connect = mock_connect.return_value.__enter__.return_value
         cursor = connect.cursor.return_value.__enter__.return_value
         assert cursor.executemany.call_count == 1
         assert cursor.executemany.call_args[0][0] == upsert_entities_sql
         assert cursor.executemany.call_args[0][1] == values
+
+    @patch('psycopg2.connect')
+    def test_connection_reused(self, mock_connect, postgresql_wrapper):
+        mock_connect.return_value.closed = 0
+        other_wrapper = PostgresqlWrapper(ConfigParser().app_cfg['postgresql_teamleader'])
+
+        postgresql_wrapper.execute(COUNT_ENTITIES_SQL)
+        postgresql_wrapper.execute(COUNT_ENTITIES_SQL)
+        other_wrapper.execute(COUNT_ENTITIES_SQL)
+
+        # all wrappers share the pool of the process
+        assert mock_connect.call_count == 1
+
+    @patch('psycopg2.connect')
+    def test_reconnect_dropped_connection(self, mock_connect, postgresql_wrapper):
+        dropped = self.mock_connection()
+        cursor = dropped.__enter__.return_value.cursor.return_value.__enter__.return_value
+
+        def server_closed(*args):
+            dropped.closed = 2
+            raise OperationalError('server closed the connection unexpectedly')
+        cursor.execute.side_effect = server_closed
+
+        connection = self.mock_connection()
+        new_cursor = connection.__enter__.return_value.cursor.return_value.__enter__.return_value
+        new_cursor.fetchall.return_value = 5
+        mock_connect.side_effect = [dropped, connection]
+
+        assert postgresql_wrapper.execute(COUNT_ENTITIES_SQL) == 5
+        assert mock_connect.call_count == 2
+
+        # the dropped connection left the pool, the new one is reused
+        assert postgresql_wrapper.execute(COUNT_ENTITIES_SQL) == 5
+        assert mock_connect.call_count == 2
+        assert cursor.execute.call_count == 1
+
+    @patch('psycopg2.extras.execute_values')
+    @patch('psycopg2.connect')
+    def test_execute_values(self, mock_connect, mock_execute_values, postgresql_wrapper):
+        mock_connect.return_value.closed = 0
+        mock_execute_values.return_value = [(True,), (False,)]
+        values = [(str(uuid.uuid4()),), (str(uuid.uuid4()),)]
+
+        result = postgresql_wrapper.execute_values('INSERT INTO t VALUES %s', values, page_size=50, fetch=True)
+
+        assert result == [(True,), (False,)]
+        connect = mock_connect.return_value.__enter__.return_value
+        cursor = connect.cursor.return_value.__enter__.return_value
+        assert mock_execute_values.call_args[0] == (cursor, 'INSERT INTO t VALUES %s', values)
+        assert mock_execute_values.call_args[1] == {'template': None, 'page_size': 50, 'fetch': True}
+
+    @patch('psycopg2.connect')
+    def test_copy_from_stdin(self, mock_connect, postgresql_wrapper):
+        mock_connect.return_value.closed = 0
+        connect = mock_connect.return_value.__enter__.return_value
+        cursor = connect.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [(True,)]
+        data = io.StringIO('a,b\n')
+
+        result = postgresql_wrapper.copy_from_stdin(
+            'COPY staging FROM STDIN', data, before='CREATE TEMP TABLE staging', after='INSERT ...')
+
+        assert result == [(True,)]
+        # all statements run on the same cursor, so in one transaction
+        assert [call[0][0] for call in cursor.execute.call_args_list] == [
+            'CREATE TEMP TABLE staging', 'INSERT ...'
+        ]
+        cursor.copy_expert.assert_called_once_with('COPY staging FROM STDIN', data)
+
+    @patch('psycopg2.connect')
+    def test_stream(self, mock_connect, postgresql_wrapper):
+        mock_connect.return_value.closed = 0
+        connect = mock_connect.return_value.__enter__.return_value
+        cursor = connect.cursor.return_value.__enter__.return_value
+        cursor.__iter__.return_value = iter([(1,), (2,), (3,)])
+        pool = PostgresqlWrapper.connection_pool(ConfigParser().app_cfg['postgresql_teamleader'])
+
+        rows = postgresql_wrapper.stream(COUNT_ENTITIES_SQL, fetch_size=2)
+        assert next(rows) == (1,)
+        # a named cursor reading fetch_size rows per round trip
+        assert connect.cursor.call_args[1]['name'].startswith('stream_')
+        assert cursor.itersize == 2
+        assert pool.pool._used
+
+        # closing the generator early returns the connection to the pool
+        rows.close()
+        assert not pool.pool._used
+        assert list(postgresql_wrapper.stream(COUNT_ENTITIES_SQL)) == [(2,), (3,)]
+        assert not pool.pool._used
+        assert mock_connect.call_count == 1
@@ -0,0 +1,54 @@
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import patch
+from viaa.configuration import ConfigParser
+from app.models.sync_state import SyncState
+
+
+class TestSyncState:
+
+    @pytest.fixture
+    @patch('app.models.sync_state.PostgresqlWrapper')
+    def sync_state(self, postgresql_wrapper_mock):
+        config = ConfigParser()
+        db_conf = config.app_cfg['postgresql_teamleader']
+        table_names = config.app_cfg['table_names']
+        self.sync_state = SyncState(db_conf, table_names)
+        return self.sync_state
+
+    def test_create_table(self, sync_state):
+        qry_executed = sync_state.postgresql_wrapper.execute.call_args[0][0]
+        assert 'CREATE TABLE IF NOT EXISTS tl_sync_state' in qry_executed
+
+    def test_start(self, sync_state):
+        sync_state.start('contacts', True, None)
+        qry, vars = sync_state.postgresql_wrapper.execute.call_args[0]
+        assert 'ON CONFLICT (resource)' in qry
+        assert vars == ('contacts', True, None, 'running')
+
+    def test_checkpoint(self, sync_state):
+        sync_state.checkpoint('contacts', 3, ['uuid1', 'uuid2'])
+        qry, vars = sync_state.postgresql_wrapper.execute.call_args[0]
+        assert 'SET last_page = %s, last_ids = %s' in qry
+        assert vars == (3, '["uuid1", "uuid2"]', 'contacts')
+
+    def test_finish(self, sync_state):
+        sync_state.finish('contacts')
+        qry, vars = sync_state.postgresql_wrapper.execute.call_args[0]
+        assert 'watermark_cap = CASE WHEN %s = %s THEN created_at' in qry
+        assert vars == ('completed', 'completed', 'completed', 'contacts')
+
+    def test_resumable(self, sync_state):
+        watermark = datetime(2021, 3, 29, tzinfo=timezone.utc)
+        row = ('contacts', False, watermark, 3, ['uuid1'], 'failed', watermark, None)
+        sync_state.postgresql_wrapper.execute.return_value = [row]
+        state = sync_state.resumable('contacts')
+        assert state['last_page'] == 3
+        assert state['watermark'] == watermark
+        assert state['full_sync'] is False
+
+        sync_state.postgresql_wrapper.execute.return_value = [row[:5] + ('completed', watermark, watermark)]
+        assert sync_state.resumable('contacts') is None
+
+        sync_state.postgresql_wrapper.execute.return_value = []
+        assert sync_state.resumable('contacts') is None
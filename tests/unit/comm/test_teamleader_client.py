@@ -1,21 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import pytest
 from unittest.mock import patch, Mock, MagicMock
+from requests.exceptions import Timeout
 from app.app import App
+from app.comm.retry_policy import TeamleaderApiError
 
 API_URL = 'https://api.focus.teamleader.eu'
 
 
 class MockResponse:
-    def __init__(self, code, data):
+    def __init__(self, code, data, headers={}):
         self.status_code = code
         self.data = data
+        self.headers = headers
+        self.text = str(data)
 
     def json(self):
         return self.data
 
 
+@patch('app.app.WebhookQueue')
+@patch('app.app.SyncState')
 @patch('app.app.Users')
 @patch('app.app.Projects')
 @patch('app.app.Invoices')
@@ -26,7 +33,6 @@ class MockResponse:
 @patch('app.app.CustomFields')
 @patch('app.comm.teamleader_client.TeamleaderAuth')
 @patch('app.comm.teamleader_client.requests')
-@patch('app.comm.teamleader_client.RATE_LIMIT_SLEEP', 0)
 class TestTeamleaderClient:
 
     def mock_api_calls(self, *args, **kwargs):
@@ -66,7 +72,7 @@ class TestTeamleaderClient:
         app = App()
         self.list_unauthorized = True
         self.resource_name = 'contacts'
-        mock_requests.get = MagicMock(side_effect=self.mock_api_calls)
+        mock_requests.Session.return_value.get = MagicMock(side_effect=self.mock_api_calls)
 
         result = app.tlc.request_page(
             f'/{self.resource_name}.list',
@@ -82,7 +88,7 @@ class TestTeamleaderClient:
         app = App()
         self.details_unauthorized = True
         self.resource_name = 'contacts'
-        mock_requests.get = MagicMock(side_effect=self.mock_api_calls)
+        mock_requests.Session.return_value.get = MagicMock(side_effect=self.mock_api_calls)
 
         result = app.tlc.request_item(
             f'/{self.resource_name}.info',
@@ -120,7 +126,7 @@ class TestTeamleaderClient:
         # mock requests.get so that api call returns something we want
         fields_data = {'data': []}
         mresp = Mock()
-        mock_requests.get.return_value = mresp
+        mock_requests.Session.return_value.get.return_value = mresp
         mresp.status_code = 200
         mresp.json.return_value = fields_data
         fields = app.tlc.list_custom_fields()
@@ -135,7 +141,7 @@ class TestTeamleaderClient:
         # mock requests.get so that api call returns something we want
         field_data = {'data': {'id': 'uidhere'}}
         mresp = Mock()
-        mock_requests.get.return_value = mresp
+        mock_requests.Session.return_value.get.return_value = mresp
         mresp.status_code = 200
         mresp.json.return_value = field_data
         result = app.tlc.get_custom_field('uidhere')
@@ -150,10 +156,163 @@ class TestTeamleaderClient:
         # mock requests.get so that api call returns something we want
         user_data = {'data': {'name': 'current_user'}}
         mresp = Mock()
-        mock_requests.get.return_value = mresp
+        mock_requests.Session.return_value.get.return_value = mresp
         mresp.status_code = 200
         mresp.json.return_value = user_data
         result = app.tlc.current_user()
 
         assert mresp.json.call_count == 1
         assert result == user_data['data']
+
+    def test_token_refresh_updates_session(self, mock_requests, mock_auth_table, *models):
+        ma = mock_auth_table.return_value
+        ma.count.return_value = 0
+        app = App()
+        session = mock_requests.Session.return_value
+        mresp = Mock()
+        mresp.status_code = 200
+        mresp.json.return_value = {
+            'access_token': 'new_token',
+            'refresh_token': 'new_refresh_token'
+        }
+        session.post.return_value = mresp
+        app.tlc.auth_token_refresh()
+
+        assert mock_requests.Session.call_count == 1
+        assert app.tlc.token == 'new_token'
+        assert session.headers.update.call_args[0][0] == {
+            'Authorization': 'Bearer new_token'
+        }
+
+    def test_list_contacts_includes(self, mock_requests, mock_auth_table, *models):
+        ma = mock_auth_table.return_value
+        ma.count.return_value = 0
+        app = App()
+        session = mock_requests.Session.return_value
+        mresp = Mock()
+        session.get.return_value = mresp
+        mresp.status_code = 200
+        mresp.json.return_value = {'data': [{'id': 'uuid1', 'custom_fields': []}]}
+        result = app.tlc.list_contacts(1, 100, None, includes='custom_fields')
+
+        assert result == [{'id': 'uuid1', 'custom_fields': []}]
+        assert session.get.call_args[1]['params'] == {
+            'page[number]': 1,
+            'page[size]': 100,
+            'includes': 'custom_fields'
+        }
+
+    def test_proactive_token_refresh(self, mock_requests, mock_auth_table, *models):
+        ma = mock_auth_table.return_value
+        ma.count.return_value = 0
+        app = App()
+        session = mock_requests.Session.return_value
+        token_resp = Mock()
+        token_resp.status_code = 200
+        token_resp.json.return_value = {
+            'access_token': 'new_token',
+            'refresh_token': 'new_refresh_token',
+            'expires_in': 3600
+        }
+        session.post.return_value = token_resp
+        mresp = Mock()
+        mresp.status_code = 200
+        mresp.json.return_value = {'data': {'id': 'uuid1'}}
+        session.get.return_value = mresp
+
+        # token about to expire is refreshed before the request is made
+        app.tlc.token_manager.token_updated(30)
+        app.tlc.get_contact('uuid1')
+        app.tlc.get_contact('uuid1')
+
+        assert session.post.call_count == 1
+        assert app.tlc.token == 'new_token'
+        assert not app.tlc.token_manager.needs_refresh()
+
+    @patch('app.comm.teamleader_client.time')
+    def test_retry_after_429(self, mock_time, mock_requests, mock_auth_table, *models):
+        mock_auth_table.return_value.count.return_value = 0
+        app = App()
+        session = mock_requests.Session.return_value
+        session.get.side_effect = [
+            MockResponse(429, {}, {'Retry-After': '7'}),
+            MockResponse(500, {}),
+            MockResponse(200, {'data': [{'id': 'uuid1'}]})
+        ]
+
+        with patch.object(app.tlc.rate_limiter, 'pause') as mock_pause:
+            result = app.tlc.list_contacts(1, 100)
+
+        assert result == [{'id': 'uuid1'}]
+        assert session.get.call_count == 3
+        assert mock_time.sleep.call_args_list[0][0][0] == 7
+        # other workers are held back by the shared rate limiter too
+        assert mock_pause.call_args[0][0] == 7
+
+    @patch('app.comm.teamleader_client.time')
+    def test_retry_timeout(self, mock_time, mock_requests, mock_auth_table, *models):
+        mock_auth_table.return_value.count.return_value = 0
+        app = App()
+        session = mock_requests.Session.return_value
+        session.get.side_effect = [
+            Timeout('read timed out'),
+            MockResponse(200, {'data': {'id': 'uuid1'}})
+        ]
+
+        assert app.tlc.get_contact('uuid1') == {'id': 'uuid1'}
+        assert mock_time.sleep.call_count == 1
+
+    @patch('app.comm.teamleader_client.time')
+    def test_retries_exhausted(self, mock_time, mock_requests, mock_auth_table, *models):
+        mock_auth_table.return_value.count.return_value = 0
+        app = App()
+        session = mock_requests.Session.return_value
+        session.get.return_value = MockResponse(502, {})
+
+        with pytest.raises(TeamleaderApiError) as e:
+            app.tlc.list_contacts(1, 100)
+
+        assert e.value.status_code == 502
+        assert session.get.call_count == app.tlc.retry_policy.max_attempts
+
+    def test_client_error_not_retried(self, mock_requests, mock_auth_table, *models):
+        mock_auth_table.return_value.count.return_value = 0
+        app = App()
+        session = mock_requests.Session.return_value
+        session.get.return_value = MockResponse(400, {})
+
+        with pytest.raises(TeamleaderApiError):
+            app.tlc.list_contacts(1, 100)
+
+        assert session.get.call_count == 1
+
+    def test_list_pagination_matches(self, mock_requests, mock_auth_table, *models):
+        mock_auth_table.return_value.count.return_value = 0
+        app = App()
+        session = mock_requests.Session.return_value
+        session.get.return_value = MockResponse(200, {
+            'data': [{'id': 'uuid1'}],
+            'meta': {'page': {'size': 100, 'number': 1}, 'matches': 245}
+        })
+
+        result = app.tlc.list_invoices(1, 100, None, includes='pagination')
+
+        assert result == [{'id': 'uuid1'}]
+        assert result.matches == 245
+        assert session.get.call_args[1]['params']['includes'] == 'pagination'
+
+    def test_list_contacts_by_ids(self, mock_requests, mock_auth_table, *models):
+        mock_auth_table.return_value.count.return_value = 0
+        app = App()
+        session = mock_requests.Session.return_value
+        session.get.return_value = MockResponse(200, {'data': [{'id': 'uuid1'}]})
+
+        result = app.tlc.list_contacts_by_ids(['uuid1', 'uuid2'], includes='custom_fields')
+
+        assert result == [{'id': 'uuid1'}]
+        assert session.get.call_args[1]['params'] == {
+            'page[number]': 1,
+            'page[size]': 2,
+            'includes': 'custom_fields',
+            'filter[ids][]': ['uuid1', 'uuid2']
+        }
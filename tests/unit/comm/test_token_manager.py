@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from unittest.mock import MagicMock
+from app.comm.token_manager import TokenManager
+
+
+class TestTokenManager:
+
+    def test_unknown_expiry(self):
+        tm = TokenManager(60)
+        assert not tm.needs_refresh()
+
+    def test_needs_refresh_before_expiry(self):
+        tm = TokenManager(60)
+        tm.token_updated(3600)
+        assert not tm.needs_refresh()
+        tm.token_updated(30)
+        assert tm.needs_refresh()
+
+    def test_proactive_refresh(self):
+        tm = TokenManager(60)
+        tm.token_updated(30)
+        refresh_call = MagicMock(side_effect=lambda: tm.token_updated(3600))
+
+        tm.refresh(refresh_call)
+        tm.refresh(refresh_call)
+
+        assert refresh_call.call_count == 1
+        assert not tm.needs_refresh()
+
+    def test_refresh_after_401_skipped_when_already_refreshed(self):
+        tm = TokenManager(60)
+        seen = tm.generation
+        refresh_call = MagicMock(side_effect=lambda: tm.token_updated(3600))
+
+        tm.refresh(refresh_call, seen)
+        # second caller got its 401 with the same old token
+        tm.refresh(refresh_call, seen)
+
+        assert refresh_call.call_count == 1
+
+    def test_failed_refresh_resets_expiry(self):
+        tm = TokenManager(60)
+        tm.token_updated(30)
+        refresh_call = MagicMock()
+
+        tm.refresh(refresh_call)
+
+        assert refresh_call.call_count == 1
+        assert tm.expires_at is None
+        assert not tm.needs_refresh()
+
+    def test_single_flight(self):
+        tm = TokenManager(60)
+        seen = tm.generation
+        calls = []
+
+        def slow_refresh():
+            calls.append(1)
+            time.sleep(0.05)
+            tm.token_updated(3600)
+
+        threads = [
+            threading.Thread(target=tm.refresh, args=(slow_refresh, seen))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(calls) == 1
@@ -46,6 +46,7 @@ class TestUsers:
             tlres.id,
             'users',
             tlres.entry_to_json(),
+            users.content_hash(asdict(tlres)),
         )
 
     def test_upsert_results_many(self, users):
@@ -54,7 +55,7 @@ class TestUsers:
         # Create 2 mock users
         result_1 = TeamleaderEntryMock()
         result_1.attributes['name'] = 'user1'
-        result_2 = TeamleaderEntryMock()
+        result_2 = TeamleaderEntryMock(id=str(uuid.uuid4()))
         result_2.attributes['name'] = 'user2'
         # Prepare to pass
         results = [([asdict(result_1), asdict(result_2)], 'users')]
@@ -64,10 +65,10 @@ class TestUsers:
         val1 = users._prepare_vars_upsert(asdict(result_1), 'users')
         val2 = users._prepare_vars_upsert(asdict(result_2), 'users')
 
-        assert psql_wrapper_mock.executemany.call_count == 1
-        assert psql_wrapper_mock.executemany.call_args[0][0] == users.upsert_entities_sql(
-        )
-        assert psql_wrapper_mock.executemany.call_args[0][1] == [val1, val2]
+        assert psql_wrapper_mock.execute_values.call_count == 1
+        assert psql_wrapper_mock.execute_values.call_args[0][0] == users.upsert_entities_sql(
+            bulk=True)
+        assert psql_wrapper_mock.execute_values.call_args[0][1] == [val1, val2]
 
     def test_max_last_modified_timestamp(self, users):
         psql_wrapper_mock = users.postgresql_wrapper
@@ -0,0 +1,60 @@
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import patch
+from viaa.configuration import ConfigParser
+from app.models.webhook_queue import WebhookQueue
+
+
+class TestWebhookQueue:
+
+    @pytest.fixture
+    @patch('app.models.webhook_queue.PostgresqlWrapper')
+    def webhook_queue(self, postgresql_wrapper_mock):
+        config = ConfigParser()
+        db_conf = config.app_cfg['postgresql_teamleader']
+        table_names = config.app_cfg['table_names']
+        self.webhook_queue = WebhookQueue(db_conf, table_names)
+        return self.webhook_queue
+
+    def test_create_table(self, webhook_queue):
+        qry_executed = webhook_queue.postgresql_wrapper.execute.call_args[0][0]
+        assert 'CREATE TABLE IF NOT EXISTS tl_webhook_queue' in qry_executed
+        assert 'PRIMARY KEY (resource, tl_uuid)' in qry_executed
+
+    def test_enqueue_coalesces(self, webhook_queue):
+        webhook_queue.enqueue('contacts', 'uuid1', 'contact.updated')
+        qry, vars = webhook_queue.postgresql_wrapper.execute.call_args[0]
+        assert 'ON CONFLICT (resource, tl_uuid)' in qry
+        assert vars == ('contacts', 'uuid1', 'contact.updated', False)
+
+    def test_peek_and_ack(self, webhook_queue):
+        psql_wrapper_mock = webhook_queue.postgresql_wrapper
+        received = datetime(2021, 3, 29, tzinfo=timezone.utc)
+        psql_wrapper_mock.execute.return_value = [('contacts', 'uuid1', False, received)]
+
+        entries = webhook_queue.peek(10)
+        assert 'next_attempt_at <= clock_timestamp()' in psql_wrapper_mock.execute.call_args[0][0]
+        assert entries == [('contacts', 'uuid1', False, received)]
+        assert psql_wrapper_mock.execute.call_args[0][1] == (None, None, 10)
+
+        webhook_queue.ack(entries)
+        qry, vars_list = psql_wrapper_mock.executemany.call_args[0]
+        assert 'received_at = %s' in qry
+        assert vars_list == [('contacts', 'uuid1', received)]
+
+    def test_retry(self, webhook_queue):
+        psql_wrapper_mock = webhook_queue.postgresql_wrapper
+        received = datetime(2021, 3, 29, tzinfo=timezone.utc)
+
+        webhook_queue.retry([('contacts', 'uuid1', False, received)])
+        qry, vars_list = psql_wrapper_mock.executemany.call_args[0]
+        assert 'attempts = attempts + 1' in qry
+        assert vars_list == [(60, 3600, 'contacts', 'uuid1', received)]
+
+    def test_next_attempt_in(self, webhook_queue):
+        psql_wrapper_mock = webhook_queue.postgresql_wrapper
+        psql_wrapper_mock.execute.return_value = [(None,)]
+        assert webhook_queue.next_attempt_in() is None
+
+        psql_wrapper_mock.execute.return_value = [(-5.0,)]
+        assert webhook_queue.next_attempt_in() == 0.0
@@ -2,11 +2,19 @@
 # -*- coding: utf-8 -*-
 
 import pytest
-from unittest.mock import patch
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
 from psycopg2 import OperationalError as PSQLError
 from app.app import App
+from app.comm.teamleader_client import ListPage
+from app.models.sync_model import SyncModel
 
 
+@patch('app.app.WebhookQueue')
+@patch('app.app.SyncState')
 @patch('app.app.Users')
 @patch('app.app.Projects')
 @patch('app.app.Invoices')
@@ -25,7 +33,7 @@ class TestApp:
         sync_mock,
         teamleader_client_mock,
         tl_auth_mock, custom_fields_mock, contacts_mock, companies_mock, departments_mock,
-        events_mock, invoices_mock, projects_mock, users_mock
+        events_mock, invoices_mock, projects_mock, users_mock, sync_state_mock, webhook_queue_mock
     ):
         # Mock max_last_modified_timestamp to return None
         companies_mock().max_last_modified_timestamp.return_value = None
@@ -76,5 +84,670 @@ class TestApp:
         companies_mock = models_mock[2]
         companies_mock().max_last_modified_timestamp.side_effect = PSQLError
         app = App()
+        app.sync_state.read.return_value = None
         with pytest.raises(PSQLError):
             app.teamleader_sync()
+
+    def details_call(self, uid):
+        if uid == 'uuid2':
+            raise ValueError('connection reset')
+        if uid == 'uuid3':
+            return []
+        return {'id': uid}
+
+    def test_fetch_details_concurrent(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        resp = [{'id': f'uuid{i}'} for i in range(1, 11)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            detailed_list, failed_ids = app.fetch_details(
+                self.details_call, resp, executor)
+
+        # listing order is preserved and failures are reported per id
+        assert [d['id'] for d in detailed_list] == [
+            f'uuid{i}' for i in range(1, 11) if i not in (2, 3)
+        ]
+        assert failed_ids == ['uuid2', 'uuid3']
+
+    def test_resource_sync_detail_workers(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.detail_workers = 4
+        model = MagicMock()
+        model.name = 'contacts'
+        model.max_last_modified_timestamp.return_value = None
+        model.upsert_results.return_value = {'inserted': 1, 'updated': 1, 'unchanged': 0}
+        pages = [[{'id': 'uuid1'}, {'id': 'uuid2'}, {'id': 'uuid4'}], []]
+        list_call = MagicMock(side_effect=pages)
+
+        result = app.resource_sync(list_call, self.details_call, model)
+
+        assert model.upsert_results.call_count == 1
+        upserted = model.upsert_results.call_args[0][0]
+        assert upserted == [([{'id': 'uuid1'}, {'id': 'uuid4'}], 'contacts')]
+        assert result == {
+            'synced': 2, 'skipped': 0, 'failed_ids': ['uuid2'],
+            'inserted': 1, 'updated': 1, 'unchanged': 0
+        }
+
+    async def details_call_async(self, uid):
+        return self.details_call(uid)
+
+    def test_resource_sync_async(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.shadow_full_sync = False
+        model = MagicMock()
+        model.name = 'contacts'
+        model.max_last_modified_timestamp.return_value = None
+        model.upsert_results.return_value = {'inserted': 1, 'updated': 1, 'unchanged': 0}
+        pages = [[{'id': 'uuid1'}, {'id': 'uuid2'}, {'id': 'uuid4'}], []]
+
+        async def list_call(page, page_size, modified_since):
+            return pages[page - 1]
+
+        result = asyncio.run(
+            app.resource_sync_async(list_call, self.details_call_async, model, full_sync=True)
+        )
+
+        assert model.truncate_table.call_count == 1
+        upserted = model.upsert_results.call_args[0][0]
+        assert upserted == [([{'id': 'uuid1'}, {'id': 'uuid4'}], 'contacts')]
+        assert result == {
+            'synced': 2, 'skipped': 0, 'failed_ids': ['uuid2'],
+            'inserted': 1, 'updated': 1, 'unchanged': 0
+        }
+
+    def test_resource_sync_list_only(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.list_only = ['contacts']
+        model = MagicMock()
+        model.name = 'contacts'
+        model.max_last_modified_timestamp.return_value = None
+        model.upsert_results.return_value = {'inserted': 0, 'updated': 0, 'unchanged': 1}
+        page_data = [{'id': 'uuid1', 'custom_fields': []}]
+        list_call = MagicMock(side_effect=[page_data, []])
+        details_call = MagicMock()
+
+        result = app.resource_sync(list_call, details_call, model)
+
+        assert details_call.call_count == 0
+        assert list_call.call_args[1]['includes'] == 'custom_fields'
+        assert model.upsert_results.call_args[0][0] == [(page_data, 'contacts')]
+        assert result == {
+            'synced': 1, 'skipped': 0, 'failed_ids': [],
+            'inserted': 0, 'updated': 0, 'unchanged': 1
+        }
+
+    def test_resource_sync_list_only_fallback(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.list_only = ['invoices']
+        model = MagicMock()
+        model.name = 'invoices'
+        model.max_last_modified_timestamp.return_value = None
+        list_call = MagicMock(side_effect=[[{'id': 'uuid1'}], []])
+
+        app.resource_sync(list_call, self.details_call, model)
+
+        # invoices.list has no includes, details call is still used
+        assert 'includes' not in list_call.call_args[1]
+        assert model.upsert_results.call_args[0][0] == [([{'id': 'uuid1'}], 'invoices')]
+
+    def test_resource_sync_skip_unchanged(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        model = MagicMock()
+        model.name = 'users'
+        model.max_last_modified_timestamp.return_value = None
+        model.list_version.side_effect = SyncModel.list_version
+        listed = [
+            {'id': 'uuid1', 'updated_at': '2021-03-29T16:44:33+00:00'},
+            {'id': 'uuid4', 'updated_at': '2021-04-01T10:00:00+00:00'},
+            {'id': 'uuid5', 'name': 'no updated_at'},
+        ]
+        model.stored_list_versions.return_value = {
+            'uuid1': '2021-03-29T16:44:33+00:00',
+            'uuid4': '2021-03-01T10:00:00+00:00',
+            'uuid5': SyncModel.list_version({'id': 'uuid5', 'name': 'no updated_at'}),
+        }
+        model.upsert_results.return_value = {'inserted': 0, 'updated': 1, 'unchanged': 0}
+        list_call = MagicMock(side_effect=[listed, []])
+        details_call = MagicMock(side_effect=self.details_call)
+
+        result = app.resource_sync(list_call, details_call, model)
+
+        # only uuid4 changed since the last sync
+        assert details_call.call_count == 1
+        assert details_call.call_args[0][0] == 'uuid4'
+        upserted, versions = model.upsert_results.call_args[0]
+        assert upserted == [([{'id': 'uuid4'}], 'users')]
+        assert versions['uuid4'] == '2021-04-01T10:00:00+00:00'
+        assert result == {
+            'synced': 1, 'skipped': 2, 'failed_ids': [],
+            'inserted': 0, 'updated': 1, 'unchanged': 0
+        }
+
+    def test_list_pages_prefetch(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        pages = [[{'id': 'uuid1'}], [{'id': 'uuid2'}], [{'id': 'uuid3'}], []]
+        list_call = MagicMock(side_effect=lambda page, size, since: pages[page - 1])
+
+        for lookahead in (0, 1, 2):
+            list_call.reset_mock()
+            assert list(app.list_pages(list_call, None, lookahead)) == pages[:3]
+            # never more than lookahead pages past the empty page are requested
+            assert list_call.call_count <= 4 + max(0, lookahead - 1)
+
+    def test_resource_sync_pipelined_write_order(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.pipeline_lookahead = 2
+        app.write_batch_records = 3
+        model = MagicMock()
+        model.name = 'contacts'
+        model.max_last_modified_timestamp.return_value = None
+        pages = [[{'id': f'uuid{p}{i}'} for i in range(3)] for p in (1, 4, 5, 6)] + [[]]
+        list_call = MagicMock(side_effect=lambda page, size, since: pages[page - 1])
+
+        result = app.resource_sync(list_call, self.details_call, model)
+
+        written = [
+            call[0][0][0][0][0]['id'] for call in model.upsert_results.call_args_list
+        ]
+        assert written == ['uuid10', 'uuid40', 'uuid50', 'uuid60']
+        assert result['synced'] == 12
+
+    def test_resource_sync_write_batches(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.write_batch_records = 5
+        model = MagicMock()
+        model.name = 'contacts'
+        model.max_last_modified_timestamp.return_value = None
+        model.upsert_results.return_value = {'inserted': 1, 'updated': 0, 'unchanged': 0}
+        pages = [[{'id': f'uuid{p}{i}'} for i in range(3)] for p in (1, 4, 5)] + [[]]
+        list_call = MagicMock(side_effect=lambda page, size, since: pages[page - 1])
+
+        result = app.resource_sync(list_call, self.details_call, model)
+
+        # pages are gathered until 5 records are buffered, the rest is flushed at the end
+        batches = [len(call[0][0][0][0]) for call in model.upsert_results.call_args_list]
+        assert batches == [6, 3]
+        assert [call[0][1] for call in app.sync_state.checkpoint.call_args_list] == [2, 3]
+        assert result['synced'] == 9
+        assert result['inserted'] == 2
+
+    def paginated_list_call(self, page, page_size, modified_since, includes=None):
+        self.list_requests.append((page, includes))
+        data = [{'id': f'uuid{page}_{i}'} for i in range(page_size)]
+        if page == 3:
+            data = data[:50]
+        if page > 3:
+            data = []
+        if includes and 'pagination' in includes:
+            return ListPage(data, 250)
+        return data
+
+    def test_list_pages_fan_out(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.list_workers = 3
+        self.list_requests = []
+
+        pages = list(app.list_pages(self.paginated_list_call, None, 1, 'custom_fields'))
+
+        assert [len(p) for p in pages] == [100, 100, 50]
+        assert [p[0]['id'] for p in pages] == ['uuid1_0', 'uuid2_0', 'uuid3_0']
+        # only the first call asks for pagination and no empty trailing page is requested
+        assert sorted(self.list_requests) == [
+            (1, 'custom_fields,pagination'),
+            (2, 'custom_fields'),
+            (3, 'custom_fields')
+        ]
+
+    def test_list_pages_fan_out_without_matches(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.list_workers = 3
+        pages = [[{'id': 'uuid1'}], []]
+        list_call = MagicMock(side_effect=lambda page, size, since, includes=None: pages[page - 1])
+
+        assert list(app.list_pages(list_call, None, 1)) == [[{'id': 'uuid1'}]]
+        assert list_call.call_count == 2
+
+    def test_sync_watermark_overlap(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.watermark_overlap = 120
+        model = MagicMock()
+        last_modified = datetime(2021, 3, 29, 16, 44, 33, tzinfo=timezone.utc)
+        model.max_last_modified_timestamp.return_value = last_modified
+        app.sync_state.read.return_value = None
+        assert app.sync_watermark(model) == last_modified - timedelta(seconds=120)
+
+        # capped at the start of the last completed sync
+        started = last_modified - timedelta(hours=1)
+        app.sync_state.read.return_value = {'watermark_cap': started}
+        assert app.sync_watermark(model) == started - timedelta(seconds=120)
+        app.sync_state.read.return_value = {'watermark_cap': last_modified + timedelta(hours=1)}
+        assert app.sync_watermark(model) == last_modified - timedelta(seconds=120)
+
+        model.max_last_modified_timestamp.return_value = None
+        assert app.sync_watermark(model) is None
+
+    def test_teamleader_sync_concurrent(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.resource_workers = 8
+        app.resource_priority = ['contacts', 'invoices']
+        names = [name for name, _ in app.resource_syncs()]
+        assert names[:3] == ['contacts', 'invoices', 'companies']
+        assert len(names) == 8
+
+        def sync_result(full_sync, resume):
+            return {'synced': 2, 'skipped': 1, 'failed_ids': ['uuid1']}
+
+        sync_names = [f'{name}_sync' for name in names]
+        with patch.multiple(App, **{name: MagicMock(side_effect=sync_result) for name in sync_names}):
+            report = app.teamleader_sync(full_sync=True)
+
+        assert report['full_sync'] is True
+        assert sorted(report['resources'].keys()) == sorted(names)
+        assert report['synced'] == 16
+        assert report['skipped'] == 8
+        assert report['failed_ids'] == 8
+
+    def test_teamleader_sync_concurrent_error(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.resource_workers = 4
+        result = {'synced': 1, 'skipped': 0, 'failed_ids': []}
+        with patch.object(App, 'companies_sync', side_effect=PSQLError('gone')), \
+                patch.multiple(App,
+                               contacts_sync=MagicMock(return_value=result),
+                               custom_fields_sync=MagicMock(return_value=result),
+                               departments_sync=MagicMock(return_value=result),
+                               events_sync=MagicMock(return_value=result),
+                               invoices_sync=MagicMock(return_value=result),
+                               projects_sync=MagicMock(return_value=result),
+                               users_sync=MagicMock(return_value=result)):
+            with pytest.raises(PSQLError):
+                app.teamleader_sync()
+
+            # the other resources still ran
+            assert App.users_sync.call_count == 1
+
+    def test_resource_detail_workers_weight(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.detail_workers = 2
+        app.resource_weights = {'contacts': 4, 'users': 0.1}
+        model = MagicMock()
+        model.name = 'contacts'
+        assert app.resource_detail_workers(model) == 8
+        model.name = 'users'
+        assert app.resource_detail_workers(model) == 1
+        model.name = 'events'
+        assert app.resource_detail_workers(model) == 2
+
+    def test_resource_sync_checkpoint_resume(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.write_batch_records = 1
+        model = MagicMock()
+        model.name = 'contacts'
+        shadow = model.shadow_model.return_value
+        shadow.name = 'contacts'
+        watermark = datetime(2021, 3, 29, 16, 44, 33, tzinfo=timezone.utc)
+        app.sync_state.resumable.return_value = {
+            'full_sync': True, 'watermark': watermark, 'last_page': 2,
+            'last_ids': ['uuid20', 'uuid21', 'uuid22'], 'status': 'running'
+        }
+        pages = [[{'id': f'uuid{p}{i}'} for i in range(3)] for p in range(1, 5)] + [[]]
+        list_call = MagicMock(side_effect=lambda page, size, since: pages[page - 1])
+
+        result = app.resource_sync(list_call, self.details_call, model, full_sync=True, resume=True)
+
+        # the checkpointed page is unchanged, resumed after it in the existing shadow table
+        model.create_shadow_table.assert_not_called()
+        app.sync_state.start.assert_not_called()
+        assert shadow.upsert_results.call_count == 2
+        model.upsert_results.assert_not_called()
+        model.swap_shadow_table.assert_called_once()
+        assert [call[0][0] for call in list_call.call_args_list] == [2, 3, 4, 5]
+        assert all(call[0][2] == watermark for call in list_call.call_args_list)
+        assert [call[0][1] for call in app.sync_state.checkpoint.call_args_list] == [3, 4]
+        app.sync_state.checkpoint.assert_called_with('contacts', 4, ['uuid40', 'uuid41', 'uuid42'])
+        app.sync_state.finish.assert_called_once_with('contacts')
+        assert result['synced'] == 6
+
+    def test_resource_sync_resume_shifted_page(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.pipeline_lookahead = 0
+        model = MagicMock()
+        model.name = 'contacts'
+        watermark = datetime(2021, 3, 29, 16, 44, 33, tzinfo=timezone.utc)
+        app.sync_state.resumable.return_value = {
+            'full_sync': False, 'watermark': watermark, 'last_page': 1,
+            'last_ids': ['uuid5', 'uuid6', 'uuid7'], 'status': 'failed'
+        }
+        # uuid5 was removed, uuid8 moved from page 2 to page 1
+        pages = [[{'id': 'uuid6'}, {'id': 'uuid7'}, {'id': 'uuid8'}], [{'id': 'uuid9'}], []]
+        list_call = MagicMock(side_effect=lambda page, size, since: pages[page - 1])
+
+        result = app.resource_sync(list_call, self.details_call, model, resume=True)
+
+        # continued one page early, so uuid8 is not skipped
+        assert [call[0][0] for call in list_call.call_args_list] == [1, 1, 2, 3]
+        app.sync_state.start.assert_not_called()
+        assert [call[0][1] for call in app.sync_state.checkpoint.call_args_list] == [1, 2]
+        assert result['synced'] == 4
+
+    def test_resource_sync_resume_starts_over(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.pipeline_lookahead = 0
+        app.shadow_full_sync = False
+        model = MagicMock()
+        model.name = 'contacts'
+        app.sync_state.resumable.return_value = {
+            'full_sync': True, 'watermark': None, 'last_page': 1,
+            'last_ids': ['uuid0'], 'status': 'failed'
+        }
+        pages = [[{'id': 'uuid1'}], []]
+        list_call = MagicMock(side_effect=lambda page, size, since: pages[page - 1])
+
+        app.resource_sync(list_call, self.details_call, model, resume=True)
+
+        # none of the checkpointed ids are left, the full sync starts over
+        model.truncate_table.assert_called_once()
+        app.sync_state.start.assert_called_once_with('contacts', True, None)
+        assert [call[0][0] for call in list_call.call_args_list] == [1, 1, 2]
+
+    def test_resource_sync_failure_keeps_checkpoint(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.shadow_full_sync = False
+        model = MagicMock()
+        model.name = 'contacts'
+        model.max_last_modified_timestamp.return_value = None
+        list_call = MagicMock(side_effect=[[{'id': 'uuid1'}], ValueError('token failure')])
+
+        with pytest.raises(ValueError):
+            app.resource_sync(list_call, self.details_call, model, full_sync=True)
+
+        model.truncate_table.assert_called_once()
+        app.sync_state.start.assert_called_once_with('contacts', True, None)
+        app.sync_state.checkpoint.assert_called_once_with('contacts', 1, ['uuid1'])
+        app.sync_state.finish.assert_called_once_with('contacts', 'failed')
+
+    def test_resource_sync_shadow_table(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        model = MagicMock()
+        model.name = 'contacts'
+        shadow = model.shadow_model.return_value
+        shadow.name = 'contacts'
+        shadow.max_last_modified_timestamp.return_value = None
+        list_call = MagicMock(side_effect=[[{'id': 'uuid1'}], []])
+
+        result = app.resource_sync(list_call, self.details_call, model, full_sync=True)
+
+        # loaded into the shadow table and swapped in, the table is never truncated
+        model.truncate_table.assert_not_called()
+        model.create_shadow_table.assert_called_once()
+        model.upsert_results.assert_not_called()
+        assert shadow.upsert_results.call_count == 1
+        model.swap_shadow_table.assert_called_once()
+        assert result['synced'] == 1
+
+    def test_resource_sync_shadow_table_failure(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        model = MagicMock()
+        model.name = 'contacts'
+        model.shadow_model.return_value.name = 'contacts'
+        list_call = MagicMock(side_effect=ValueError('token failure'))
+
+        with pytest.raises(ValueError):
+            app.resource_sync(list_call, self.details_call, model, full_sync=True)
+
+        # the old data stays in place
+        model.swap_shadow_table.assert_not_called()
+        model.truncate_table.assert_not_called()
+
+    def test_resource_reconcile(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        model = MagicMock()
+        model.name = 'invoices'
+        model.stored_uuids.return_value = iter([['uuid1', 'uuid2', 'uuid3'], ['uuid4', 'uuid5']])
+        model.delete_uuids.side_effect = lambda uuids, soft_delete: len(uuids)
+        list_call = MagicMock(side_effect=[[{'id': 'uuid1'}, {'id': 'uuid3'}], [{'id': 'uuid5'}], []])
+
+        result = app.resource_reconcile(list_call, model, soft_delete=True)
+
+        assert result == {'listed': 3, 'deleted': 2}
+        deleted = [call[0] for call in model.delete_uuids.call_args_list]
+        assert deleted == [(['uuid2'], True), (['uuid4'], True)]
+        # only list calls are used, without a watermark
+        assert all(call[0][2] is None for call in list_call.call_args_list)
+
+    def test_resource_reconcile_empty_list(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        model = MagicMock()
+        model.name = 'invoices'
+        list_call = MagicMock(side_effect=[[]])
+
+        result = app.resource_reconcile(list_call, model)
+
+        assert result == {'listed': 0, 'deleted': 0}
+        model.stored_uuids.assert_not_called()
+        model.delete_uuids.assert_not_called()
+
+    def test_drain_webhook_queue(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        received = datetime(2021, 3, 29, tzinfo=timezone.utc)
+        batch = [
+            ('contacts', 'uuid1', False, received),
+            ('contacts', 'uuid2', False, received),
+            ('contacts', 'uuid3', True, received),
+            ('invoices', 'uuid4', False, received),
+        ]
+        app.webhook_queue.peek.side_effect = [batch, []]
+        app.contacts.delete_uuids.return_value = 1
+        app.invoices.delete_uuids.return_value = 0
+        app.tlc.get_contact.side_effect = self.details_call
+        app.tlc.get_invoice.side_effect = self.details_call
+
+        result = app.drain_webhook_queue()
+
+        assert result == {'synced': 2, 'deleted': 1, 'failed_ids': ['uuid2']}
+        app.contacts.delete_uuids.assert_called_once_with(['uuid3'], False)
+        assert app.contacts.upsert_results.call_args[0][0] == [([{'id': 'uuid1'}], app.contacts.name)]
+        assert app.invoices.upsert_results.call_args[0][0] == [([{'id': 'uuid4'}], app.invoices.name)]
+        # the entry of the failed details call stays queued for a retry
+        app.webhook_queue.ack.assert_called_once_with(
+            [batch[0], batch[2], batch[3]])
+        app.webhook_queue.retry.assert_called_once_with([batch[1]])
+
+    def test_drain_webhook_queue_list_only(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.contacts.name = 'contacts'
+        app.list_only = ['contacts']
+        received = datetime(2021, 3, 29, tzinfo=timezone.utc)
+        batch = [('contacts', 'uuid1', False, received)]
+        app.webhook_queue.peek.side_effect = [batch, []]
+        app.tlc.list_contacts_by_ids.return_value = [{'id': 'uuid1', 'custom_fields': []}]
+
+        result = app.drain_webhook_queue()
+
+        assert result == {'synced': 1, 'deleted': 0, 'failed_ids': []}
+        app.tlc.list_contacts_by_ids.assert_called_once_with(['uuid1'], includes='custom_fields')
+        app.tlc.get_contact.assert_not_called()
+        assert app.contacts.upsert_results.call_args[0][0] == [
+            ([{'id': 'uuid1', 'custom_fields': []}], 'contacts')]
+        app.webhook_queue.ack.assert_called_once_with(batch)
+
+    def test_webhook_event(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        assert app.webhook_event('company.deleted', 'company', 'uuid1') == 'companies'
+        app.webhook_queue.enqueue.assert_called_once_with('companies', 'uuid1', 'company.deleted', True)
+        assert app.webhook_event('meeting.created', 'meeting', 'uuid2') is None
+        assert app.webhook_queue.enqueue.call_count == 1
+
+    def test_ids_sync(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.detail_workers = 1
+        app.tlc.get_invoice.side_effect = self.details_call
+        app.invoices.upsert_results.return_value = {'inserted': 1, 'updated': 1, 'unchanged': 0}
+
+        result = app.ids_sync('invoices', ['uuid1', 'uuid2', 'uuid4', 'uuid1'])
+
+        assert result['requested'] == 3
+        assert result['synced'] == 2
+        assert result['failed_ids'] == ['uuid2']
+        assert result['inserted'] == 1 and result['updated'] == 1
+        app.invoices.upsert_results.assert_called_once_with(
+            [([{'id': 'uuid1'}, {'id': 'uuid4'}], app.invoices.name)])
+
+    def test_ids_sync_list_only(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.contacts.name = 'contacts'
+        app.list_only = ['contacts']
+        app.contacts.upsert_results.return_value = {'inserted': 0, 'updated': 1, 'unchanged': 0}
+        app.tlc.list_contacts_by_ids.return_value = [{'id': 'uuid1', 'custom_fields': []}]
+
+        result = app.ids_sync('contacts', ['uuid1', 'uuid2'])
+
+        assert result['synced'] == 1
+        assert result['failed_ids'] == ['uuid2']
+        app.tlc.list_contacts_by_ids.assert_called_once_with(
+            ['uuid1', 'uuid2'], includes='custom_fields')
+        app.tlc.get_contact.assert_not_called()
+
+    def test_ids_sync_waits_for_resource_lock(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        app.detail_workers = 1
+        app.tlc.get_invoice.side_effect = self.details_call
+        app.invoices.upsert_results.return_value = {'inserted': 0, 'updated': 1, 'unchanged': 0}
+
+        with app.resource_lock('invoices'):
+            assert app.resource_busy('invoices')
+            refresh = threading.Thread(target=app.ids_sync, args=('invoices', ['uuid1']))
+            refresh.start()
+            refresh.join(0.2)
+            # waits for the running sync of the same resource
+            assert refresh.is_alive()
+            app.invoices.upsert_results.assert_not_called()
+
+        refresh.join()
+        app.invoices.upsert_results.assert_called_once()
+        assert not app.resource_busy('invoices')
+
+    def test_ids_sync_unknown_resource(
+        self,
+        teamleader_client_mock,
+        *models_mock
+    ):
+        app = App()
+        with pytest.raises(ValueError):
+            app.ids_sync('meetings', ['uuid1'])
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+import time
+from app.sync_pipeline import SyncPipeline
+
+
+class TestSyncPipeline:
+
+    def pages(self, count, size=2):
+        return [(p, [{'id': f'uuid{p}_{i}'} for i in range(size)]) for p in range(1, count + 1)]
+
+    @staticmethod
+    def fetch(resp):
+        return resp, {res['id']: 'v1' for res in resp}
+
+    def run(self, pipeline, pages, fetch=None):
+        self.batches = []
+        pipeline.run(
+            iter(pages),
+            fetch or self.fetch,
+            lambda records, versions, page: self.batches.append((len(records), len(versions), page))
+        )
+        return self.batches
+
+    def test_flush_by_records(self):
+        pipeline = SyncPipeline(queue_size=1, batch_records=4, batch_seconds=60)
+        assert self.run(pipeline, self.pages(5)) == [(4, 4, 2), (4, 4, 4), (2, 2, 5)]
+
+    def test_flush_by_bytes(self):
+        pipeline = SyncPipeline(batch_records=1000, batch_bytes=1, batch_seconds=60)
+        assert self.run(pipeline, self.pages(3)) == [(2, 2, 1), (2, 2, 2), (2, 2, 3)]
+
+    def test_flush_by_time(self):
+        pipeline = SyncPipeline(batch_records=1000, batch_seconds=0.05)
+
+        def slow_fetch(resp):
+            time.sleep(0.2)
+            return self.fetch(resp)
+
+        # each page waits longer than batch_seconds for the next one
+        assert self.run(pipeline, self.pages(3), slow_fetch) == [(2, 2, 1), (2, 2, 2), (2, 2, 3)]
+
+    def test_list_error_writes_fetched_pages(self):
+        pipeline = SyncPipeline(batch_records=1000, batch_seconds=60)
+
+        def failing_pages():
+            yield 1, [{'id': 'uuid1'}]
+            raise ValueError('token failure')
+
+        with pytest.raises(ValueError):
+            self.run(pipeline, failing_pages())
+
+        assert self.batches == [(1, 1, 1)]
+
+    def test_write_error_stops_pipeline(self):
+        pipeline = SyncPipeline(queue_size=1, batch_records=1, batch_seconds=60)
+        fetched = []
+
+        def fetch(resp):
+            fetched.append(resp)
+            return self.fetch(resp)
+
+        def write(records, versions, page):
+            raise ValueError('database gone')
+
+        with pytest.raises(ValueError):
+            pipeline.run(iter(self.pages(100)), fetch, write)
+
+        # the listing and details stop soon after the write failed
+        assert len(fetched) < 10
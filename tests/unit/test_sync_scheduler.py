@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from unittest.mock import MagicMock
+from app.sync_scheduler import SyncScheduler
+
+
+class TestSyncScheduler:
+
+    def scheduler(self, busy=None):
+        self.contacts_sync = MagicMock(return_value={'inserted': 2, 'updated': 3})
+        self.departments_sync = MagicMock(return_value={'inserted': 0, 'updated': 0})
+        return SyncScheduler(
+            [('contacts', self.contacts_sync), ('departments', self.departments_sync)],
+            {
+                'interval': 1000,
+                'intervals': {'departments': 100000},
+                'min_interval': 300,
+                'max_interval': 7200,
+                'jitter': 0.1
+            },
+            busy=busy
+        )
+
+    def test_initial_intervals(self):
+        scheduler = self.scheduler()
+        assert scheduler.resources['contacts']['interval'] == 1000
+        # clamped to max_interval
+        assert scheduler.resources['departments']['interval'] == 7200
+        next_run = scheduler.resources['contacts']['next_run'] - time.monotonic()
+        assert 890 < next_run <= 1100
+
+    def test_adaptive_interval(self):
+        scheduler = self.scheduler()
+        scheduler.run_resource('contacts')
+        scheduler.run_resource('departments')
+
+        # changes found: run more often, nothing changed: less often
+        assert scheduler.resources['contacts']['interval'] == 500
+        assert scheduler.resources['contacts']['last_changes'] == 5
+        assert scheduler.resources['departments']['interval'] == 7200
+        self.contacts_sync.assert_called_once_with(False)
+
+        scheduler.run_resource('contacts')
+        assert scheduler.resources['contacts']['interval'] == 300
+
+    def test_due_resources_skips_running(self):
+        scheduler = self.scheduler()
+        now = time.monotonic() + 8000
+        assert scheduler.due_resources(now) == ['contacts', 'departments']
+        # both are marked running now, so they are not started twice
+        assert scheduler.due_resources(now) == []
+
+    def test_due_resources_busy(self):
+        scheduler = self.scheduler(busy=lambda: True)
+        assert scheduler.due_resources(time.monotonic() + 8000) == []
+
+    def test_due_resources_resource_busy(self):
+        scheduler = self.scheduler()
+        scheduler.resource_busy = lambda name: name == 'contacts'
+        # contacts is synced by someone else, it is started once that is done
+        assert scheduler.due_resources(time.monotonic() + 8000) == ['departments']
+        assert not scheduler.resources['contacts']['running']
+
+    def test_failed_run_keeps_interval(self):
+        scheduler = self.scheduler()
+        self.contacts_sync.side_effect = ValueError('token failure')
+        scheduler.run_resource('contacts')
+
+        contacts = scheduler.resources['contacts']
+        assert contacts['interval'] == 1000
+        assert contacts['last_error'] == 'token failure'
+        assert not contacts['running']
+
+    def test_status(self):
+        scheduler = self.scheduler()
+        status = scheduler.status()
+        assert status['enabled'] is False
+        contacts = status['resources']['contacts']
+        assert contacts['interval'] == 1000
+        assert contacts['next_run'] is not None
+        assert contacts['last_run'] is None
+
+    def test_start_stop(self):
+        scheduler = self.scheduler()
+        scheduler.start()
+        assert scheduler.status()['enabled'] is True
+        scheduler.stop()
+        assert scheduler.status()['enabled'] is False